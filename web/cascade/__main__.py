@@ -7,10 +7,14 @@ use.
 
 USAGE = (
 """Usage:
-    cascade [-dgp] check <requirements.docx>
+    cascade [-dgp] [--no-cache] [--no-index] [--jobs N] check <requirements.docx>...
     cascade [-dgp] annotate <requirements.docx>
     cascade [-dgp] annotate-reset <requirements.docx>
-    cascade [-dgplw] http
+    cascade [-dgp] id-owner <object_id>
+    cascade [-dgp] id-collisions
+    cascade [-dgp] id-forget (--missing | <document>...)
+    cascade [-dgp] [--no-cache] [--no-index] [--jobs N] [--format FORMATS] aggregate <requirements.zip>
+    cascade [-dgplw] [--no-cache] [--no-index] [--workers N] [--threads N] [--max-requests N] http
     cascade -h | --help
     cascade --version
 """)
@@ -32,6 +36,21 @@ Options:
   -p          When launching debugger, try to use pudb
   -l          Host http locally (127.0.0.1)
   -w          Enable privacy warning
+  --no-cache  Don't use (or update) the cache of parsed (and aggregated) documents,
+              or the object ID index
+  --no-index  Don't record checked documents in the object ID index
+              (index/object_ids.sqlite), used by id-owner and id-collisions
+  --missing   Forget every indexed document whose file no longer exists
+  --jobs N    Number of worker processes used to check multiple documents, or
+              to extract the documents of an aggregate zip (0 means one per
+              CPU).  By default check uses 1 and aggregate one per CPU.
+  --format FORMATS  Aggregate output formats: a comma separated list of
+              xlsx, csv, jsonl and parquet [default: xlsx]
+  --workers N  Serve http with gunicorn, using N worker processes (0 means one
+              per CPU), rather than with the development server
+  --threads N  Threads per http worker process [default: 4]
+  --max-requests N  Gracefully restart each http worker process after it has
+              handled about N requests (0 means never) [default: 1000]
  """)
 
 # Standard library
@@ -59,6 +78,10 @@ if '--develop' in sys.argv:
     developer_usage = '\n'.join([line for line in DEVELOPER_USAGE.split('\n') if line.strip()])
     USAGE += developer_usage
 arguments = docopt(USAGE + '\n' + OPTIONS, version=__version__)
+if not arguments['check'] and arguments['<requirements.docx>']:
+    # Only check accepts multiple documents, but docopt makes the argument a list
+    # for every command
+    arguments['<requirements.docx>'] = arguments['<requirements.docx>'][0]
 
 # Start quicklog logging
 qlog = Quicklog(
@@ -75,6 +98,9 @@ qlog.begin('Cascade, Version {}'.format(__version__))
 #---------------------------------------------------------------------
 from cascade.main import main
 from cascade.util_eliot import rotating_logfile
+from cascade import parse_cache
+from cascade import object_id_index
+from cascade import aggregate_manifest
 #---------------------------------------------------------------------
 
 # Start eliot logging
@@ -87,17 +113,46 @@ Message.log(
     arguments=arguments,
     version=__version__)
 
+# Cache parsed documents (keyed by document content) across runs
+parse_cache.configure(
+    os.path.join('cache', 'parse'),
+    enabled=not arguments['--no-cache'])
+
+# Reuse what aggregate extracted from documents which are unchanged since the
+# last aggregate
+aggregate_manifest.configure(
+    os.path.join('cache', 'aggregate'),
+    enabled=not arguments['--no-cache'])
+
+# Index the object IDs of checked documents (for id-owner, id-collisions, etc.)
+object_id_index.configure(
+    os.path.join('index', 'object_ids.sqlite'),
+    enabled=not (arguments['--no-index'] or arguments['--no-cache']))
+
 if arguments['-w']:
     print('Privacy warning enabled.')
 
+# Process exit code. Set (to 1) only when check (or id-owner/id-collisions/id-forget/aggregate)
+# fails, so that e.g. pre-commit hooks can run check.
+exit_code = 0
+sets_exit_code = (
+    arguments['check'] or arguments['id-owner'] or arguments['id-collisions'] or arguments['id-forget'] or
+    arguments['aggregate'])
+
 try:
-    main(arguments)
+    result = main(arguments)
+    if sets_exit_code and not result:
+        exit_code = 1
 except FatalUserError as e:
     # "Normal" user errors which cause application to halt
     qlog.error(str(e))
+    if sets_exit_code:
+        exit_code = 1
 except Exception as e:
     # Unexpected exceptions (i.e. application crashes)
     qlog.fatal_exception(e)
+    if sets_exit_code:
+        exit_code = 1
     if arguments['-g']:
         #Launch postmortem debugger
         print('Launching postmortem debugger...')
@@ -133,5 +188,6 @@ except Exception as e:
 
 qlog.show_counters() # Show WARNING/ERROR/CRITICAL counts (if nonzero)
 qlog.end()
-Message.log(message_type="exit")
+Message.log(message_type="exit", exit_code=exit_code)
 eliot_handler.close()
+sys.exit(exit_code)
@@ -0,0 +1,34 @@
+'''Manifest of the documents extracted by aggregate, for incremental re-aggregation
+
+aggregate checks every document in its zip and extracts its directives.  When a
+zip is submitted again, most of its documents are usually unchanged, so the
+manifest maps each document's content (the SHA-256 of its .docx bytes) to what
+was extracted from it:
+
+    directives:     The document's directives (a list of dicts), as exported
+    check_result:   The document's cmd_check.CheckResult
+
+A document is only added to the manifest if it passed check with no warnings or
+errors, so that reusing an entry never hides a message a full run would log.
+Entries are keyed by the Cascade version too, and the manifest is bounded in size
+(least recently used entries are evicted); it is stored exactly like the parse
+cache (see parse_cache.py).
+
+The manifest is disabled unless configure() is called (which __main__ does, unless
+the --no-cache option is given).
+'''
+
+# Local
+from cascade.parse_cache import ParseCache, DEFAULT_MAX_BYTES
+
+# The manifest in use (None if disabled). Set by configure().
+_manifest = None
+
+def configure(directory, max_bytes=DEFAULT_MAX_BYTES, enabled=True):
+    '''Configure (or disable) the manifest used by aggregate'''
+    global _manifest
+    _manifest = ParseCache(directory, max_bytes) if enabled else None
+
+def get_manifest():
+    '''Return the configured manifest (a ParseCache of entries), or None if it is disabled'''
+    return _manifest
@@ -4,34 +4,45 @@
 
 # Standard library
 import os
+import io
 import zipfile
 import tempfile
 import shutil
 import json
 
 # Libraries
-from openpyxl import Workbook
-from openpyxl.styles import Alignment, Border, Side, PatternFill, Color
-from openpyxl.utils import get_column_letter
 
 # Local
 from cascade import cmd_check
+from cascade import parse_cache
+from cascade import aggregate_manifest
+from cascade.exporters import EXPORTERS, parse_formats
+from cascade import object_id_index
+from cascade.cmd_object_ids import report_collisions
+from cascade.worker_pool import run_jobs, resolve_jobs
 from cascade.word_docx import WordDocx
+from cascade.util import input_file_name, input_file_exists, open_input_file
 from cascade import quicklog
 from cascade.util_eliot import log_function
 
 qlog = quicklog.get_logger()
 lprint = qlog.lprint
 
-MAX_XLSX_COL_WIDTH = 50
+# Folders of a zip which are ignored (e.g. the resource forks added by macOS)
+ZIP_IGNORED_FOLDERS = ('__MACOSX/',)
 
 @log_function
 def aggregate(arguments):
     """Create aggregation summary from multiple requirements documents
 
-    * Receive a zip containing multiple requirements docs
-    * Parse all to JSON
-    * Create an output summary spreadsheet (.xlsx)
+    * Receive a zip containing multiple requirements docs ('<requirements.zip>', a
+      filename or an InputFile)
+    * Check and parse all to JSON (in parallel, by up to '--jobs' worker
+      processes; one per CPU by default).  Documents which are unchanged since
+      they were last aggregated are reused from the manifest (see
+      aggregate_manifest.py) rather than parsed again.
+    * Create an output summary, in each format given by '--format' (a comma
+      separated list of xlsx, csv, jsonl and parquet; xlsx by default)
         * Aggregate each requirement into a row
         * Columnize the enumerated type (“allocatedTo”) field into multiple columns
             * Make each a filterable checkbox (“X”) list
@@ -41,38 +52,35 @@ def aggregate(arguments):
         Tuple of output filenames if successful
         None otherwise
     """
-    zip_directory_in = None
     staging_directory_out = None
-    output_xlsx_filename = 'aggregation.xlsx'
+    export_formats = parse_formats(arguments.get('--format') or 'xlsx')
+    output_filenames = ['aggregation.' + export_format for export_format in export_formats]
 
     #-----------------------------
-    # Extract submitted files from .zip
+    # Check submitted .zip
     #-----------------------------
-    # Note: For this operation, the submitted file will be a .zip file (not a
-    #       .docx file as the argument name implies)
-    zip_filename_in = arguments['<requirements.docx>']
-    if not os.path.isfile(zip_filename_in):
+    zip_file_in = arguments['<requirements.zip>']
+    zip_filename_in = input_file_name(zip_file_in)
+    if not input_file_exists(zip_file_in):
         qlog.error(f'The file "{zip_filename_in}" does not exist')
         return False
     if not zip_filename_in.endswith('.zip'):
         qlog.error(f'Expected filename ("{zip_filename_in}") to end in ".zip".')
         return False
 
-    lprint(f'Extracting files from "{zip_filename_in}"...')
-    if not os.path.exists('temp'):
-        os.makedirs('temp')
-    zip_directory_in = tempfile.mkdtemp(prefix='zip_extract_', dir='temp')
-    zip_ref = zipfile.ZipFile(zip_filename_in, 'r')
-    zip_ref.extractall(zip_directory_in)
-    zip_ref.close()
-
     #-----------------------------
-    # Find .docx files in .zip
+    # Find .docx files in .zip (including any in folders)
     #-----------------------------
-    files = [
-        f for f in os.listdir(zip_directory_in)
-        if os.path.isfile(os.path.join(zip_directory_in, f))
-        ]
+    # The documents are read straight from the zip (see extract_document()), so
+    # nothing is extracted to disk.
+    # The zip's path or, if it is held in memory (e.g. an upload), a file object
+    # holding it
+    zip_source = open_input_file(zip_file_in)
+    with zipfile.ZipFile(zip_source, 'r') as zip_ref:
+        files = [
+            info.filename for info in zip_ref.infolist()
+            if not info.filename.endswith('/') and not info.filename.startswith(ZIP_IGNORED_FOLDERS)
+            ]
     lprint('Found files in .zip:\n' + '\n'.join([f'    "{f}"' for f in files]))
     docx_files = [f for f in files if f.endswith(".docx")]
     if not docx_files:
@@ -82,64 +90,94 @@ def aggregate(arguments):
     #-----------------------------
     # Extract requirements from each requirements .docx file
     #-----------------------------
+    # Each document is checked and extracted in a worker process.  Results (and
+    # each document's output) are gathered in the order of the files in the zip.
+    if not os.path.exists('temp'):
+        os.makedirs('temp')
     staging_directory_out = tempfile.mkdtemp(prefix='staging_', dir='temp')
     document_dicts = []
-    for filename in docx_files:
-        docx_filename = os.path.join(zip_directory_in, filename)
-
-        #-----------------------------
-        # Check integrity
-        #-----------------------------
-        check_arguments = {'<requirements.docx>':docx_filename}
-        if not cmd_check.check(check_arguments):
-            qlog.error('Operation aborted due to document check failures.')
-            return False
-
-        #-----------------------------
-        # Extract requirement data
-        #-----------------------------
-        lprint('Extracting requirements from "{}"...'.format(docx_filename))
-        doc = WordDocx(qlog, os.path.abspath(docx_filename))
-        document_dict = {
-            'sourceDocument': filename,
-            'directives': [
-                directive.as_dict
-                for directive in doc._directives
-                if '#document_info' not in directive.as_dict
-                ]
-        }
-        qlog.debug(f'document_dict: {json.dumps(document_dict, indent=4)}')
-        document_dicts.append(document_dict)
+    json_filenames = staging_filenames(docx_files)
+    # The name under which each document is recorded in the object ID index.  The
+    # zip's previous entries are forgotten, so documents since removed from it
+    # don't linger.
+    index = object_id_index.get_index()
+    if index is not None:
+        zip_index_name = object_id_index.input_file_document_name(zip_file_in)
+        index.forget_document(zip_index_name)
+        index_names = [object_id_index.member_name(zip_index_name, filename) for filename in docx_files]
+    else:
+        index_names = [None] * len(docx_files)
+    jobs = resolve_jobs(int(arguments.get('--jobs') or 0))
+    spooled_zip_filename = None
+    if not isinstance(zip_source, str) and jobs > 1 and len(docx_files) > 1:
+        # Give the worker processes the zip's path, rather than pickling its
+        # content into every job
+        spooled_zip_filename = spool_to_file(zip_source, 'temp')
+        zip_source = spooled_zip_filename
+    try:
+        job_results = run_jobs(
+            extract_document,
+            [(zip_source, filename, name) for filename, name in zip(docx_files, index_names)],
+            docx_files,
+            jobs)
+        failed = False
+        for json_filename, job_result in zip(json_filenames, job_results):
+            qlog.print_output(job_result.output)
+            document_dict = job_result.value
+            if document_dict is None:
+                failed = True
+                continue
+            document_dicts.append(document_dict)
+
+            out_filename = os.path.join(staging_directory_out, json_filename)
+            with open(out_filename, "w") as text_file:
+                json.dump(document_dict, text_file, indent=4)
+    finally:
+        if spooled_zip_filename is not None:
+            os.remove(spooled_zip_filename)
+    if failed:
+        qlog.error('Operation aborted due to document check failures.')
+        return False
 
-        out_filename = os.path.join(staging_directory_out, filename.replace('.docx', '.json'))
-        with open(out_filename, "w") as text_file:
-            text_file.write(json.dumps(document_dict, indent=4))
+    #-----------------------------
+    # Check for object IDs shared between documents
+    #-----------------------------
+    # The collisions are advisory (reported as warnings): the documents each
+    # passed check, so they are still aggregated.
+    if index is not None:
+        lprint('Checking for object ID collisions between documents...')
+        report_collisions(index, index_names, advisory=True)
 
     #-----------------------------
-    # Aggregate directives into single .xlsx
+    # Aggregate directives into a single file (per export format)
     #-----------------------------
-    exporter = ExcelExporter(os.path.join(staging_directory_out, output_xlsx_filename))
-    exporter.add_column_header('id')
-    # Note: For now the list of directive properties which are enumerations is
+    exporters = [
+        EXPORTERS[export_format](os.path.join(staging_directory_out, output_filename))
+        for export_format, output_filename in zip(export_formats, output_filenames)]
+    for exporter in exporters:
+        exporter.add_column_header('id')
+        # Note: For now the list of directive properties which are enumerations is
         #       hard coded. It may be possible to be more general in the
         #       future, and discover which directive properties are enumerations by
         #       parsing the "#document_info" directive in each document (ant presumably
         #       identifying which ones have a type of "array" in their schema)
-    exporter.add_ennumeration(
-        'allocatedTo',
-        ['System', 'Application', 'Function', 'Network', 'Equipment', 'Radio']
-        )
+        exporter.add_ennumeration(
+            'allocatedTo',
+            ['System', 'Application', 'Function', 'Network', 'Equipment', 'Radio']
+            )
     for document_dict in document_dicts:
         for directive in document_dict['directives']:
             directive['sourceDocument'] = document_dict['sourceDocument']
-            exporter.add_row(directive)
-    exporter.prettify()
-    exporter.save()
+            for exporter in exporters:
+                exporter.add_row(directive)
+    for exporter in exporters:
+        exporter.save()
 
     #-----------------------------
     # Return the output files
     #-----------------------------
-    return_directory = os.path.join('cascade', 'static', 'results')
+    return_directory = arguments.get('<output.csv>') or os.path.join('cascade', 'static', 'results')
+    os.makedirs(return_directory, exist_ok=True)
     return_filename_list = []
     filenames = [
         f for f in os.listdir(staging_directory_out)
@@ -150,16 +188,19 @@ def aggregate(arguments):
         destination = os.path.join(return_directory, filename)
         shutil.move(source, destination)
         return_filename_list.append(filename)
-    # Move primary output file to end of list
-    return_filename_list.append(
-        return_filename_list.pop(
-            return_filename_list.index(
-                output_xlsx_filename)))
+    # Move primary output files to end of list
+    for output_filename in output_filenames:
+        return_filename_list.append(
+            return_filename_list.pop(
+                return_filename_list.index(
+                    output_filename)))
+    lprint('Output files written to "{}":\n'.format(return_directory) +
+           '\n'.join('    "{}"'.format(filename) for filename in output_filenames))
 
     #-----------------------------
     # Delete temp directories
     #-----------------------------
-    for directory in (zip_directory_in, staging_directory_out):
+    for directory in (staging_directory_out,):
         if directory is not None:
             lprint('Deleting temp directory "{}"'.format(directory))
             try:
@@ -172,139 +213,95 @@ def aggregate(arguments):
     lprint("Done.")
     return return_filename_list
 
-class ExcelExporter():
-    """ Export requirement directives to an Excel (.xlsx) file """
-
-    def __init__(self, filename):
-        self.wb = Workbook()
-        self.ws = self.wb.active
-        self.filename = filename
-
-        self.column_map = {}
-        self.tier_1_header_row = 1
-        self.tier_2_header_row = self.tier_1_header_row + 1
-        self.current_row = self.tier_2_header_row + 1
-        self.next_column = 1
-
-        self.enumeration_properties = []
-
-        self.fill = PatternFill(
-            patternType='solid',
-            fill_type='solid',
-            fgColor=Color('EBF1DE') # RGB: 235, 241, 222
-            )
-        self.thin_border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-            )
-        self.thin_border_left = Border(
-            left=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-            )
-        self.thin_border_right = Border(
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-            )
-        self.thin_border_center = Border(
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-            )
-
-    def add_row(self, data_dict):
-        """Add a row containing all properties from a dict of the requirements directive"""
-        for key, value in data_dict.items():
-            if key in self.enumeration_properties:
-                for value2 in value:
-                    self.add_property(value2, 'X')      
-            else:
-                if isinstance(value, (list,)):
-                    self.add_property(key, ', '.join(value))
-                else:
-                    self.add_property(key, value)
-        self.current_row += 1
-
-    def add_property(self, key, value):
-        """add a new property to the current row"""
-        self.add_column_header(key)
-        self.ws.cell(row=self.current_row, column=self.column_map[key], value=value)
-
-    def add_column_header(self, key):
-        """Add a column header if it doesn't already exist"""
-        if key not in self.column_map:
-            self.column_map[key] = self.next_column
-            self.ws.cell(row=self.tier_2_header_row, column=self.next_column, value=key)
-            self.next_column += 1
-
-    def add_ennumeration(self, name, values):
-        """Add columns for an enumeration
-
-        The enumeration name shows up on the top row.
-        The enumeration values show up on the primary heading row.
-        """
-        start_column = self.next_column
-        self.enumeration_properties.append(name)
-        cell = self.ws.cell(row=self.tier_1_header_row, column=self.next_column, value=name)
-        for value in values:
-            self.add_column_header(value)
-        for column in range(start_column, self.next_column):
-            cell = self.ws.cell(row=self.tier_1_header_row, column=column)
-            if column == start_column:
-                cell.border = self.thin_border_left
-            elif column == self.next_column-1:
-                cell.border = self.thin_border_right
-            else:
-                cell.border = self.thin_border_center
-            cell.fill = self.fill
-
-    def save(self):
-        """Save the current workbook"""
-        self.wb.save(self.filename)
-
-    def prettify(self):
-        """Format all worksheets
-
-        * Add fill color to heading columns.
-        * Set column widths based on content size
-        * Set border lines
-        """
-        worksheet_names = self.wb.get_sheet_names()
-        alignment_default = Alignment(horizontal='left', wrapText=True, vertical='top')
-
-        for worksheet_name in worksheet_names:
-            worksheet = self.wb.get_sheet_by_name(name=worksheet_name)
-            dims = {}
+def staging_filenames(member_names):
+    """Return the name of the JSON file written for each document in a zip
 
-            end_reached = False
-            max_row = 0
-            max_col = 0
-            for row_index, row in enumerate(worksheet.rows):
-                max_row = max(max_row, row_index)
-                if row_index == self.tier_1_header_row-1:
-                    continue
-                for col_index, cell in enumerate(row):
-                    max_col = max(max_col, col_index)
-
-                    if row_index == self.tier_2_header_row - 1:
-                        # Column headings
-                        width_scale = 1.4
-                    else:
-                        # Content cells
-                        width_scale = 1.2
-                    if cell.value:
-                        column_width = len(str(cell.value)) * width_scale
-                        column_width = min(column_width, MAX_XLSX_COL_WIDTH)
-                        dims[cell.column] = max((dims.get(cell.column, 0), column_width))
-                    if row_index == self.tier_2_header_row - 1:
-                        cell.fill = self.fill
-                    cell.border = self.thin_border
-                    cell.alignment = alignment_default
+    Folders are flattened into the name (e.g. 'specs/two.docx' -> 'specs_two.json'),
+    since the output files are returned in a single folder.  If that makes names
+    clash (e.g. 'a/b_c.docx' and 'a_b/c.docx'), a number is appended to the later
+    ones ('a_b_c_2.json'), so no document's JSON overwrites another's.
+    """
+    filenames = []
+    used = set()
+    for member_name in member_names:
+        stem = os.path.splitext(member_name)[0].replace('/', '_')
+        filename = stem + '.json'
+        number = 2
+        # (Compared ignoring case, for case-insensitive file systems)
+        while filename.lower() in used:
+            filename = '{}_{}.json'.format(stem, number)
+            number += 1
+        used.add(filename.lower())
+        filenames.append(filename)
+    return filenames
+
+def spool_to_file(in_file, directory):
+    """Copy a binary file object to a (uniquely named) temporary file in directory. Returns its filename"""
+    fd, filename = tempfile.mkstemp(prefix='spool_', suffix='.zip', dir=directory)
+    with os.fdopen(fd, 'wb') as out_file:
+        in_file.seek(0)
+        shutil.copyfileobj(in_file, out_file)
+    return filename
+
+def extract_document(zip_source, member_name, index_name=None):
+    """Check a requirements document in a zip, and extract its directives (run in a worker process)
+
+    zip_source is the zip's path, or a binary file object holding it.  If it
+    passes check, the document is recorded in the object ID index (if enabled)
+    under index_name (if given).
+
+    The document is read from the zip into memory.  If the aggregate manifest
+    (see aggregate_manifest.py) has an entry for the document's content, the
+    document is not parsed or checked again; the entry's directives are used.
 
-            cell_filter = f'B2:{get_column_letter(max_col + 1)}{max_row+1}'
-            worksheet.auto_filter.ref = cell_filter
+    Returns:
+        A dict of the document's directives (and its name in the zip), or None if
+        the document failed check
+    """
+    with zipfile.ZipFile(zip_source, 'r') as zip_ref:
+        docx_file = io.BytesIO(zip_ref.read(member_name))
+    manifest = aggregate_manifest.get_manifest()
+    index = object_id_index.get_index() if index_name is not None else None
+    digest = parse_cache.file_digest(docx_file) if manifest is not None or index is not None else None
+    entry = manifest.get(digest) if manifest is not None else None
+
+    if entry is not None:
+        #-----------------------------
+        # Reuse unchanged document (reporting it exactly as a full run would)
+        #-----------------------------
+        qlog.debug('Document "{}" unchanged since it was last aggregated; reusing its requirements'.format(member_name))
+        lprint('Checking "{}"...'.format(member_name))
+        cmd_check.report_passed_check(entry['check_result'])
+        if index is not None:
+            index.record_document(index_name, entry['check_result'], digest)
+        lprint('Extracting requirements from "{}"...'.format(member_name))
+        directives = entry['directives']
+    else:
+        #-----------------------------
+        # Check integrity
+        #-----------------------------
+        doc = WordDocx(qlog, docx_file, read_only=True)
+        counts_before = [qlog.get_count(level) for level in cmd_check.LOG_LEVELS_FAILED]
+        check_result = cmd_check.check_document(doc, member_name, index_name, digest)
+        if not check_result.passed:
+            return None
 
-            for col, value in dims.items():
-                worksheet.column_dimensions[col].width = value
+        #-----------------------------
+        # Extract requirement data
+        #-----------------------------
+        lprint('Extracting requirements from "{}"...'.format(member_name))
+        directives = [
+            directive.as_dict
+            for directive in doc._directives
+            if '#document_info' not in directive.as_dict
+            ]
+        if manifest is not None and counts_before == [
+                qlog.get_count(level) for level in cmd_check.LOG_LEVELS_FAILED]:
+            manifest.put(digest, {'directives': directives, 'check_result': check_result})
+
+    document_dict = {
+        'sourceDocument': member_name,
+        'directives': directives
+    }
+    qlog.debug(lambda: f'document_dict: {json.dumps(document_dict, indent=4)}')
+    return document_dict
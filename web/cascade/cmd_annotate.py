@@ -4,7 +4,6 @@
 
 # Standard library
 import os
-from collections import OrderedDict
 
 # Libraries
 
@@ -12,7 +11,8 @@ from collections import OrderedDict
 from cascade import cmd_check
 from cascade.word_docx import WordDocx
 from cascade.util import (
-    is_shortform_dict, add_suffix_to_filename, make_output_file_info)
+    is_shortform_dict, add_suffix_to_filename, make_output_file_info,
+    input_file_name, input_file_exists, open_input_file)
 from cascade import quicklog
 from cascade.util_eliot import log_function
 
@@ -40,33 +40,36 @@ def annotate(arguments, reset=False, suffix='ANNOTATED'):
         None otherwise
     """
 
-    # Integrity check
-    if not cmd_check.check(arguments):
-        qlog.error('Annotation aborted due to document check failures.')
+    in_file = arguments['<requirements.docx>']
+    in_filename = input_file_name(in_file)
+    if not input_file_exists(in_file):
+        qlog.error('The file "{}" does not exist'.format(in_filename))
         return
 
-    in_filename = arguments['<requirements.docx>']
-    if not os.path.isfile(in_filename):
-        qlog.error('The file "{}" does not exist'.format(in_filename))
+    doc = WordDocx(qlog, open_input_file(in_file))
+
+    # Integrity check
+    if not cmd_check.check_document(doc, in_filename).passed:
+        qlog.error('Annotation aborted due to document check failures.')
         return
 
     lprint('Annotating "{}"...'.format(in_filename))
-    doc = WordDocx(qlog, os.path.abspath(in_filename))
 
-    object_ids = OrderedDict()
+    object_ids = {}
     for object_id in doc.doc_info_directive.as_dict['#document_info']['object_ids']:
         prefix = object_id['prefix']
         object_ids[prefix] = {
             'next_id': object_id['next_id']
         }
     next_id_updated = False
+    changed_directives = []
 
     #next_id = int(doc.doc_info_directive.as_dict['#document_info']['object_id']['next_id'])
     #original_next_id = next_id
     for directive in doc._directives:
         directive_dict = directive.as_dict
         if is_shortform_dict(directive_dict):
-            qlog.debug('Processing {}'.format(directive_dict['id']))
+            qlog.debug('Processing %s', directive_dict['id'])
             original_id = directive_dict['id']
             id_parts = directive_dict['id'].split('-')
             prefix = '-'.join(id_parts[:-1]) + '-'
@@ -85,7 +88,7 @@ def annotate(arguments, reset=False, suffix='ANNOTATED'):
                     changed = True
             if changed:
                 directive_dict['id'] = '-'.join(id_parts)
-                doc.rewrite_directive(directive)
+                changed_directives.append(directive)
                 lprint('   {:15s} --> {}'.format(original_id, directive_dict['id']))
 
     if reset:
@@ -96,12 +99,15 @@ def annotate(arguments, reset=False, suffix='ANNOTATED'):
         # One or more 'next_id' has changed. Write new next_id back to doc
         object_id_list = []
         for object_id_prefix in object_ids:
-            object_id_list.append(OrderedDict([
-                ('prefix', object_id_prefix),
-                ('next_id', object_ids[object_id_prefix]['next_id'])
-            ]))
+            object_id_list.append({
+                'prefix': object_id_prefix,
+                'next_id': object_ids[object_id_prefix]['next_id']
+            })
         doc.doc_info_directive.as_dict['#document_info']['object_ids'] = object_id_list
-        doc.rewrite_directive(doc.doc_info_directive)
+        changed_directives.append(doc.doc_info_directive)
+
+    # Write all changes back to the document in a single batch
+    doc.rewrite_directives(changed_directives)
 
     #----------------------------
     # Save
@@ -2,14 +2,12 @@
 (Commands are issued on the command line, per the docopt syntax in __main__.py)
 """
 
-# Standard library
-import os
-
 # Local
 from cascade import cmd_check
 from cascade.word_docx import WordDocx
 from cascade.util import get_directive_type
 from cascade.util import add_suffix_to_filename, make_output_file_info
+from cascade.util import input_file_name, input_file_exists, open_input_file
 from cascade import quicklog
 from cascade.util_eliot import log_function
 
@@ -29,21 +27,22 @@ def apply_styles(arguments):
         None otherwise
     """
 
-    in_filename = arguments['<requirements.docx>']
+    in_file = arguments['<requirements.docx>']
+    in_filename = input_file_name(in_file)
 
-    if not os.path.isfile(in_filename):
+    if not input_file_exists(in_file):
         qlog.error('The file "{}" does not exist'.format(in_filename))
         return
 
+    # Load
+    lprint('Loading document...')
+    doc = WordDocx(qlog, open_input_file(in_file))
+
     # Integrity Check
-    if not cmd_check.check(arguments):
+    if not cmd_check.check_document(doc, in_filename).passed:
         qlog.error('Aborted due to document check failures.')
         return
 
-    # Load
-    lprint('Loading document...')
-    doc = WordDocx(qlog, os.path.abspath(in_filename))
-
     # Identify clusters
     lprint('Identifying paragraph clusters...')
     clusters = doc.get_clusters()
@@ -57,7 +56,7 @@ def apply_styles(arguments):
             directives_found += 1
             directive_dict = cluster['directive']
             directive_type = get_directive_type(directive_dict)
-            qlog.debug("Processing directive: {}".format(directive_dict))
+            qlog.debug("Processing directive: %s", directive_dict)
             if directive_type == '#shortform':
                 target_style = doc._document.styles['Cascade Directive']
             else:
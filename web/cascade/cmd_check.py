@@ -3,8 +3,8 @@
 """
 
 # Standard library
-import os
-from collections import Counter
+import logging
+from collections import Counter, namedtuple
 
 # Libraries
 from colorama import Fore
@@ -12,15 +12,95 @@ from colorama import Fore
 # Local
 from cascade.word_docx import WordDocx
 from cascade.util import validate_json, represents_int, get_requirement_id, SCHEMA__DOCUMENT_INFO, SCHEMA__PRAGMA
+from cascade.util import InputFile, input_file_name, input_file_exists, open_input_file
 from cascade.util_eliot import log_function
+from cascade.worker_pool import run_jobs, resolve_jobs
+from cascade import object_id_index
+from cascade import parse_cache
 from cascade import quicklog
 
 qlog = quicklog.get_logger()
 lprint = qlog.lprint
 
+# The outcome of checking a single document.
+#   passed:         True if check passed, False otherwise
+#   doc_info_dict:  The parsed "#document_info" directive (None if not found)
+#   object_ids:     Dict of declared object ID prefix -> {'next_id', 'num_unassigned', 'max'}
+#   schemas:        Dict of directive name -> JSON schema
+#   all_object_ids: List of all (numbered) object IDs appearing in the document
+CheckResult = namedtuple('CheckResult', 'passed doc_info_dict object_ids schemas all_object_ids')
+
+# A check result is not cached if any messages at these levels were logged during the check
+LOG_LEVELS_FAILED = (logging.WARNING, logging.ERROR, logging.CRITICAL)
+
 @log_function
-def check(arguments):
-    """Check a requirements document for Cascade compliance & integrity
+def check(arguments, doc=None):
+    """Check requirements document(s) for Cascade compliance & integrity
+
+    Args:
+        arguments: Command arguments.  '<requirements.docx>' names the document, or
+            is an InputFile of it (or, from the command line, is a list of documents).  If several documents
+            are named they are checked in parallel by up to '--jobs' worker processes.
+        doc: An already-loaded WordDocx of the document (optional).  If not
+            supplied, the document is loaded from '<requirements.docx>'.
+
+    Returns:
+        True if check passed (for every document), false otherwise
+    """
+    filenames = arguments['<requirements.docx>']
+    if isinstance(filenames, (str, InputFile)):
+        filenames = [filenames]
+    if len(filenames) > 1:
+        jobs = resolve_jobs(int(arguments.get('--jobs') or 1))
+        return check_files(filenames, jobs)
+    filename = filenames[0]
+    if doc is None:
+        return check_file(filename)
+    return check_document(doc, input_file_name(filename), *index_entry(filename, doc)).passed
+
+def check_files(filenames, jobs):
+    """Check several documents, using up to jobs worker processes
+
+    Each document's report is printed in turn (in the order given, regardless of
+    the order in which the checks finish), followed by a summary.
+
+    Returns:
+        True if every document passed, false otherwise
+    """
+    failed = []
+    job_results = run_jobs(check_file, [(filename,) for filename in filenames], filenames, jobs)
+    for filename, job_result in zip(filenames, job_results):
+        qlog.print_output(job_result.output)
+        if not job_result.value:
+            failed.append(filename)
+    lprint('Checked {} documents: {} passed, {} failed.'.format(
+        len(filenames), len(filenames) - len(failed), len(failed)))
+    for filename in failed:
+        lprint('   ' + Fore.RED + 'FAILED' + Fore.RESET + ': "{}"'.format(filename))
+    return not failed
+
+def check_file(filename):
+    """Load and check a single document (a filename or an InputFile). Returns True if check passed"""
+    if not input_file_exists(filename):
+        qlog.error('The file "{}" does not exist'.format(input_file_name(filename)))
+        return False
+    doc = WordDocx(qlog, open_input_file(filename), read_only=True)
+    return check_document(doc, input_file_name(filename), *index_entry(filename, doc)).passed
+
+def index_entry(filename, doc):
+    """Return (name, content digest) under which a loaded document (a filename or an InputFile) is indexed
+
+    Returns (None, None) if the object ID index is disabled.
+    """
+    if object_id_index.get_index() is None:
+        return (None, None)
+    #pylint: disable=locally-disabled, protected-access
+    digest = doc._cache_digest or parse_cache.file_digest(open_input_file(filename))
+    return (object_id_index.input_file_document_name(filename, digest), digest)
+
+@log_function
+def check_document(doc, filename, index_name=None, digest=None):
+    """Check a loaded requirements document for Cascade compliance & integrity
 
     Checks:
         Required styles exist: 'Cascade Directive', 'Cascade Hidden Directive'
@@ -31,39 +111,63 @@ def check(arguments):
         Verify "next_id" directive exceeds highest Object ID used.
         No old-form object IDs.
 
+    Commands which go on to modify or extract from the document should load it
+    once and pass the same WordDocx here, rather than calling check().
+
+    If the document was loaded from the parse cache, and it previously passed
+    with no warnings, the cached result is reported (exactly as the check
+    reported it, see report_passed_check()) and returned.  A result is only
+    cached if the check passed with no warnings or errors.
+
+    The object IDs of a document which passes are recorded in the object ID
+    index (if enabled), under index_name (if given), with the document's content
+    digest (see object_id_index.py).
+
     Returns:
-        True if check passed, false otherwise
+        A CheckResult
     """
-    success = True
-
-    filename = arguments['<requirements.docx>']
-    if not os.path.isfile(filename):
-        qlog.error('The file "{}" does not exist'.format(filename))
-        return False
     lprint('Checking "{}"...'.format(filename))
-    doc = WordDocx(qlog, os.path.abspath(filename))
+    if doc.cached_check_result is not None:
+        qlog.debug('Document unchanged since it last passed check; reporting the cached result')
+        result = doc.cached_check_result
+        report_passed_check(result)
+    else:
+        counts_before = [qlog.get_count(level) for level in LOG_LEVELS_FAILED]
+        result = _check_document(doc, filename)
+        if result.passed and counts_before == [qlog.get_count(level) for level in LOG_LEVELS_FAILED]:
+            doc.store_check_result(result)
+
+    index = object_id_index.get_index()
+    if index is not None and index_name is not None and result.passed:
+        index.record_document(index_name, result, digest)
+    return result
+
+def _check_document(doc, filename):
+    """Check a loaded requirements document (see check_document())"""
+    success = True
 
     # Check for change tracking elements and warn accordingly
     doc.warn_on_change_tracking()
 
     if doc.doc_info_directive is None:
         qlog.error('Expected "document_info" directive not found in document "{}".'.format(filename))
-        return False
+        return CheckResult(False, None, {}, {}, [])
 
     doc_info_dict = doc.doc_info_directive.as_dict
-    qlog.debug('doc_info_directive.as_dict: {}'.format(doc_info_dict))
+    qlog.debug('doc_info_directive.as_dict: %s', doc_info_dict)
 
     if not check_styles(doc):
         success = False
 
-    if not validate_json(doc_info_dict, SCHEMA__DOCUMENT_INFO):
-        return False
+    if not validate_json(doc_info_dict, SCHEMA__DOCUMENT_INFO, collect_all=True):
+        return CheckResult(False, doc_info_dict, {}, {}, [])
 
     #Extract schemas from document_info directive
     schemas = {}
     for schema in doc_info_dict['#document_info']['schemas']:
         title = schema['title']
         schemas[title] = schema
+    declared_schemas = dict(schemas)
 
     object_ids = {}
     for object_id in doc_info_dict['#document_info']['object_ids']:
@@ -74,13 +178,7 @@ def check(arguments):
             'max': -1
         }
 
-    lprint('   Using directives:')
-    lprint('      Object ID prefix:')
-    for key in object_ids:
-        lprint('         "{}" (Next ID:{})'.format(key, object_ids[key]['next_id']))
-    lprint('      Schemas:')
-    for key in schemas:
-        lprint('         "{}"'.format(key))
+    report_directives(object_ids, declared_schemas)
 
     # Add the #pragma schema to the list of schemas (#pragma is always allowed to
     # appear in a doc, but its form is defined by Cascade, not in #document_info)
@@ -105,7 +203,7 @@ def check(arguments):
             # Do nothing. This directive has already been parsed.
             pass
         elif directive_name in schemas:
-            if not validate_json(directive_dict, schemas[directive_name]):
+            if not validate_json(directive_dict, schemas[directive_name], collect_all=True):
                 success = False
             elif directive_name == '#shortform':
                 #TODO Use meta-schema to enforce that 'id' exists in shortform schema
@@ -113,7 +211,7 @@ def check(arguments):
                 pieces = object_id.split('-')
                 prefix = '-'.join(pieces[:-1]) + '-'
                 suffix = pieces[-1]
-                qlog.debug('Found object_id: "{}". Prefix:{} Suffix: {}'.format(object_id, prefix, suffix))
+                qlog.debug('Found object_id: "%s". Prefix:%s Suffix: %s', object_id, prefix, suffix)
                 if prefix not in object_ids:
                     qlog.error('Prefix in object ID {} does not match any declared object ID "prefix": {}'.format(object_id, list(object_ids.keys())))
                     success = False
@@ -135,15 +233,14 @@ def check(arguments):
                        'each directive type appearing in the document.')
             success = False
 
-        check_directive_style(directive_name, directive)
+        check_directive_style(doc, directive_name, directive)
 
     # TODO: Add constraint to prefix format?  Maybe just warn if looks suspicious?
 
     #-----------------------
     # Check for old style object ids
     #-----------------------
-    for paragragh in doc.paragraphs:
-        text = doc.get_text(paragragh)
+    for text in doc.paragraph_texts():
         if get_requirement_id(text, fuzzy=True):
             qlog.error('Unexpected old-style object ID: "{}". Use directive form.'.format(text))
             success = False
@@ -155,6 +252,25 @@ def check(arguments):
             qlog.error('Object ID {} appears {} times'.format(object_id, counts[object_id]))
             success = False
 
+    report_object_id_usage(object_ids)
+
+    if success:
+        lprint(Fore.GREEN + "Check PASSED" + Fore.RESET)
+
+    return CheckResult(success, doc_info_dict, object_ids, declared_schemas, all_object_ids)
+
+def report_directives(object_ids, schemas):
+    '''Print the object ID prefixes and schemas declared by a document's "document_info" directive'''
+    lprint('   Using directives:')
+    lprint('      Object ID prefix:')
+    for key in object_ids:
+        lprint('         "{}" (Next ID:{})'.format(key, object_ids[key]['next_id']))
+    lprint('      Schemas:')
+    for key in schemas:
+        lprint('         "{}"'.format(key))
+
+def report_object_id_usage(object_ids):
+    '''Print the usage of each object ID prefix (as counted by check)'''
     lprint('   Object ID usage summary:')
     for key in object_ids:
         lprint('      "{}"'.format(key))
@@ -171,10 +287,15 @@ def check(arguments):
         else:
             lprint('         (Does not appear in document)')
 
-    if success:
-        lprint(Fore.GREEN + "Check PASSED" + Fore.RESET)
+def report_passed_check(result):
+    '''Print the report of a check which passed (with no warnings), from its CheckResult
 
-    return success
+    Used when a check's result is reused (from the parse cache or the aggregate
+    manifest), so the report is the same as that of a full check.
+    '''
+    report_directives(result.object_ids, result.schemas)
+    report_object_id_usage(result.object_ids)
+    lprint(Fore.GREEN + "Check PASSED" + Fore.RESET)
 
 def pluralize(singular, plural, value):
     return singular if value == 1 else plural
@@ -188,19 +309,19 @@ def check_styles(doc):
     required_styles = ['Cascade Directive', 'Cascade Hidden Directive']
     success = True
     for style in required_styles:
-        if style not in doc._document.styles:
+        if not doc.has_style(style):
             qlog.error('The required style "{}" was not found in the document.'.format(style))
             success = False
     return success
 
-def check_directive_style(directive_name, directive):
+def check_directive_style(doc, directive_name, directive):
     expected_style = 'Cascade Directive' if directive_name == '#shortform' else 'Cascade Hidden Directive'
-    for paragragh in directive.paragraphs:
-        if paragragh.style.name != expected_style:
+    for text, style_id in zip(directive.texts, directive.style_ids):
+        style_name = doc.get_style_name(style_id)
+        if style_name != expected_style:
             qlog.warning('In "{}" directive, expected style to be "{}".  Was "{}". Paragraph text: "{}"'.format(
                 directive_name,
                 expected_style,
-                paragragh.style.name,
-                paragragh.text
+                style_name,
+                text
                 ))
-
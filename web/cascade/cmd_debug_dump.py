@@ -12,7 +12,7 @@ from docx.text.paragraph import Paragraph
 
 # Local
 from cascade.word_docx import WordDocx
-from cascade.util import Indent, get_heading_level
+from cascade.util import Indent
 from cascade import quicklog
 from cascade.util_eliot import log_function
 
@@ -69,10 +69,11 @@ def dump(arguments):
     indent.print("----|------------|------|--------|---------------------  ")
 
     for p_number, paragraph in enumerate(doc.paragraphs):
-        style = paragraph.style.name
+        style_id = doc.get_style_id(paragraph)
+        style = doc.get_style_name(style_id)
         p_indent = paragraph.paragraph_format.left_indent
         indent_inches = 0 if p_indent is None else p_indent.inches
-        heading_level = get_heading_level(style)
+        heading_level = doc.get_style_heading_level(style_id)
         indent.print("{:04d}| {:>10} | {:>4} | {: 0.3f} | {}".format(p_number, style, str(heading_level), indent_inches, shorten(paragraph.text)))
     indent.dec()
 
@@ -3,7 +3,9 @@
 """
 
 # Standard library
+import io
 import pprint
+import tempfile
 from urllib.parse import urlparse, urljoin
 import os
 import sys
@@ -12,8 +14,11 @@ from functools import wraps
 
 
 # Library
-from flask import Flask, render_template, Markup, request, jsonify, session
+from flask import (
+    Flask, Request, render_template, Markup, request, jsonify, session, redirect, url_for, abort,
+    send_from_directory)
 from werkzeug import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 from colorama import Fore
 from eliot import Message, start_action
 
@@ -23,6 +28,11 @@ from cascade import cmd_check
 from cascade import cmd_annotate
 from cascade import cmd_apply_styles
 from cascade import cmd_aggregate
+from cascade.exporters import EXPORTERS
+from cascade.worker_pool import resolve_jobs
+from cascade import wsgi_server
+from cascade import jobs
+from cascade.util import InputFile
 from cascade.custom_exceptions import FatalUserError
 from cascade.version import __version__
 import markdown
@@ -36,11 +46,72 @@ lprint = qlog.lprint
 # This global will be set by http()
 global_arguments = {}
 
+# Most worker processes used by a single aggregate request.  They are forked from
+# a (threaded) server process, which may be serving other requests, so the
+# server's CPUs aren't all given to one request.
+MAX_AGGREGATE_JOBS = 2
+
+# Uploads up to this size are kept in memory. Larger uploads are written to a
+# (uniquely named) temporary file in the UPLOAD_FOLDER.
+UPLOAD_MEMORY_MAX_BYTES = 4 * 1024 * 1024
+
+class UploadRequest(Request):
+    ''' A request whose uploaded files are kept in memory or, if large, in temporary files
+
+    The total size of the uploaded files is checked as they are received, so an
+    upload larger than MAX_CONTENT_LENGTH is rejected (413) as soon as it passes
+    the limit, even if the client didn't declare its length up front.
+
+    Temporary files are deleted when the request ends, unless they were taken
+    over (see take_upload()).
+    '''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_bytes = 0
+        self.upload_paths = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= UPLOAD_MEMORY_MAX_BYTES:
+            stream = _UploadBuffer()
+        else:
+            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+            fd, path = tempfile.mkstemp(prefix='upload_', dir=app.config['UPLOAD_FOLDER'])
+            os.close(fd)
+            self.upload_paths.append(path)
+            stream = _UploadFile(path, 'w+b')
+        stream.request = self
+        return stream
+
+    def close(self):
+        super().close()
+        for path in self.upload_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.upload_paths = []
+
+class _LimitedUpload():
+    '''Mixin for an uploaded file's stream, which enforces MAX_CONTENT_LENGTH as the upload is written'''
+    def write(self, data):
+        self.request.upload_bytes += len(data)
+        limit = self.request.max_content_length
+        if limit is not None and self.request.upload_bytes > limit:
+            raise RequestEntityTooLarge()
+        return super().write(data)
+
+class _UploadBuffer(_LimitedUpload, io.BytesIO):
+    pass
+
+class _UploadFile(_LimitedUpload, io.FileIO):
+    pass
+
 app = Flask(__name__, static_url_path = "/static", static_folder = "static")
+app.request_class = UploadRequest
 app.config['TEMPLATES_AUTO_RELOAD'] = True
 app.config['SESSION_TYPE'] = 'filesystem'
 app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_PATH'] = 200000 # 200 MB max file size
+app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024 # 200 MB max upload size
 results_path_local = os.path.join('cascade', 'static', 'results')
 results_path_web = 'static/results/'
 
@@ -57,7 +128,7 @@ def log_route(func):
             <handler code>
     '''
     @wraps(func)
-    def wrapped():
+    def wrapped(*args, **route_kwargs):
         kwargs = {}
         try:
             if request.files:
@@ -72,24 +143,39 @@ def log_route(func):
             pass
 
         with start_action(action_type='http', path=request.path, **kwargs):
-            return func()
+            return func(*args, **route_kwargs)
     return wrapped
 
 def http(arguments):
     """Provide a web interface
 
-    This is the main entry point for starting the http server
+    This is the main entry point for starting the http server.  By default the
+    app is served by Flask's development server.  If '--workers' is given it is
+    served by gunicorn (see wsgi_server.py), using that many worker processes
+    (0 means one per CPU) of '--threads' threads each, each worker being
+    recycled after about '--max-requests' requests.
     """
     global global_arguments
     global_arguments = arguments
+    # Long commands run as background jobs, kept under jobs/
+    jobs.configure('jobs')
     if arguments['-l']:
         host = '127.0.0.1'
         port = 5001
     else:
         host = '0.0.0.0'
         port = 5001
-    Message.log(message_type="start_http_server", host=host, port=port)
-    app.run(host=host, port=port, threaded=True,)
+    if arguments.get('--workers') is None:
+        Message.log(message_type="start_http_server", host=host, port=port)
+        app.run(host=host, port=port, threaded=True,)
+        return
+    workers = resolve_jobs(int(arguments['--workers']))
+    threads = int(arguments.get('--threads') or 1)
+    max_requests = int(arguments.get('--max-requests') or 0)
+    Message.log(
+        message_type="start_http_server", host=host, port=port,
+        workers=workers, threads=threads, max_requests=max_requests)
+    wsgi_server.serve(app, host, port, workers, threads, max_requests)
 
 @app.after_request
 def add_header(response):
@@ -110,6 +196,13 @@ def inject_template_globals():
 def page_unauthorized(e):
     return render_template('401.html'), 401
 
+@app.errorhandler(413)
+def upload_too_large(e):
+    return render_template(
+        'message.html',
+        message='Error: The upload is too large (the limit is {} MB).'.format(
+            app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024))), 413
+
 @app.route('/')
 @log_route
 def home():
@@ -150,7 +243,7 @@ def annotate():
 def do_annotate():
     if request.method == 'POST':
         file = request.files['file']
-        return run_command('Annotate', file, cmd_annotate.annotate)
+        return run_command('Annotate', file, cmd_annotate.annotate, background=True)
 
 @app.route('/annotate_reset')
 @log_route
@@ -162,7 +255,7 @@ def annotate_reset():
 def do_annotate_reset():
     if request.method == 'POST':
         file = request.files['file']
-        return run_command('Annotate Reset', file, cmd_annotate.annotate_reset)
+        return run_command('Annotate Reset', file, cmd_annotate.annotate_reset, background=True)
 
 @app.route('/apply_styles')
 @log_route
@@ -174,12 +267,16 @@ def apply_styles():
 def do_apply_styles():
     if request.method == 'POST':
         file = request.files['file']
-        return run_command('Apply Styles', file, cmd_apply_styles.apply_styles)
+        return run_command('Apply Styles', file, cmd_apply_styles.apply_styles, background=True)
 
 @app.route('/aggregate')
 @log_route
 def aggregate():
-    return render_template('util.html', cmd_name='Aggregation Report', cmd_action='/do_aggregate')
+    return render_template(
+        'util.html',
+        cmd_name='Aggregation Report',
+        cmd_action='/do_aggregate',
+        export_formats=list(EXPORTERS))
 
 @app.route('/do_aggregate', methods=['GET', 'POST'])
 @log_route
@@ -188,9 +285,13 @@ def do_aggregate():
         file = request.files['file']
         return run_command(
             'Aggregation Report',
-            file,
+            [{'argument_name': '<requirements.zip>', 'file': file}],
             cmd_aggregate.aggregate,
-            output_argument='<output.csv>')
+            output_argument='<output.csv>',
+            additional_arguments={
+                '--format': ','.join(request.form.getlist('format')) or 'xlsx',
+                '--jobs': str(min(MAX_AGGREGATE_JOBS, resolve_jobs(0)))},
+            background=True)
 
 
 @app.route('/_get_post_json/', methods=['POST'])
@@ -207,7 +308,8 @@ def run_command(operation,
                 command,
                 output_argument='<output.docx>',
                 additional_arguments={},
-                returns_files=True
+                returns_files=True,
+                background=False
                 ):
     """ Execute a Cascade command
 
@@ -232,6 +334,9 @@ def run_command(operation,
             it completes successfully.
         additional_arguments: A dict of additional arguments to be passed
             to the command.
+        background: True to run the command as a background job (see jobs.py),
+            redirecting to the job's status page (rather than waiting for the
+            command and responding with its report).
     """
 
     # Parse parameter: file
@@ -245,15 +350,16 @@ def run_command(operation,
             }
         ]
 
-    # Process incoming file(s) and save them locally
+    # Process incoming file(s). Each is passed to the command as an InputFile
+    # (held in memory, or in a uniquely named temporary file if large).
     for incoming_file_info in incoming_file_list:
         raw_filename = secure_filename(incoming_file_info['file'].filename)
         if not raw_filename:
             return render_template('message.html', message='Error: You must specify a file to upload first.') 
-        local_filename = os.path.join(app.config['UPLOAD_FOLDER'], raw_filename)
-        incoming_file_info['file'].save(local_filename)
         incoming_file_info['raw_filename'] = raw_filename # filename (with no path)
-        incoming_file_info['local_filename'] = local_filename # filename (with local path)
+    for incoming_file_info in incoming_file_list:
+        incoming_file_info['input_file'] = take_upload(
+            incoming_file_info['raw_filename'], incoming_file_info['file'])
 
     # Build command arguments
     arguments = {
@@ -261,44 +367,126 @@ def run_command(operation,
         output_argument: results_path_local
     }
     for incoming_file_info in incoming_file_list:
-        arguments[incoming_file_info['argument_name']] = incoming_file_info['local_filename']
+        arguments[incoming_file_info['argument_name']] = incoming_file_info['input_file']
     arguments.update(additional_arguments)
 
-    qlog.start_print_capture()
-    qlog.clear_counters()
-    results = None
-    try:
-        results = command(arguments)
-    except FatalUserError as e:
-        qlog.error('Exception: {}'.format(e))
-    except Exception as e:
-        return process_exception(e)
-    finally:
-        # Remove the uploaded (incoming) file(s)
+    def execute(results_path):
+        """Run the command, with its output file(s) written to results_path. Returns its result"""
+        arguments[output_argument] = results_path
+        results = None
         try:
+            results = command(arguments)
+        except FatalUserError as e:
+            qlog.error('Exception: {}'.format(e))
+        finally:
+            # Remove the uploaded (incoming) file(s) held in temporary files
             for incoming_file_info in incoming_file_list:
-                qlog.debug('Deleting file:"{}"'.format(incoming_file_info['local_filename']))
-                os.remove(incoming_file_info['local_filename'])
+                source = incoming_file_info['input_file'].source
+                if isinstance(source, str):
+                    qlog.debug('Deleting file:"{}"'.format(source))
+                    try:
+                        os.remove(source)
+                    except OSError:
+                        pass
+        qlog.show_counters()
+        return results
+
+    job_queue = jobs.get_queue()
+    if background and job_queue is not None:
+        job_id = job_queue.submit(operation, execute)
+        return redirect(url_for('job_status', job_id=job_id))
+
+    # The report (captured output) and the WARNING/ERROR counts are private to
+    # this request, so concurrent requests don't mix their reports.
+    with qlog.scope():
+        qlog.start_print_capture()
+        try:
+            results = execute(results_path_local)
         except Exception as e:
-            pass
-    qlog.show_counters()
-    report = to_html(qlog.stop_print_capture())
+            return process_exception(e)
+        report = to_html(qlog.stop_print_capture())
     if returns_files and results:
-        for filename in results:
-            report += (
-                '<b>Download:</b> ' +
-                '<a href="{}" download="{}">{}</a>'.format(
-                    os.path.join(results_path_web, filename), 
-                    filename,
-                    filename) +
-                '<br>\n' 
-            )
+        report += download_links([os.path.join(results_path_web, filename) for filename in results])
 
     return render_template(
         'report.html',
         operation=operation,
         report=Markup(report))
 
+def take_upload(filename, file):
+    ''' Return an uploaded file (a FileStorage) as an InputFile named filename
+
+    A small upload's content is copied from memory.  A large upload's temporary
+    file is taken over from the request (so it outlives the request, e.g. for a
+    background job); the caller must delete it.
+    '''
+    stream = file.stream
+    if isinstance(stream, _UploadFile):
+        stream.close()
+        request.upload_paths.remove(stream.name)
+        return InputFile(filename, stream.name)
+    stream.seek(0)
+    return InputFile(filename, stream.read())
+
+def download_links(urls):
+    """Return HTML download links for output files (given their URLs)"""
+    html = ''
+    for url in urls:
+        filename = url.split('/')[-1]
+        html += (
+            '<b>Download:</b> ' +
+            '<a href="{}" download="{}">{}</a>'.format(
+                url,
+                filename,
+                filename) +
+            '<br>\n'
+        )
+    return html
+
+@app.route('/jobs/<job_id>')
+@log_route
+def job_status(job_id):
+    """Report a background job's progress (its output so far) and, once it has finished, its download links
+
+    The page reloads itself until the job has finished.
+    """
+    job_queue = jobs.get_queue()
+    job = job_queue.get(job_id) if job_queue is not None else None
+    if job is None:
+        return render_template('message.html', message='Error: No such job (results expire after a while).'), 404
+    report = to_html(job_queue.read_log(job_id))
+    if job.status == jobs.DONE:
+        report += download_links([url_for('job_result', job_id=job_id, filename=filename) for filename in job.results])
+    return render_template(
+        'job.html',
+        operation=job.operation,
+        status=job.status,
+        finished=job.status in jobs.FINISHED_STATES,
+        report=Markup(report))
+
+@app.route('/jobs/<job_id>/status')
+@log_route
+def job_status_json(job_id):
+    """A background job's state and output so far, as JSON"""
+    job_queue = jobs.get_queue()
+    job = job_queue.get(job_id) if job_queue is not None else None
+    if job is None:
+        return jsonify(error='No such job'), 404
+    return jsonify(
+        log=job_queue.read_log(job_id),
+        downloads=[url_for('job_result', job_id=job_id, filename=filename) for filename in job.results],
+        **job._asdict())
+
+@app.route('/jobs/<job_id>/results/<filename>')
+@log_route
+def job_result(job_id, filename):
+    """Download an output file of a background job"""
+    job_queue = jobs.get_queue()
+    job = job_queue.get(job_id) if job_queue is not None else None
+    if job is None or filename not in job.results:
+        abort(404)
+    return send_from_directory(os.path.abspath(job_queue.results_path(job_id)), filename, as_attachment=True)
+
 def is_safe_url(target):
     """ Check that a redirect URL is safe to follow
     From http://flask.pocoo.org/snippets/62/
@@ -0,0 +1,107 @@
+"""Handlers for the 'id-owner', 'id-collisions' and 'id-forget' commands
+(Commands are issued on the command line, per the docopt syntax in __main__.py)
+
+The commands use the object ID index (see object_id_index.py), which is
+populated by checking documents.  No documents are parsed.
+"""
+
+# Local
+from cascade import object_id_index
+from cascade import quicklog
+from cascade.util_eliot import log_function
+
+qlog = quicklog.get_logger()
+lprint = qlog.lprint
+
+@log_function
+def owner(arguments):
+    '''Report which indexed document(s) contain an object ID
+
+    Returns:
+        True if exactly one document (or several with the same content) contains
+        the object ID, false otherwise
+    '''
+    object_id = arguments['<object_id>']
+    index = object_id_index.get_index()
+    owners = index.owners(object_id)
+    if not owners:
+        lprint('Object ID {} does not appear in any indexed document.'.format(object_id))
+        return False
+    lprint('Object ID {} appears in:\n'.format(object_id) +
+           '\n'.join('   "{}"'.format(document) for document in owners))
+    num_documents = index.count_distinct(owners)
+    if num_documents > 1:
+        qlog.error('Object ID {} appears in {} documents'.format(object_id, num_documents))
+        return False
+    return True
+
+@log_function
+def collisions(arguments):
+    '''Report object IDs used by more than one indexed document, and overlapping next_id ranges
+
+    Returns:
+        True if no collisions (or overlaps) were found, false otherwise
+    '''
+    #pylint: disable=locally-disabled, unused-argument
+    index = object_id_index.get_index()
+    lprint('Searching {} indexed documents...'.format(len(index.documents())))
+    return report_collisions(index)
+
+@log_function
+def forget(arguments):
+    '''Remove documents from the object ID index
+
+    Each '<document>' is a document's (or an aggregated zip's) path, or its name in
+    the index (as reported by id-owner or id-collisions).  Forgetting a zip
+    forgets the documents aggregated from it.  With '--missing', every document
+    whose file no longer exists is forgotten instead.
+
+    Returns:
+        True if every document given was found in the index, false otherwise
+    '''
+    index = object_id_index.get_index()
+    if arguments['--missing']:
+        report_forgotten(index.forget_missing())
+        return True
+    indexed = set(index.documents())
+    success = True
+    for document in arguments['<document>']:
+        if document not in indexed:
+            document = object_id_index.document_name(document)
+        forgotten = index.forget_document(document)
+        if not forgotten:
+            qlog.error('"{}" is not in the object ID index'.format(document))
+            success = False
+        report_forgotten(forgotten)
+    return success
+
+def report_forgotten(documents):
+    '''Print the names of documents removed from the index'''
+    if documents:
+        lprint('Forgot:\n' + '\n'.join('   "{}"'.format(document) for document in documents))
+
+def report_collisions(index, documents=None, advisory=False):
+    '''Log each object ID collision and next_id range overlap (among documents, if given)
+
+    Collisions are logged as errors or, if advisory, as warnings (overlaps are
+    always warnings).
+
+    Returns:
+        True if none were found, false otherwise
+    '''
+    log_collision = qlog.warning if advisory else qlog.error
+    found_collisions = index.collisions(documents)
+    for collision in found_collisions:
+        log_collision('Object ID {} appears in multiple documents: {}'.format(
+            collision.object_id, ', '.join('"{}"'.format(document) for document in collision.documents)))
+    overlaps = index.next_id_overlaps(documents)
+    for overlap in overlaps:
+        qlog.warning(
+            'Object ID prefix "{}" is used by "{}" (IDs {}-{}) and "{}" (IDs {}-{}), whose '
+            'ID ranges overlap. New IDs allocated by one may collide with the other.'.format(
+                overlap.prefix,
+                overlap.document_a, overlap.range_a[0], overlap.range_a[1],
+                overlap.document_b, overlap.range_b[0], overlap.range_b[1]))
+    if not found_collisions and not overlaps:
+        lprint('No object ID collisions found.')
+    return not found_collisions and not overlaps
@@ -0,0 +1,162 @@
+'''Fast saving of python-docx packages
+
+python-docx's Document.save() re-serializes every part of the package and
+recompresses the whole .docx.  Cascade's edits only ever touch a few XML parts
+(e.g. annotate only changes word/document.xml), yet saving a document containing
+many embedded images/diagrams would spend nearly all of its time recompressing
+data which hasn't changed.
+
+save_package() writes the same parts python-docx would, but each part whose bytes
+are identical to the corresponding member of the source .docx (same size and CRC)
+is copied from the source zip byte-for-byte, still compressed.  Only the parts
+which actually changed are compressed, at a configurable compression level.
+'''
+
+# Standard library
+import os
+import shutil
+import struct
+import tempfile
+import time
+import zipfile
+import zlib
+
+# Libraries
+from docx.opc.pkgwriter import PackageWriter
+
+# zlib's own default: a good balance of speed and size
+DEFAULT_COMPRESS_LEVEL = 6
+
+# Zip flag bit: sizes and CRC follow the data in a "data descriptor" (rather than
+# being given in the local file header)
+FLAG_DATA_DESCRIPTOR = 0x08
+
+# Local file header: signature, versions, flags, sizes, etc. then the variable
+# length filename and extra fields
+LOCAL_HEADER_FORMAT = '<4s5H3L2H'
+LOCAL_HEADER_SIZE = struct.calcsize(LOCAL_HEADER_FORMAT)
+
+COPY_CHUNK_BYTES = 1 << 20
+
+def save_package(package, source_filename, filename, compress_level=DEFAULT_COMPRESS_LEVEL):
+    '''Save a python-docx OpcPackage (loaded from source_filename) to filename
+
+    source_filename may instead be a (seekable) binary file object holding the
+    source package, e.g. an upload held in memory.
+
+    Returns (copied, compressed): the number of zip members which were copied raw
+    from the source, and the number which were (re)compressed.
+
+    filename may be the source file itself, in which case the package is written
+    to a temporary file which then replaces it.
+    '''
+    for part in package.parts:
+        part.before_marshal()
+    replace_source = (
+        isinstance(source_filename, str)
+        and os.path.exists(filename) and os.path.samefile(filename, source_filename))
+    if replace_source:
+        fd, out_filename = tempfile.mkstemp(suffix='.docx', dir=os.path.dirname(os.path.abspath(filename)))
+        os.close(fd)
+        shutil.copymode(source_filename, out_filename)
+    else:
+        out_filename = filename
+    try:
+        with open(out_filename, 'wb') as out_file, zipfile.ZipFile(source_filename) as source_zip:
+            writer = RawCopyZipWriter(out_file, source_zip, compress_level)
+            #pylint: disable=locally-disabled, protected-access
+            PackageWriter._write_content_types_stream(writer, package.parts)
+            PackageWriter._write_pkg_rels(writer, package.rels)
+            PackageWriter._write_parts(writer, package.parts)
+            writer.close()
+        if replace_source:
+            os.replace(out_filename, filename)
+    except BaseException:
+        os.remove(out_filename)
+        raise
+    return (writer.num_copied, writer.num_compressed)
+
+class RawCopyZipWriter():
+    '''A python-docx PhysPkgWriter which copies unchanged members from a source zip
+
+    Members are written to the zip as raw (already compressed) data: either copied
+    straight from the source zip, or deflated here (which lets the compression
+    level be chosen on any Python version).
+    '''
+    def __init__(self, out_file, source_zip, compress_level):
+        self._zip = zipfile.ZipFile(out_file, 'w', compression=zipfile.ZIP_DEFLATED)
+        self._source_zip = source_zip
+        self._compress_level = compress_level
+        self.num_copied = 0
+        self.num_compressed = 0
+
+    def write(self, pack_uri, blob):
+        '''Write blob to the zip, as the member corresponding to pack_uri'''
+        membername = pack_uri.membername
+        try:
+            source_info = self._source_zip.getinfo(membername)
+        except KeyError:
+            source_info = None
+        if (source_info is not None
+                and source_info.file_size == len(blob)
+                and source_info.CRC == zlib.crc32(blob)):
+            self._copy_member(source_info)
+            self.num_copied += 1
+        else:
+            self._compress_member(membername, blob)
+            self.num_compressed += 1
+
+    def close(self):
+        '''Write the zip's central directory'''
+        self._zip.close()
+
+    def _copy_member(self, source_info):
+        '''Copy a member (and its compressed data) from the source zip'''
+        info = zipfile.ZipInfo(source_info.filename, source_info.date_time)
+        info.compress_type = source_info.compress_type
+        info.flag_bits = source_info.flag_bits & ~FLAG_DATA_DESCRIPTOR
+        info.external_attr = source_info.external_attr
+        info.create_system = source_info.create_system
+        info.CRC = source_info.CRC
+        info.compress_size = source_info.compress_size
+        info.file_size = source_info.file_size
+        source_file = self._source_zip.fp
+        source_file.seek(source_info.header_offset)
+        header = struct.unpack(LOCAL_HEADER_FORMAT, source_file.read(LOCAL_HEADER_SIZE))
+        # Skip the filename and extra fields
+        source_file.seek(header[-2] + header[-1], os.SEEK_CUR)
+        self._write_header(info)
+        remaining = info.compress_size
+        while remaining:
+            chunk = source_file.read(min(remaining, COPY_CHUNK_BYTES))
+            if not chunk:
+                raise zipfile.BadZipFile('Truncated member "{}"'.format(info.filename))
+            self._zip.fp.write(chunk)
+            remaining -= len(chunk)
+        self._end_member(info)
+
+    def _compress_member(self, membername, blob):
+        '''Deflate blob and write it as a new member'''
+        info = zipfile.ZipInfo(membername, time.localtime(time.time())[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o600 << 16
+        compressor = zlib.compressobj(self._compress_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        data = compressor.compress(blob) + compressor.flush()
+        info.CRC = zlib.crc32(blob)
+        info.compress_size = len(data)
+        info.file_size = len(blob)
+        self._write_header(info)
+        self._zip.fp.write(data)
+        self._end_member(info)
+
+    def _write_header(self, info):
+        info.header_offset = self._zip.fp.tell()
+        self._zip.fp.write(info.FileHeader())
+
+    def _end_member(self, info):
+        '''Register a member written directly to the zip's file'''
+        #pylint: disable=locally-disabled, protected-access
+        self._zip.filelist.append(info)
+        self._zip.NameToInfo[info.filename] = info
+        self._zip.start_dir = self._zip.fp.tell()
+        self._zip._didModify = True
@@ -0,0 +1,337 @@
+"""Export requirement directives (e.g. those gathered by aggregate) to tabular files
+
+Each directive becomes a row, and each directive property a column.  Columns
+are added as new properties are found.  Enumeration properties (see
+add_ennumeration()) are flattened into one column per enumeration value, holding
+"X" where the directive's property includes that value.  List properties are
+joined into a single comma separated value.
+
+Supported formats (by file extension; see EXPORTERS):
+    xlsx:       Excel workbook, with formatted headings and an auto filter
+    csv:        Comma separated values, with a single heading row
+    jsonl:      JSON Lines; one JSON object per directive, of its non-empty columns
+    parquet:    Apache Parquet (requires pandas, plus pyarrow or fastparquet)
+"""
+
+# Standard library
+import abc
+import csv
+import json
+import tempfile
+import importlib.util
+
+# Libraries
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Side, PatternFill, Color, NamedStyle
+from openpyxl.utils import get_column_letter
+
+# Local
+from cascade.custom_exceptions import FatalUserError
+
+MAX_XLSX_COL_WIDTH = 50
+
+class Exporter(abc.ABC):
+    """ Base class for exporters: flattens directives into rows of columns
+
+    Since the full set of columns is only known once every row has been added,
+    rows are spooled to a temporary file (as JSON lists of [column, value]
+    pairs) until save(), so memory use is flat regardless of the number of rows.
+    Subclasses write the file in save(), typically from spooled_rows().  A
+    subclass which writes each row as it is added instead sets SPOOLS_ROWS to
+    False and overrides write_row().
+    """
+
+    # True if rows are spooled (to self.spool) until save()
+    SPOOLS_ROWS = True
+
+    def __init__(self, filename):
+        self.filename = filename
+
+        self.column_map = {}
+        self.headers = []
+        self.next_column = 1
+        self.num_rows = 0
+
+        self.enumeration_properties = []
+        # (name, first column, last column) of each enumeration
+        self.enumerations = []
+
+        self.spool = tempfile.TemporaryFile('w+', encoding='utf-8') if self.SPOOLS_ROWS else None
+        self.current_row_cells = []
+
+    def add_row(self, data_dict):
+        """Add a row containing all properties from a dict of the requirements directive"""
+        for key, value in data_dict.items():
+            if key in self.enumeration_properties:
+                for value2 in value:
+                    self.add_property(value2, 'X')
+            else:
+                if isinstance(value, (list,)):
+                    self.add_property(key, ', '.join(value))
+                else:
+                    self.add_property(key, value)
+        self.write_row(self.current_row_cells)
+        self.current_row_cells = []
+        self.num_rows += 1
+
+    def write_row(self, cells):
+        """Write a completed row, given as a list of [column, value] pairs"""
+        self.spool.write(json.dumps(cells) + '\n')
+
+    def add_property(self, key, value):
+        """add a new property to the current row"""
+        self.add_column_header(key)
+        self.current_row_cells.append([self.column_map[key], value])
+
+    def add_column_header(self, key):
+        """Add a column header if it doesn't already exist"""
+        if key not in self.column_map:
+            self.column_map[key] = self.next_column
+            self.headers.append(key)
+            self.next_column += 1
+
+    def add_ennumeration(self, name, values):
+        """Add columns for an enumeration
+
+        The enumeration values become column headers.  (The enumeration name
+        itself only appears in formats with a heading row above the column
+        headers, i.e. xlsx.)
+        """
+        start_column = self.next_column
+        self.enumeration_properties.append(name)
+        for value in values:
+            self.add_column_header(value)
+        self.enumerations.append((name, start_column, self.next_column - 1))
+
+    def spooled_rows(self):
+        """Yield each spooled row, as a list of values (None for empty cells) of every column
+
+        The spool is closed once all rows have been read.
+        """
+        num_columns = self.next_column - 1
+        self.spool.seek(0)
+        for line in self.spool:
+            values = [None] * num_columns
+            for column, value in json.loads(line):
+                values[column - 1] = value
+            yield values
+        self.spool.close()
+
+    @classmethod
+    def check_available(cls):
+        """Raise FatalUserError if a library needed by the exporter is not installed"""
+
+    @abc.abstractmethod
+    def save(self):
+        """Write the output file"""
+
+class ExcelExporter(Exporter):
+    """ Export requirement directives to an Excel (.xlsx) file
+
+    The workbook is written with openpyxl's write-only (streaming) mode, using
+    named styles shared by all cells.  Column widths are tracked as rows are
+    added, since they must be written before the rows.
+    """
+
+    # Column width scaling (characters -> width) for headings and content cells
+    HEADER_WIDTH_SCALE = 1.4
+    CONTENT_WIDTH_SCALE = 1.2
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        self.tier_1_header_row = 1
+        self.tier_2_header_row = self.tier_1_header_row + 1
+        self.column_widths = {}
+
+    @staticmethod
+    def make_named_styles():
+        """Return the named styles used by the workbook"""
+        fill = PatternFill(
+            patternType='solid',
+            fill_type='solid',
+            fgColor=Color('EBF1DE') # RGB: 235, 241, 222
+            )
+        alignment_default = Alignment(horizontal='left', wrapText=True, vertical='top')
+        thin = Side(style='thin')
+        return [
+            NamedStyle(
+                name='Cascade Cell',
+                border=Border(left=thin, right=thin, top=thin, bottom=thin),
+                alignment=alignment_default),
+            NamedStyle(
+                name='Cascade Heading',
+                border=Border(left=thin, right=thin, top=thin, bottom=thin),
+                alignment=alignment_default,
+                fill=fill),
+            NamedStyle(
+                name='Cascade Enumeration Left',
+                border=Border(left=thin, top=thin, bottom=thin),
+                fill=fill),
+            NamedStyle(
+                name='Cascade Enumeration Center',
+                border=Border(top=thin, bottom=thin),
+                fill=fill),
+            NamedStyle(
+                name='Cascade Enumeration Right',
+                border=Border(right=thin, top=thin, bottom=thin),
+                fill=fill),
+            ]
+
+    def add_property(self, key, value):
+        """add a new property to the current row"""
+        super().add_property(key, value)
+        if value:
+            self._fit_column(self.column_map[key], value, self.CONTENT_WIDTH_SCALE)
+
+    def add_column_header(self, key):
+        """Add a column header if it doesn't already exist"""
+        if key not in self.column_map:
+            self._fit_column(self.next_column, key, self.HEADER_WIDTH_SCALE)
+        super().add_column_header(key)
+
+    def _fit_column(self, column, value, width_scale):
+        """Widen a column (if necessary) to fit a value"""
+        width = min(len(str(value)) * width_scale, MAX_XLSX_COL_WIDTH)
+        if width > self.column_widths.get(column, 0):
+            self.column_widths[column] = width
+
+    def save(self):
+        """Write the workbook (heading rows, then the spooled rows) and save it
+
+        * Heading cells are filled, and all cells bordered
+        * Column widths are based on content size
+        * An auto filter covers the headings and content
+        """
+        workbook = Workbook(write_only=True)
+        for named_style in self.make_named_styles():
+            workbook.add_named_style(named_style)
+        worksheet = workbook.create_sheet()
+        num_columns = self.next_column - 1
+
+        for column, width in self.column_widths.items():
+            worksheet.column_dimensions[get_column_letter(column)].width = width
+        worksheet.auto_filter.ref = 'B{}:{}{}'.format(
+            self.tier_2_header_row, get_column_letter(num_columns), self.tier_2_header_row + self.num_rows)
+
+        # Enumeration names
+        row = [None] * num_columns
+        for name, start_column, end_column in self.enumerations:
+            for column in range(start_column, end_column + 1):
+                if column == start_column:
+                    style = 'Cascade Enumeration Left'
+                elif column == end_column:
+                    style = 'Cascade Enumeration Right'
+                else:
+                    style = 'Cascade Enumeration Center'
+                row[column - 1] = self._make_cell(
+                    worksheet, name if column == start_column else None, style)
+        worksheet.append(row)
+
+        # Column headings
+        worksheet.append([self._make_cell(worksheet, key, 'Cascade Heading') for key in self.headers])
+
+        # Content.  Rows are written as they are appended, so the same (styled)
+        # cells are reused for every row, rather than styling a new cell per value.
+        row = [self._make_cell(worksheet, None, 'Cascade Cell') for _ in range(num_columns)]
+        for values in self.spooled_rows():
+            for cell, value in zip(row, values):
+                cell.value = value
+            worksheet.append(row)
+
+        workbook.save(self.filename)
+
+    @staticmethod
+    def _make_cell(worksheet, value, style):
+        cell = WriteOnlyCell(worksheet, value=value)
+        cell.style = style
+        return cell
+
+class CsvExporter(Exporter):
+    """ Export requirement directives to a CSV (.csv) file, with a single heading row"""
+
+    def save(self):
+        """Write the heading row, then the spooled rows"""
+        with open(self.filename, 'w', newline='', encoding='utf-8') as out_file:
+            writer = csv.writer(out_file)
+            writer.writerow(self.headers)
+            writer.writerows(self.spooled_rows())
+
+class JsonLinesExporter(Exporter):
+    """ Export requirement directives to a JSON Lines (.jsonl) file
+
+    Each row is written (as a JSON object mapping column headers to values) as
+    soon as it is added, so nothing is spooled.
+    """
+
+    SPOOLS_ROWS = False
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        self.out_file = open(filename, 'w', encoding='utf-8')
+
+    def write_row(self, cells):
+        """Write a completed row, given as a list of [column, value] pairs"""
+        row = {self.headers[column - 1]: value for column, value in cells}
+        self.out_file.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+    def save(self):
+        """Close the file"""
+        self.out_file.close()
+
+class ParquetExporter(Exporter):
+    """ Export requirement directives to an Apache Parquet (.parquet) file
+
+    The file is written by pandas, which requires a Parquet engine (pyarrow or
+    fastparquet).
+    """
+
+    ENGINES = ('pyarrow', 'fastparquet')
+
+    @classmethod
+    def check_available(cls):
+        """Raise FatalUserError unless pandas and a Parquet engine are installed"""
+        if not importlib.util.find_spec('pandas'):
+            raise FatalUserError('Parquet export requires the "pandas" package, which is not installed.')
+        if not any(importlib.util.find_spec(engine) for engine in cls.ENGINES):
+            raise FatalUserError(
+                'Parquet export requires the "pyarrow" or "fastparquet" package, '
+                'and neither is installed.')
+
+    def save(self):
+        """Write the spooled rows (as one DataFrame) to the file"""
+        import pandas
+        data_frame = pandas.DataFrame(list(self.spooled_rows()), columns=self.headers)
+        data_frame.to_parquet(self.filename, index=False)
+
+# Export format (i.e. output file extension) -> Exporter class
+EXPORTERS = {
+    'xlsx':     ExcelExporter,
+    'csv':      CsvExporter,
+    'jsonl':    JsonLinesExporter,
+    'parquet':  ParquetExporter,
+}
+
+def parse_formats(formats):
+    """Parse a comma separated list of export formats (e.g. "xlsx,csv") into a list
+
+    Each format's exporter is checked for its libraries, so e.g. a missing
+    Parquet engine is reported before any documents are processed.
+
+    Raises:
+        FatalUserError if a format is not supported (or its libraries are not installed)
+    """
+    parsed = []
+    for export_format in formats.split(','):
+        export_format = export_format.strip().lower().lstrip('.')
+        if not export_format:
+            continue
+        if export_format not in EXPORTERS:
+            raise FatalUserError('Unsupported export format "{}". Supported formats are: {}.'.format(
+                export_format, ', '.join(EXPORTERS)))
+        if export_format not in parsed:
+            EXPORTERS[export_format].check_available()
+            parsed.append(export_format)
+    if not parsed:
+        raise FatalUserError('No export format was given.')
+    return parsed
@@ -0,0 +1,298 @@
+'''Background jobs for the web interface
+
+Long operations (e.g. aggregating a large zip) can take longer than the proxy in
+front of the web server will wait for a response.  Instead of running them within
+the request, cmd_http submits them to a JobQueue and responds at once with the
+job's ID.  The browser then polls the job (/jobs/<job_id>) for its progress (its
+output so far) and, once it has finished, its download links.
+
+Each job has a directory (under the queue's directory) holding:
+
+    job.json        The job's state (see Job), replaced atomically on each change
+    log.txt         The job's output, written as it runs
+    results/        The job's output files
+
+so any process (e.g. any of several http worker processes) can report on any job.
+Jobs run in a pool of threads in the process which submitted them.
+
+While a job is queued or running, that process touches its job.json every
+HEARTBEAT_INTERVAL seconds.  A job whose heartbeat stops (for longer than
+stale_seconds), or whose process no longer exists, is reported as failed, e.g.
+after the server (or its container) was restarted.  A process which is exiting
+(e.g. a recycled http worker, see wsgi_server.py) calls drain(), which gives its
+running jobs a while to finish and then marks any unfinished jobs as failed.
+
+Finished jobs (and their output files) are deleted once they are older than
+expire_seconds, by a sweeper thread.
+
+Jobs are disabled unless configure() is called (which cmd_http does).
+'''
+
+# Standard library
+import os
+import json
+import time
+import uuid
+import shutil
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Local
+from cascade import quicklog
+
+qlog = quicklog.get_logger()
+
+DEFAULT_WORKERS = 2
+DEFAULT_EXPIRE_SECONDS = 24 * 60 * 60
+DEFAULT_SWEEP_INTERVAL = 10 * 60 # seconds
+DEFAULT_STALE_SECONDS = 60
+
+# Seconds between heartbeats of a process's unfinished jobs
+HEARTBEAT_INTERVAL = 10
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+FINISHED_STATES = (DONE, FAILED)
+
+JOB_FILENAME = 'job.json'
+LOG_FILENAME = 'log.txt'
+RESULTS_DIRECTORY = 'results'
+
+# A job's state
+#   job_id:     The job's ID
+#   operation:  Text description of the job's command (e.g. "Annotate")
+#   status:     One of QUEUED, RUNNING, DONE, FAILED
+#   created:    Time the job was submitted (seconds since the epoch)
+#   finished:   Time the job finished (None if it hasn't)
+#   pid:        ID of the process running the job (job.json's modification time
+#               is the time of the process's last heartbeat for the job)
+#   results:    The job's output filenames (in its results directory)
+Job = namedtuple('Job', 'job_id operation status created finished pid results')
+
+# The queue in use (None if disabled). Set by configure().
+_queue = None
+
+def configure(
+        directory,
+        workers=DEFAULT_WORKERS,
+        expire_seconds=DEFAULT_EXPIRE_SECONDS,
+        sweep_interval=DEFAULT_SWEEP_INTERVAL,
+        stale_seconds=DEFAULT_STALE_SECONDS,
+        enabled=True):
+    '''Configure (or disable) the job queue used by the web interface'''
+    global _queue
+    _queue = JobQueue(directory, workers, expire_seconds, sweep_interval, stale_seconds) if enabled else None
+
+def get_queue():
+    '''Return the configured JobQueue, or None if jobs are disabled'''
+    return _queue
+
+def drain(timeout):
+    '''Drain the configured job queue (if any) before this process exits, see JobQueue.drain()'''
+    if _queue is not None:
+        _queue.drain(timeout)
+
+class JobQueue():
+    ''' Runs jobs in background threads, keeping their state, output and results in a directory
+
+    The thread pool, the heartbeat thread and the sweeper thread are started on
+    first use, in each process which uses the queue (threads don't survive
+    forking, e.g. of http worker processes).
+    '''
+    def __init__(self, directory, workers, expire_seconds, sweep_interval, stale_seconds=DEFAULT_STALE_SECONDS):
+        self.directory = directory
+        self.workers = workers
+        self.expire_seconds = expire_seconds
+        self.sweep_interval = sweep_interval
+        self.stale_seconds = stale_seconds
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        # The futures of this process's unfinished jobs, by job ID
+        self._futures = {}
+
+    def _start(self):
+        '''Start the thread pool, the heartbeat thread and the sweeper thread (once per process)'''
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            self._futures = {}
+            threading.Thread(target=self._heartbeat_periodically, name='job_heartbeat', daemon=True).start()
+            threading.Thread(target=self._sweep_periodically, name='job_sweeper', daemon=True).start()
+            self._pid = os.getpid()
+
+    def job_path(self, job_id, *names):
+        '''Return the path of a job's directory (or of a file within it)'''
+        return os.path.join(self.directory, job_id, *names)
+
+    def results_path(self, job_id):
+        '''Return the directory in which a job's command should write its output files'''
+        return self.job_path(job_id, RESULTS_DIRECTORY)
+
+    def submit(self, operation, func):
+        '''Queue func(results_path) to run in the background. Returns the job's ID
+
+        func is called with the job's results directory, with printed output
+        captured to the job's log.  It returns the filenames of its output files
+        (in the results directory), or None if it failed.
+        '''
+        self._start()
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.results_path(job_id))
+        self._write_job(Job(job_id, operation, QUEUED, time.time(), None, os.getpid(), []))
+        with self._lock:
+            self._futures[job_id] = self._executor.submit(self._run, job_id, func)
+        return job_id
+
+    def get(self, job_id):
+        '''Return a job's Job, or None if there is no such job (or it has expired)'''
+        if not _is_job_id(job_id):
+            return None
+        try:
+            with open(self.job_path(job_id, JOB_FILENAME), 'r') as in_file:
+                job = Job(**json.load(in_file))
+                heartbeat = os.fstat(in_file.fileno()).st_mtime
+        except (OSError, ValueError, TypeError):
+            return None
+        if job.status not in FINISHED_STATES and (
+                time.time() - heartbeat > self.stale_seconds or not _process_exists(job.pid)):
+            # The process running the job has died (or its ID has since been reused)
+            job = job._replace(status=FAILED, finished=heartbeat)
+        return job
+
+    def read_log(self, job_id):
+        '''Return a job's output so far'''
+        try:
+            with open(self.job_path(job_id, LOG_FILENAME), 'r', encoding='utf-8') as in_file:
+                return in_file.read()
+        except OSError:
+            return ''
+
+    def _run(self, job_id, func):
+        '''Run a job (in a pool thread)'''
+        results = None
+        try:
+            job = self.get(job_id)
+            if job is None:
+                # Its state can't be read (or it has been swept), so there's nothing to report to
+                qlog.error('Job {} no longer exists; not running it'.format(job_id))
+                return
+            self._write_job(job._replace(status=RUNNING))
+            with open(self.job_path(job_id, LOG_FILENAME), 'w', encoding='utf-8') as log_file, qlog.scope():
+                qlog.start_print_capture(stream=log_file)
+                try:
+                    results = func(self.results_path(job_id))
+                except Exception as e:
+                    qlog.fatal_exception(e)
+                finally:
+                    qlog.stop_print_capture()
+            self._write_job(job._replace(
+                status=DONE if results else FAILED,
+                finished=time.time(),
+                results=list(results or [])))
+        finally:
+            with self._lock:
+                self._futures.pop(job_id, None)
+
+    def drain(self, timeout):
+        '''Prepare for this process to exit: wait for its jobs, then mark those unfinished as failed
+
+        Queued jobs are cancelled.  Running jobs are given up to timeout seconds
+        to finish.  Jobs which are then still running are marked as failed (and
+        a note is added to their output).
+        '''
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            futures = dict(self._futures)
+        running = []
+        for job_id, future in futures.items():
+            if future.cancel():
+                self._interrupt(job_id, 'The job was cancelled (the server process was stopping).')
+            else:
+                running.append(future)
+        wait(running, timeout=timeout)
+        with self._lock:
+            unfinished = list(self._futures)
+        for job_id in unfinished:
+            self._interrupt(job_id, 'The job was interrupted (the server process was stopping).')
+        self._executor.shutdown(wait=False)
+
+    def _interrupt(self, job_id, message):
+        '''Mark an unfinished job as failed, noting why in its output'''
+        job = self.get(job_id)
+        if job is None or job.status in FINISHED_STATES:
+            return
+        with open(self.job_path(job_id, LOG_FILENAME), 'a', encoding='utf-8') as log_file:
+            log_file.write('\nERROR: {}\n'.format(message))
+        self._write_job(job._replace(status=FAILED, finished=time.time()))
+        with self._lock:
+            self._futures.pop(job_id, None)
+
+    def _write_job(self, job):
+        '''Write a job's state (atomically, so readers never see a partial file)'''
+        temp_fd, temp_path = tempfile.mkstemp(dir=self.job_path(job.job_id), suffix='.tmp')
+        with os.fdopen(temp_fd, 'w') as out_file:
+            json.dump(job._asdict(), out_file)
+        os.replace(temp_path, self.job_path(job.job_id, JOB_FILENAME))
+
+    def sweep(self):
+        '''Delete jobs which finished more than expire_seconds ago'''
+        now = time.time()
+        for job_id in os.listdir(self.directory):
+            job = self.get(job_id)
+            if job is None:
+                # Not a job, or a job whose state was never written
+                path = self.job_path(job_id)
+                if not _is_job_id(job_id) or now - os.path.getmtime(path) < self.expire_seconds:
+                    continue
+            elif job.status not in FINISHED_STATES or now - job.finished < self.expire_seconds:
+                continue
+            qlog.debug('Deleting expired job {}'.format(job_id))
+            shutil.rmtree(self.job_path(job_id), ignore_errors=True)
+
+    def _heartbeat_periodically(self):
+        '''The heartbeat thread: touch the job.json of each of this process's unfinished jobs'''
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            with self._lock:
+                job_ids = list(self._futures)
+            for job_id in job_ids:
+                try:
+                    os.utime(self.job_path(job_id, JOB_FILENAME))
+                except OSError:
+                    pass
+
+    def _sweep_periodically(self):
+        '''The sweeper thread'''
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                qlog.error('Job sweep failed: {}'.format(e), quiet=True)
+            time.sleep(self.sweep_interval)
+
+def _is_job_id(text):
+    '''True if text could be a job ID (so it is safe to use as a filename)'''
+    return len(text) == 32 and all(c in '0123456789abcdef' for c in text)
+
+def _process_exists(pid):
+    '''True if a process (on this host) with the given ID exists'''
+    if os.name == 'nt':
+        # os.kill() would terminate the process
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # e.g. the process belongs to another user
+        return True
+    return True
@@ -0,0 +1,337 @@
+'''Asynchronous, batched log file writing
+
+Quicklog and the eliot rotating_logfile write each log record from a background
+thread, so that logging never waits on file I/O:
+
+* Records are put on a bounded queue (AsyncWriter).  When the queue is full the
+  caller either blocks until there is room (policy 'block', the default) or the
+  record is dropped and counted (policy 'drop').
+* The writer thread takes records off the queue in batches, formats them and
+  writes each batch with a single write.  The file is flushed periodically
+  (every flush_interval seconds while there is unflushed output), and on flush()
+  or close().
+* Log files are rotated by size (RotatingFile), using a count of the bytes
+  written rather than asking the file for its position.
+
+Forking (e.g. by worker_pool) is handled: the writers are flushed before a fork,
+and a forked child starts its own writer threads (which a child would otherwise
+lack) with empty queues.  Writers are flushed and closed at exit.
+'''
+
+# Standard library
+import os
+import sys
+import time
+import queue
+import atexit
+import logging
+import weakref
+import threading
+import traceback
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_FLUSH_INTERVAL = 1.0 # seconds
+
+# Queue full policies
+POLICY_BLOCK = 'block'
+POLICY_DROP = 'drop'
+POLICIES = (POLICY_BLOCK, POLICY_DROP)
+
+# Most records written by a single write
+MAX_BATCH = 1000
+
+# All open AsyncWriters
+_writers = weakref.WeakSet()
+
+def flush_all():
+    '''Flush all open writers, e.g. before forking (see worker_pool.py)'''
+    for writer in list(_writers):
+        writer.flush()
+
+def close_all():
+    '''Flush and close all open writers'''
+    for writer in list(_writers):
+        writer.close()
+
+class RotatingFile():
+    ''' A log file (appended to as UTF-8) which is rotated by size
+
+    On rotation "<filename>" is renamed "<filename>.1" (and any "<filename>.1" to
+    "<filename>.2", etc.), keeping at most backup_count old files.
+
+    The size of the file is tracked as it is written, so checking whether it
+    needs rotation doesn't touch the file.  Several processes (e.g. http worker
+    processes) may append to the same file; if another process has already
+    rotated it, this process just reopens the (new) file.
+    '''
+    def __init__(self, filename, max_bytes, backup_count, encoding='utf-8'):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.encoding = encoding
+        self._open()
+
+    def _open(self):
+        self.file = open(self.filename, 'ab')
+        self.num_bytes = os.fstat(self.file.fileno()).st_size
+
+    def write(self, text, rotate=True):
+        '''Write text to the file, first rotating it if the text would take it past max_bytes (and rotate is True)'''
+        data = text.encode(self.encoding, errors='backslashreplace')
+        if rotate:
+            self.rotate_if_needed(len(data))
+        self.file.write(data)
+        self.num_bytes += len(data)
+
+    def rotate_if_needed(self, pending_bytes=0):
+        '''Rotate the file if it is (or, after writing pending_bytes, would be) larger than max_bytes'''
+        if (self.backup_count > 0 and self.max_bytes > 0 and self.num_bytes
+                and self.num_bytes + pending_bytes > self.max_bytes):
+            self.rotate()
+
+    def rotate(self):
+        '''Rotate the file (see class docstring)'''
+        current = self._is_current()
+        self.file.close()
+        if not current:
+            # Already rotated by another process
+            self._open()
+            return
+        for index in range(self.backup_count - 1, 0, -1):
+            source = '{}.{}'.format(self.filename, index)
+            if os.path.exists(source):
+                os.replace(source, '{}.{}'.format(self.filename, index + 1))
+        if os.path.exists(self.filename):
+            os.replace(self.filename, self.filename + '.1')
+        self._open()
+
+    def _is_current(self):
+        '''True if filename is still the file which was opened (i.e. it hasn't been renamed by a rotation)'''
+        try:
+            return os.path.samestat(os.stat(self.filename), os.fstat(self.file.fileno()))
+        except (OSError, ValueError):
+            return False
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class AsyncWriter():
+    ''' Writes records from a background thread, fed by a bounded queue
+
+    write_batch(records) is called (by the writer thread) with each batch of
+    records, in the order they were put, and flush() to flush what has been
+    written.  lock is held while either is called; hold it to use the underlying
+    file from another thread.
+    '''
+    def __init__(
+            self,
+            write_batch,
+            flush,
+            queue_size=DEFAULT_QUEUE_SIZE,
+            policy=POLICY_BLOCK,
+            flush_interval=DEFAULT_FLUSH_INTERVAL,
+            name='log_writer'):
+        if policy not in POLICIES:
+            raise ValueError('Unknown log queue policy "{}" (expected one of: {})'.format(
+                policy, ', '.join(POLICIES)))
+        self._write_batch = write_batch
+        self._flush = flush
+        self._queue_size = queue_size
+        self._policy = policy
+        self._flush_interval = flush_interval
+        self._name = name
+        self._closed = False
+        # Number of records dropped because the queue was full (policy 'drop')
+        self.dropped = 0
+        self._start()
+        _writers.add(self)
+
+    def _start(self):
+        '''Start the writer thread (with a new, empty queue)'''
+        self.lock = threading.Lock()
+        self._queue = queue.Queue(self._queue_size)
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+        self._thread.start()
+
+    def put(self, record):
+        '''Queue a record to be written'''
+        if self._closed:
+            return
+        if self._pid != os.getpid():
+            # Forked without the at-fork hooks (i.e. Python < 3.7)
+            self._start()
+        if self._policy == POLICY_BLOCK:
+            self._queue.put(record)
+        else:
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+
+    def flush(self):
+        '''Wait until every record queued so far has been written and flushed'''
+        self._control(_FLUSH)
+
+    def close(self):
+        '''Flush, then stop the writer thread. Records put after closing are ignored'''
+        if self._closed:
+            return
+        self._control(_CLOSE)
+        self._thread.join()
+        self._closed = True
+        _writers.discard(self)
+
+    def _control(self, kind):
+        '''Send a control message to the writer thread, and wait for it to be handled'''
+        if self._closed or threading.current_thread() is self._thread:
+            return
+        if self._pid != os.getpid():
+            self._start()
+        control = _Control(kind)
+        self._queue.put(control)
+        control.done.wait()
+
+    def _run(self):
+        '''The writer thread'''
+        unflushed = False
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(
+                    timeout=max(0, last_flush + self._flush_interval - time.monotonic()) if unflushed else None)
+            except queue.Empty:
+                self._locked_call(self._flush)
+                unflushed = False
+                last_flush = time.monotonic()
+                continue
+
+            # Gather a batch of records (up to any control message)
+            batch = []
+            control = None
+            while True:
+                if isinstance(item, _Control):
+                    control = item
+                    break
+                batch.append(item)
+                if len(batch) >= MAX_BATCH:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._locked_call(self._write_batch, batch)
+                unflushed = True
+            if unflushed and (control is not None or time.monotonic() - last_flush >= self._flush_interval):
+                self._locked_call(self._flush)
+                unflushed = False
+                last_flush = time.monotonic()
+            if control is not None:
+                control.done.set()
+                if control.kind == _CLOSE:
+                    return
+
+    def _locked_call(self, func, *args):
+        '''Call func(*args) holding lock. Errors are reported (as logging does), but don't stop the thread'''
+        with self.lock:
+            try:
+                func(*args)
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
+
+    def _before_fork(self):
+        '''Flush (holding lock through the fork, so that no write is in progress)'''
+        self.lock.acquire()
+        try:
+            self._flush()
+        except Exception:
+            pass
+
+    def _after_fork_in_parent(self):
+        self.lock.release()
+
+    def _after_fork_in_child(self):
+        '''Start a writer thread for the child. Records queued by the parent are left to the parent'''
+        if not self._closed:
+            self._start()
+
+class QueuedRotatingFileHandler(logging.Handler):
+    ''' A logging handler which writes to a RotatingFile through an AsyncWriter
+
+    Records are formatted by the writer thread.
+
+    The file is opened (and the writer started) before the handler is
+    registered with logging, so if the file can't be opened no half-built
+    handler is left for logging to flush or close at exit.
+    '''
+    def __init__(
+            self,
+            filename,
+            max_bytes,
+            backup_count,
+            queue_size=DEFAULT_QUEUE_SIZE,
+            policy=POLICY_BLOCK,
+            flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self._file = RotatingFile(filename, max_bytes, backup_count)
+        self._writer = AsyncWriter(
+            self._write_records,
+            self._file.flush,
+            queue_size=queue_size,
+            policy=policy,
+            flush_interval=flush_interval,
+            name='log_writer:' + filename)
+        super().__init__()
+
+    @property
+    def dropped(self):
+        '''Number of records dropped because the queue was full'''
+        return self._writer.dropped
+
+    def emit(self, record):
+        self._writer.put(record)
+
+    def _write_records(self, records):
+        self._file.write(''.join(self.format(record) + '\n' for record in records))
+
+    def flush(self):
+        self._writer.flush()
+
+    def close(self):
+        self._writer.close()
+        with self._writer.lock:
+            self._file.close()
+        super().close()
+
+# Writer thread control messages
+_FLUSH = 'flush'
+_CLOSE = 'close'
+
+class _Control():
+    def __init__(self, kind):
+        self.kind = kind
+        self.done = threading.Event()
+
+def _before_fork():
+    for writer in list(_writers):
+        writer._before_fork()
+
+def _after_fork_in_parent():
+    for writer in list(_writers):
+        writer._after_fork_in_parent()
+
+def _after_fork_in_child():
+    for writer in list(_writers):
+        writer._after_fork_in_child()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(
+        before=_before_fork,
+        after_in_parent=_after_fork_in_parent,
+        after_in_child=_after_fork_in_child)
+
+atexit.register(close_all)
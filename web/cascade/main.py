@@ -1,36 +1,47 @@
 '''Dispatch cascade command (from command line) to the relevant command handler module'''
 
+# Standard library
+import importlib
+
 # Library
 from eliot import Message
 
 # Local
-from cascade import cmd_check
-from cascade import cmd_annotate
-from cascade import cmd_debug_dump
-from cascade import cmd_debug_dumpxl
-from cascade import cmd_apply_styles
-from cascade import cmd_http
 from cascade import quicklog
 
 qlog = quicklog.get_logger()
 
+# Command -> (module, handler function name).
+# Command modules are only imported when their command is dispatched, so that e.g.
+# 'check' doesn't pay for importing flask (cmd_http) or openpyxl (cmd_debug_dumpxl).
+COMMAND_HANDLERS = {
+    'check':            ('cascade.cmd_check', 'check'),
+    'annotate':         ('cascade.cmd_annotate', 'annotate'),
+    'annotate-reset':   ('cascade.cmd_annotate', 'annotate_reset'),
+    'debug-dump':       ('cascade.cmd_debug_dump', 'dump'),
+    'debug-dumpxl':     ('cascade.cmd_debug_dumpxl', 'dump'),
+    'apply-styles':     ('cascade.cmd_apply_styles', 'apply_styles'),
+    'id-owner':         ('cascade.cmd_object_ids', 'owner'),
+    'id-collisions':    ('cascade.cmd_object_ids', 'collisions'),
+    'id-forget':        ('cascade.cmd_object_ids', 'forget'),
+    'aggregate':        ('cascade.cmd_aggregate', 'aggregate'),
+    'http':             ('cascade.cmd_http', 'http'),
+}
+
+def get_handler(command):
+    '''Import (if necessary) and return the handler function for a command'''
+    module_name, function_name = COMMAND_HANDLERS[command]
+    return getattr(importlib.import_module(module_name), function_name)
+
 def main(arguments):
-    '''Dispatch cascade command (from command line) to the relevant command handler module'''
-
-    jump_table = {
-        'check':            cmd_check.check,
-        'annotate':         cmd_annotate.annotate,
-        'annotate-reset':   cmd_annotate.annotate_reset,
-        'debug-dump':       cmd_debug_dump.dump,
-        'debug-dumpxl':     cmd_debug_dumpxl.dump,
-        'apply-styles':     cmd_apply_styles.apply_styles,
-        'http':             cmd_http.http,
-    }
-
-    for command, handler in jump_table.items():
+    '''Dispatch cascade command (from command line) to the relevant command handler module
+
+    Returns the command handler's return value
+    '''
+
+    for command in COMMAND_HANDLERS:
         if command in arguments and arguments[command]:
             Message.log(message_type='dispatch_command', command=command)
-            handler(arguments)
-            return
+            return get_handler(command)(arguments)
 
     qlog.error("The requested operation is not yet implemented.")
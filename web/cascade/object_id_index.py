@@ -0,0 +1,320 @@
+'''Persistent, cross-document index of object IDs
+
+cmd_check finds duplicate object IDs within a single document.  This index
+records the object IDs (and each prefix's "next_id") of every document which
+passes check (including each document checked by aggregate), in an SQLite
+database.  It answers questions about the whole corpus of documents without
+re-parsing any of them:
+
+    * Which document(s) own a given object ID?  (owners())
+    * Which object IDs appear in more than one document?  (collisions())
+    * Which documents sharing a prefix have overlapping ranges of object ID
+      numbers, i.e. will allocate the same new IDs?  (next_id_overlaps())
+
+Each document is indexed under a name (see document_name(), upload_name() and
+member_name()), so re-checking an updated document replaces its previous
+entries:
+
+    * A document on disk: its absolute path, e.g. "/specs/a/spec.docx"
+    * An uploaded document (which is not on disk): "upload:<digest>/<filename>",
+      so different uploads of the same filename are indexed separately
+    * A document in an aggregate zip: "<zip's name>!/<path in the zip>", e.g.
+      "/specs/all.zip!/a/spec.docx"
+
+Documents with the same content (digest), e.g. a file which was both checked
+and uploaded, are treated as the same document, so are never reported as
+colliding with each other.  The entries of documents which were moved or
+deleted remain until they are forgotten (see forget_document() and
+forget_missing(), and the id-forget command).
+
+The index is disabled unless configure() is called (which __main__ does, unless
+the --no-index or --no-cache option is given).
+'''
+
+# Standard library
+import os
+import sqlite3
+import time
+from contextlib import closing
+from collections import namedtuple
+
+# Local
+from cascade import parse_cache
+from cascade.util import InputFile, open_input_file
+from cascade import quicklog
+
+qlog = quicklog.get_logger()
+
+# Prefix of the names of uploaded documents
+UPLOAD_PREFIX = 'upload:'
+
+# Separates a zip's name from the path of a document in it
+MEMBER_SEPARATOR = '!/'
+
+# Digest characters included in the names of uploaded documents
+UPLOAD_DIGEST_LENGTH = 12
+
+# Seconds to wait for another process (e.g. a parallel check worker) to finish writing
+LOCK_TIMEOUT = 30
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS documents (
+        document TEXT PRIMARY KEY,
+        digest TEXT,
+        updated REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS prefixes (
+        document TEXT NOT NULL,
+        prefix TEXT NOT NULL,
+        next_id INTEGER NOT NULL,
+        PRIMARY KEY (document, prefix)
+    );
+    CREATE TABLE IF NOT EXISTS object_ids (
+        object_id TEXT NOT NULL,
+        prefix TEXT NOT NULL,
+        number INTEGER NOT NULL,
+        document TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS object_ids_by_id ON object_ids (object_id);
+    CREATE INDEX IF NOT EXISTS object_ids_by_document ON object_ids (document);
+    CREATE INDEX IF NOT EXISTS prefixes_by_prefix ON prefixes (prefix);
+'''
+
+# SQL expression identifying a document (of a table joined to documents) by its
+# content: documents with the same digest are the same document
+DOCUMENT_IDENTITY = 'COALESCE({table}.digest, {table}.document)'
+
+# An object ID appearing in more than one document
+#   object_id:  The object ID
+#   documents:  The documents it appears in (sorted)
+Collision = namedtuple('Collision', 'object_id documents')
+
+# Two documents, sharing a prefix, whose ranges of object ID numbers overlap.  A
+# document's range runs from the lowest number it uses up to (and including) its
+# next_id, which is the next number it will allocate.
+#   prefix:             The shared object ID prefix
+#   document_a/_b:      The documents
+#   range_a/_b:         (lowest, next_id) of each document
+Overlap = namedtuple('Overlap', 'prefix document_a range_a document_b range_b')
+
+# The index in use (None if disabled). Set by configure().
+_index = None
+
+def configure(path, enabled=True):
+    '''Configure (or disable) the object ID index updated by check'''
+    global _index
+    _index = ObjectIdIndex(path) if enabled else None
+
+def get_index():
+    '''Return the configured ObjectIdIndex, or None if the index is disabled'''
+    return _index
+
+def document_name(filename):
+    '''Return the name under which a document on disk is indexed: its absolute path, with '/' separators'''
+    return os.path.abspath(filename).replace(os.sep, '/')
+
+def upload_name(filename, digest):
+    '''Return the name under which an uploaded document (filename, with content digest) is indexed'''
+    return '{}{}/{}'.format(UPLOAD_PREFIX, digest[:UPLOAD_DIGEST_LENGTH], filename)
+
+def member_name(zip_name, member):
+    '''Return the name under which a document in a zip (itself indexed as zip_name) is indexed'''
+    return zip_name + MEMBER_SEPARATOR + member
+
+def input_file_document_name(input_file, digest=None):
+    '''Return the name under which a command's input file (a filename or an InputFile) is indexed
+
+    An InputFile (an upload) is named by its content digest, which is computed
+    if not given.
+    '''
+    if not isinstance(input_file, InputFile):
+        return document_name(input_file)
+    if digest is None:
+        digest = parse_cache.file_digest(open_input_file(input_file))
+    return upload_name(input_file.filename, digest)
+
+def split_object_id(object_id):
+    '''Split a numbered object ID into (prefix, number), e.g. 'SRD-RCN-0412' -> ('SRD-RCN-', 412)'''
+    pieces = object_id.split('-')
+    return ('-'.join(pieces[:-1]) + '-', int(pieces[-1]))
+
+class ObjectIdIndex():
+    ''' An SQLite database of the object IDs used by each document
+
+    A connection is opened per operation, so an ObjectIdIndex can be shared by
+    threads (e.g. the http server) and used by forked worker processes.
+    '''
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        '''Return a connection to the database (closed on exiting a with block)'''
+        return _ClosingConnection(sqlite3.connect(self.path, timeout=LOCK_TIMEOUT))
+
+    def record_document(self, document, check_result, digest=None):
+        '''Record (replacing any previous entries) the object IDs of a checked document
+
+        document is the document's name (see document_name()).  check_result is
+        the document's cmd_check.CheckResult.  digest (the document's content
+        hash) is optional; if given, and the document is already recorded with
+        the same digest, nothing is rewritten.
+        '''
+        with self._connect() as connection:
+            if digest is not None:
+                row = connection.execute(
+                    'SELECT digest FROM documents WHERE document = ?', (document,)).fetchone()
+                if row is not None and row[0] == digest:
+                    return
+            connection.execute('DELETE FROM object_ids WHERE document = ?', (document,))
+            connection.execute('DELETE FROM prefixes WHERE document = ?', (document,))
+            connection.execute(
+                'INSERT OR REPLACE INTO documents (document, digest, updated) VALUES (?, ?, ?)',
+                (document, digest, time.time()))
+            connection.executemany(
+                'INSERT INTO prefixes (document, prefix, next_id) VALUES (?, ?, ?)',
+                [(document, prefix, info['next_id']) for prefix, info in check_result.object_ids.items()])
+            connection.executemany(
+                'INSERT INTO object_ids (object_id, prefix, number, document) VALUES (?, ?, ?, ?)',
+                [(object_id,) + split_object_id(object_id) + (document,)
+                 for object_id in check_result.all_object_ids])
+        qlog.debug('Indexed {} object IDs of "{}"'.format(len(check_result.all_object_ids), document))
+
+    def forget_document(self, document):
+        '''Remove a document (given its name) from the index, or a zip and the documents in it
+
+        Returns:
+            The names of the documents removed (sorted)
+        '''
+        members = document + MEMBER_SEPARATOR
+        with self._connect() as connection:
+            forgotten = [row[0] for row in connection.execute(
+                'SELECT document FROM documents WHERE document = ? OR substr(document, 1, ?) = ?'
+                ' ORDER BY document',
+                (document, len(members), members))]
+            for table in ('object_ids', 'prefixes', 'documents'):
+                connection.executemany(
+                    'DELETE FROM {} WHERE document = ?'.format(table), [(name,) for name in forgotten])
+        return forgotten
+
+    def forget_missing(self):
+        '''Remove each document whose file (or, for a document in a zip, whose zip) no longer exists
+
+        Uploaded documents have no file, so are kept.
+
+        Returns:
+            The names of the documents removed (sorted)
+        '''
+        forgotten = []
+        for document in self.documents():
+            if document.startswith(UPLOAD_PREFIX):
+                continue
+            if not os.path.exists(document.split(MEMBER_SEPARATOR, 1)[0]):
+                forgotten.extend(self.forget_document(document))
+        return forgotten
+
+    def documents(self):
+        '''Return the names of all indexed documents (sorted)'''
+        with self._connect() as connection:
+            return [row[0] for row in connection.execute('SELECT document FROM documents ORDER BY document')]
+
+    def owners(self, object_id):
+        '''Return the documents in which an object ID appears (sorted)'''
+        with self._connect() as connection:
+            return [row[0] for row in connection.execute(
+                'SELECT DISTINCT document FROM object_ids WHERE object_id = ? ORDER BY document',
+                (object_id,))]
+
+    def count_distinct(self, documents):
+        '''Return the number of distinct documents (counting documents with the same content once) among documents'''
+        restrict, parameters = _restrict_documents(documents)
+        with self._connect() as connection:
+            return connection.execute(
+                'SELECT COUNT(DISTINCT {identity}) FROM documents WHERE {restrict}'.format(
+                    identity=DOCUMENT_IDENTITY.format(table='documents'), restrict=restrict),
+                parameters).fetchone()[0]
+
+    def collisions(self, documents=None):
+        '''Return a Collision for each object ID appearing in more than one document
+
+        Documents with the same content (digest) count as one document.  If
+        documents (a list of document names) is given, only collisions among
+        those documents are returned.
+        '''
+        restrict, parameters = _restrict_documents(documents, column='object_ids.document')
+        with self._connect() as connection:
+            rows = connection.execute(
+                'SELECT object_id, document FROM object_ids WHERE object_id IN ('
+                '    SELECT object_ids.object_id FROM object_ids'
+                '    JOIN documents ON documents.document = object_ids.document {restrict}'
+                '    GROUP BY object_ids.object_id HAVING COUNT(DISTINCT {identity}) > 1)'
+                ' {and_restrict} ORDER BY object_id, document'.format(
+                    identity=DOCUMENT_IDENTITY.format(table='documents'),
+                    restrict='WHERE ' + restrict if restrict else '',
+                    and_restrict='AND ' + restrict if restrict else ''),
+                parameters + parameters).fetchall()
+        collisions = []
+        for object_id, document in rows:
+            if not collisions or collisions[-1].object_id != object_id:
+                collisions.append(Collision(object_id, []))
+            if document not in collisions[-1].documents:
+                collisions[-1].documents.append(document)
+        return collisions
+
+    def next_id_overlaps(self, documents=None):
+        '''Return an Overlap for each pair of documents whose object ID ranges (for a shared prefix) overlap
+
+        Documents with the same content (digest) never overlap.  If documents (a
+        list of document names) is given, only overlaps among those documents
+        are returned.
+        '''
+        restrict, parameters = _restrict_documents(documents, column='prefixes.document')
+        with self._connect() as connection:
+            rows = connection.execute(
+                'SELECT prefixes.prefix, prefixes.document, {identity}, prefixes.next_id, MIN(object_ids.number)'
+                ' FROM prefixes JOIN documents ON documents.document = prefixes.document'
+                ' LEFT JOIN object_ids'
+                '    ON object_ids.document = prefixes.document AND object_ids.prefix = prefixes.prefix'
+                ' {restrict}'
+                ' GROUP BY prefixes.prefix, prefixes.document'
+                ' ORDER BY prefixes.prefix, prefixes.document'.format(
+                    identity=DOCUMENT_IDENTITY.format(table='documents'),
+                    restrict='WHERE ' + restrict if restrict else ''),
+                parameters).fetchall()
+        ranges_by_prefix = {}
+        for prefix, document, identity, next_id, lowest in rows:
+            low = next_id if lowest is None else min(lowest, next_id)
+            ranges_by_prefix.setdefault(prefix, []).append((document, identity, (low, next_id)))
+        overlaps = []
+        for prefix, ranges in ranges_by_prefix.items():
+            for index, (document_a, identity_a, range_a) in enumerate(ranges):
+                for document_b, identity_b, range_b in ranges[index + 1:]:
+                    if identity_a == identity_b:
+                        continue
+                    if range_a[0] <= range_b[1] and range_b[0] <= range_a[1]:
+                        overlaps.append(Overlap(prefix, document_a, range_a, document_b, range_b))
+        return overlaps
+
+def _restrict_documents(documents, column='document'):
+    '''Return (SQL condition, parameters) restricting a query to documents (names; no condition if None)'''
+    if documents is None:
+        return ('', [])
+    names = sorted(set(documents))
+    return ('{} IN ({})'.format(column, ', '.join('?' * len(names))), names)
+
+class _ClosingConnection():
+    '''Context manager which commits (or rolls back) a connection's transaction, then closes it'''
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __enter__(self):
+        return self._connection
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        with closing(self._connection):
+            # The connection's own context manager commits or rolls back
+            return self._connection.__exit__(exc_type, exc_value, exc_traceback)
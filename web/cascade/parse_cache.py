@@ -0,0 +1,127 @@
+'''On-disk cache of parsed Word documents
+
+Documents are keyed by the SHA-256 of their .docx bytes plus the Cascade version,
+so an entry can never be used for a changed document, or by a version of Cascade
+which might parse it differently.  Each entry holds what a read-only WordDocx
+extracts from a document (its tokens, style tables, etc.) and, once the document
+has been checked, the check result.  A cache hit therefore skips opening and
+parsing the .docx entirely.
+
+The cache is bounded in size.  When it grows beyond max_bytes, the least recently
+used entries are evicted (file modification time is used as the "last used" time,
+and is updated on every hit).
+
+The cache is disabled unless configure() is called (which __main__ does, unless
+the --no-cache option is given).
+'''
+
+# Standard library
+import os
+import hashlib
+import pickle
+import tempfile
+
+# Local
+from cascade import quicklog
+from cascade.version import __version__
+
+qlog = quicklog.get_logger()
+
+CACHE_FILE_SUFFIX = '.pickle'
+DEFAULT_MAX_BYTES = 200000000
+HASH_CHUNK_BYTES = 1 << 20
+
+# The cache in use (None if caching is disabled). Set by configure().
+_cache = None
+
+def configure(directory, max_bytes=DEFAULT_MAX_BYTES, enabled=True):
+    '''Configure (or disable) the parse cache used by WordDocx'''
+    global _cache
+    _cache = ParseCache(directory, max_bytes) if enabled else None
+
+def get_cache():
+    '''Return the configured ParseCache, or None if caching is disabled'''
+    return _cache
+
+def file_digest(source):
+    '''Return the SHA-256 hex digest of a file (given its filename or a binary file object)'''
+    digest = hashlib.sha256()
+    if isinstance(source, str):
+        with open(source, 'rb') as in_file:
+            for chunk in iter(lambda: in_file.read(HASH_CHUNK_BYTES), b''):
+                digest.update(chunk)
+    else:
+        position = source.tell()
+        for chunk in iter(lambda: source.read(HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+        source.seek(position)
+    return digest.hexdigest()
+
+class ParseCache():
+    ''' A size-bounded, LRU, on-disk cache of parsed document entries (dicts) '''
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest):
+        version = hashlib.sha256(__version__.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.directory, f'{digest}-{version}{CACHE_FILE_SUFFIX}')
+
+    def get(self, digest):
+        '''Return the entry for a document digest, or None on a miss'''
+        path = self._path(digest)
+        try:
+            with open(path, 'rb') as in_file:
+                entry = pickle.load(in_file)
+            # Mark as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # A corrupt (or incompatible) entry is discarded
+            qlog.debug('Discarding unreadable parse cache entry "{}": {}'.format(path, e))
+            self._remove(path)
+            return None
+        qlog.debug('Parse cache hit: {}'.format(digest))
+        return entry
+
+    def put(self, digest, entry):
+        '''Store the entry for a document digest, then evict entries as needed'''
+        path = self._path(digest)
+        # Write to a temp file and rename, so readers never see a partial entry
+        temp_fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(temp_fd, 'wb') as out_file:
+                pickle.dump(entry, out_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except Exception:
+            self._remove(temp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        '''Remove least recently used entries until the cache fits within max_bytes'''
+        entries = []
+        total_bytes = 0
+        with os.scandir(self.directory) as scan:
+            for dir_entry in scan:
+                if dir_entry.name.endswith(CACHE_FILE_SUFFIX):
+                    stat = dir_entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, dir_entry.path))
+                    total_bytes += stat.st_size
+        entries.sort()
+        for _mtime, size, path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            qlog.debug('Evicting parse cache entry "{}"'.format(path))
+            self._remove(path)
+            total_bytes -= size
+
+    def _remove(self, path):
+        #pylint: disable=locally-disabled, no-self-use
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -5,16 +5,26 @@
   to the console (based on settable 'logging_level' and 'print_level').
 * Provides colorization of (console printed) log level designations
   (WARNING, INFO, etc.).
+* Printed output can be captured, and WARNING/ERROR/etc. messages are counted.
+  Both are kept in a scope: by default one shared by the whole process, or (within
+  "with qlog.scope():") one private to the current thread, so that e.g. concurrent
+  http requests each get their own report and counts.
+* Message formatting is lazy: the logging methods accept %-style arguments
+  (e.g. qlog.debug('Found %d directives', count)) or a callable returning the
+  message (e.g. qlog.debug(lambda: pp.pformat(requirements))), which are only
+  formatted/called if the message will be logged or printed.
 
 '''
 
 from __future__ import print_function
 import sys
 import logging
-import logging.handlers
+import threading
 import traceback
+from contextlib import contextmanager
 from colorama import init, Fore
 from eliot import Message
+from cascade import log_writer
 init(autoreset=True)
 
 __version__ = '0.3'
@@ -29,12 +39,26 @@ class Quicklog(object):
             enable_colored_logging=False,
             maxBytes=1000000,
             backupCount=5,
-            logger_name='default_logger'):
+            logger_name='default_logger',
+            queue_size=log_writer.DEFAULT_QUEUE_SIZE,
+            queue_policy=log_writer.POLICY_BLOCK,
+            flush_interval=log_writer.DEFAULT_FLUSH_INTERVAL):
+        '''Log records are written to the log file by a background thread (see
+        log_writer.py).  queue_size bounds the number of records waiting to be
+        written; when it is reached queue_policy either blocks the caller ('block')
+        or drops the record ('drop').  The log file is flushed every flush_interval
+        seconds.
+        '''
 
         self._enable_colored_printing = enable_colored_printing
         self._enable_colored_logging = enable_colored_logging
         self._print_level = print_level
         self._log_filename = log_filename
+        self._queue_settings = {
+            'queue_size': queue_size,
+            'queue_policy': queue_policy,
+            'flush_interval': flush_interval,
+        }
         self._logging_level = logging_level
         self._color_clear = Fore.RESET
         self._logger_name = logger_name
@@ -68,13 +92,15 @@ class Quicklog(object):
                 logging.ERROR,
                 logging.CRITICAL
             ]
-        self.clear_counters()
-
-        self._print_capture = ""
-        self._print_capture_enabled = False
-
-        self._handler = logging.handlers.RotatingFileHandler(
-              log_filename, maxBytes=maxBytes, backupCount=backupCount)
+        # Capture and counters, shared by all threads outside "with scope():"
+        self._default_scope = _Scope(self._log_levels)
+        # Per thread: the _Scope entered by "with scope():"
+        self._thread_scopes = threading.local()
+        self._log_context = ''
+
+        self._handler = log_writer.QueuedRotatingFileHandler(
+              log_filename, maxBytes, backupCount,
+              queue_size=queue_size, policy=queue_policy, flush_interval=flush_interval)
         formatter = logging.Formatter(color+'%(asctime)s'+color_clear+' %(message)s')
         self._handler.setFormatter(formatter)
 
@@ -84,10 +110,29 @@ class Quicklog(object):
 
         self._register_logger()
 
+    @contextmanager
+    def scope(self):
+        '''Give the current thread its own print capture and message counters (within a with block)
+
+        Usage:
+            with qlog.scope():
+                qlog.start_print_capture()
+                ...
+                report = qlog.stop_print_capture()
+        '''
+        previous = getattr(self._thread_scopes, 'scope', None)
+        self._thread_scopes.scope = _Scope(self._log_levels)
+        try:
+            yield
+        finally:
+            self._thread_scopes.scope = previous
+
+    def _scope(self):
+        '''Return the current thread's scope (see scope())'''
+        return getattr(self._thread_scopes, 'scope', None) or self._default_scope
+
     def clear_counters(self):
-        self._counters = {}
-        for level in self._log_levels:
-            self._counters[level] = 0
+        self._scope().clear_counters()
 
     def _register_logger(self):
         if 'quicklog_loggers' not in globals():
@@ -114,9 +159,10 @@ class Quicklog(object):
 
     def show_counters(self, min_report_level=logging.WARNING):
         report_text = ''
+        counters = self._scope().counters
         for level in self._log_levels:
             if level >= min_report_level:
-                count = self._counters[level]
+                count = counters[level]
                 if count > 0:
                     if report_text:
                         report_text += '\n'
@@ -133,11 +179,38 @@ class Quicklog(object):
             self.lprint('Status summary:\n{}'.format(report_text))
 
 
+    def get_counters(self):
+        '''Return a copy of the message counts, by log level'''
+        return dict(self._scope().counters)
+
+    def add_counters(self, counters):
+        '''Add message counts (e.g. from get_counters() in a worker process) to this logger's counts'''
+        scope_counters = self._scope().counters
+        for level, count in counters.items():
+            scope_counters[level] += count
+
+    def get_settings(self):
+        '''Return the arguments needed to create an equivalent Quicklog (e.g. in a worker process)'''
+        return {
+            'log_filename': self._log_filename,
+            'logging_level': self._logging_level,
+            'print_level': self._print_level,
+            'enable_colored_printing': self._enable_colored_printing,
+            'enable_colored_logging': self._enable_colored_logging,
+            'logger_name': self._logger_name,
+            **self._queue_settings
+        }
+
+    def set_log_context(self, context):
+        '''Prefix each message written to the log file with "[<context>] " (or nothing, if context is empty)
+
+        Used to attribute messages to e.g. the document being processed, where several
+        processes write to the same log.
+        '''
+        self._log_context = '[{}] '.format(context) if context else ''
+
     def get_count(self, log_level):
-        if log_level in self._counters:
-            return self._counters[log_level]
-        else:
-            return 0
+        return self._scope().counters.get(log_level, 0)
 
     def stop(self):
         '''Stop logging
@@ -148,6 +221,7 @@ class Quicklog(object):
         instance of Quicklog, and such apps need not call stop before terminating.
         '''
         self._logger.removeHandler(self._handler)
+        self._handler.close()
         self._handler = None
         self._unregister_logger()
 
@@ -155,14 +229,24 @@ class Quicklog(object):
         '''True if current logging level includes DEBUG'''
         return self._logging_level <= logging.DEBUG
 
-    def start_print_capture(self):
-        self._print_capture = ""
-        self._print_capture_enabled = True
-    
+    def start_print_capture(self, echo=True, stream=None):
+        '''Capture printed output (until stop_print_capture()). If echo is False, it is not also printed
+
+        If a stream (text file) is given, captured output is also written (and
+        flushed) to it as it is printed, e.g. so another process can follow it.
+        '''
+        scope = self._scope()
+        scope.capture = []
+        scope.capture_echo = echo
+        scope.capture_stream = stream
+
     def stop_print_capture(self):
-        self._print_capture_enabled = False
-        result = self._print_capture
-        self._print_capture = ""
+        '''Stop capturing printed output, returning what was captured'''
+        scope = self._scope()
+        result = ''.join(scope.capture or ())
+        scope.capture = None
+        scope.capture_echo = True
+        scope.capture_stream = None
         return result
 
     def begin(self, app_identification_text='', show=True):
@@ -180,82 +264,136 @@ class Quicklog(object):
 
     def end(self):
          # Log execution end
+        if self._handler.dropped:
+            self._logger.warning('{} log messages were dropped (the log queue was full)'.format(
+                self._handler.dropped))
         self._logger.info('------------------------------- END ------------------------------- ')
 
-    def debug(self, message, quiet=False):
-        self.log(message, logging.DEBUG, quiet)
+    def flush(self):
+        '''Wait until all messages logged so far have been written to the log file'''
+        self._handler.flush()
+
+    def debug(self, message, *args, quiet=False):
+        self.log(message, logging.DEBUG, quiet, args)
 
-    def info(self, message, quiet=False):
-        self.log(message, logging.INFO, quiet)
+    def info(self, message, *args, quiet=False):
+        self.log(message, logging.INFO, quiet, args)
 
-    def warning(self, message, quiet=False):
-        self.log(message, logging.WARNING, quiet)
+    def warning(self, message, *args, quiet=False):
+        self.log(message, logging.WARNING, quiet, args)
 
-    def error(self, message, quiet=False):
-        self.log(message, logging.ERROR, quiet)
+    def error(self, message, *args, quiet=False):
+        self.log(message, logging.ERROR, quiet, args)
 
-    def critical(self, message, quiet=False):
-        self.log(message, logging.CRITICAL, quiet)
+    def critical(self, message, *args, quiet=False):
+        self.log(message, logging.CRITICAL, quiet, args)
 
     def fatal_exception(self, e):
         """Notify user (tersely) of a fatal exception. Write the traceback to the log"""
         self.error('(INTERNAL): {}: {}. Details written to log.'.format(type(e).__name__, str(e)))
         self.critical(str(traceback.format_exc()), quiet=True)
 
-    def lprint(self, message):
+    def lprint(self, message, *args):
         """Logs the message (at "INFO" level) and prints the message as-is (i.e. with no "INFO: " prefix)"""
-        # Unicode is re-encoded for stdout, replacing any encoding errors, per
-        # http://stackoverflow.com/questions/14630288/unicodeencodeerror-charmap-codec-cant-encode-character-maps-to-undefined
-        message = str(message)
-        self._print(message.encode(sys.stdout.encoding, errors='backslashreplace').decode(sys.stdout.encoding))
+        message = _format_message(message, args)
+        self._print(message)
         self.log(message, logging.INFO, quiet=True)
 
-    def log(self, message, log_level, quiet=False):
-        log_prefix = self._log_level_name[log_level]
+    def log(self, message, log_level, quiet=False, args=()):
+        '''Log (and, per the print level, print) a message
+
+        message may be a %-style format string (formatted with args), or a callable
+        returning the message.  Either is only formatted (or called) if the message
+        is actually logged or printed.
+        '''
+        self._scope().counters[log_level] += 1
+
+        logged = log_level >= self._logging_level
+        printed = log_level >= self._print_level and not quiet
+        if not logged and not printed:
+            return
+
+        # Get string representation of message
+        message = _format_message(message, args)
+
         if self._log_color[log_level]:
             color = self._log_color[log_level]
             color_clear = self._color_clear
         else:
             color = ''
             color_clear = ''
+        print_prefix = self._log_level_name[log_level]
+
+        if logged:
+            self._logger.log(
+                log_level,
+                '{}{}{}{}: {}'.format(
+                    self._log_context,
+                    color if self._enable_colored_logging else '',
+                    print_prefix,
+                    color_clear if self._enable_colored_logging else '',
+                    message))
+
+            # Log to eliot
+            Message.log(
+                message_type='qlog',
+                level=self._log_level_name[log_level],
+                message=message
+                )
 
-        self._counters[log_level] += 1
-
-        # Get string representation of message
-        message = str(message)
-            
-        print_prefix = log_prefix
-        self._logger.log(
-            log_level,
-            '{}{}{}: {}'.format(
-                color if self._enable_colored_logging else '',
-                print_prefix,
-                color_clear if self._enable_colored_logging else '',
-                message.encode(sys.stdout.encoding, errors='backslashreplace').decode(sys.stdout.encoding)))
-        
-        if log_level >= self._print_level and not quiet:
-            # Unicode is re-encoded for stdout, replacing any encoding errors, per
-            # http://stackoverflow.com/questions/14630288/unicodeencodeerror-charmap-codec-cant-encode-character-maps-to-undefined
+        if printed:
             self._print('{}{}{}: {}'.format(
                 color if self._enable_colored_printing else '',
                 print_prefix,
                 color_clear if self._enable_colored_printing else '',
-                message.encode(sys.stdout.encoding, errors='backslashreplace').decode(sys.stdout.encoding)
+                message
                 ))
 
-        # Log to eliot
-        if log_level >= self._logging_level:
-            Message.log(
-                message_type='qlog',
-                level=self._log_level_name[log_level],
-                message=message.encode(
-                    sys.stdout.encoding, errors='backslashreplace').decode(sys.stdout.encoding)
-                )
+    def print_output(self, text):
+        """Print output which has already been logged (e.g. captured in a worker process), without logging it again"""
+        if text:
+            self._print(text[:-1] if text.endswith('\n') else text)
 
     def _print(self, text):
-        if self._print_capture_enabled:
-            self._print_capture += text + '\n'
-        print(text)
+        scope = self._scope()
+        if scope.capture is not None:
+            scope.capture.append(text + '\n')
+            if scope.capture_stream is not None:
+                scope.capture_stream.write(text + '\n')
+                scope.capture_stream.flush()
+            if not scope.capture_echo:
+                return
+        print(_encode_for_stdout(text))
+
+class _Scope():
+    ''' Print capture and message counters (see Quicklog.scope()) '''
+    def __init__(self, levels):
+        self.counters = {level: 0 for level in levels}
+        # Captured text (a list of strings), or None if not capturing
+        self.capture = None
+        self.capture_echo = True
+        self.capture_stream = None
+
+    def clear_counters(self):
+        for level in self.counters:
+            self.counters[level] = 0
+
+def _format_message(message, args):
+    '''Return the string for a (lazy) message: a %-style format string and its args, or a callable'''
+    if callable(message):
+        message = message()
+    if args:
+        return str(message) % args
+    return str(message)
+
+def _encode_for_stdout(text):
+    '''Return text with any characters which stdout can't encode replaced by escapes'''
+    # Unicode is re-encoded for stdout, replacing any encoding errors, per
+    # http://stackoverflow.com/questions/14630288/unicodeencodeerror-charmap-codec-cant-encode-character-maps-to-undefined
+    encoding = sys.stdout.encoding
+    if not encoding:
+        return text
+    return text.encode(encoding, errors='backslashreplace').decode(encoding)
 
 def get_logger(logger_name='default_logger'):
     if 'quicklog_loggers' in globals() and logger_name in globals()['quicklog_loggers']:
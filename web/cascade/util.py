@@ -1,19 +1,17 @@
 
 # Standard library
+import io
 import os
 import sys
 import json
+import hashlib
 from json import JSONDecodeError
 import re
-from collections import namedtuple, OrderedDict
+from collections import namedtuple
 
 # Libraries
-import pandas as pd
 import jsonschema
 from colorama import Fore
-import openpyxl
-from openpyxl.styles import Alignment, Border, Side, PatternFill, Color
-from openpyxl.utils import get_column_letter
 
 # Local
 from cascade import quicklog
@@ -65,10 +63,8 @@ def json_to_dict(json_text):
 
     json_dict = None
     try:
-        json_dict = json.loads(
-            json_text,
-            object_pairs_hook=OrderedDict  # Preserve item order by using an OrderedDict
-            )
+        # (Plain dicts preserve item order)
+        json_dict = json.loads(json_text)
     except JSONDecodeError as err:
         json_error_text = json_text
         # Show error location for errors of the form:
@@ -168,36 +164,36 @@ def legacy_object_id_to_directive_dict(text):
     else:
         if len(pieces) == 2:
             # Form:    '[SRD-RCN-0001, X]'
-            directive_dict = OrderedDict([
-                ('id', pieces[0]),
-                ('method', pieces[1])])
+            directive_dict = {
+                'id': pieces[0],
+                'method': pieces[1]}
         elif len(pieces) == 3:
             if pieces[2] in requirement_types:
                 # Form:    '[SRD-RCN-3186, X, GUI]'
-                directive_dict = OrderedDict([
-                    ('id', pieces[0]),
-                    ('method', pieces[1]),
-                    ('type', pieces[2]),
-                ])
+                directive_dict = {
+                    'id': pieces[0],
+                    'method': pieces[1],
+                    'type': pieces[2],
+                }
             else:
                 # Form: '[SRD-RCN-4843, X, RSG-3895]'
-                directive_dict = OrderedDict([
-                    ('id', pieces[0]),
-                    ('method', pieces[1]),
-                    ('old_id', pieces[2]),
-                ])
+                directive_dict = {
+                    'id': pieces[0],
+                    'method': pieces[1],
+                    'old_id': pieces[2],
+                }
         elif len(pieces) == 4:
             # Form: '[SRD-RCN-4845, X, APP_B-8439, RSG]'
             if pieces[3] not in requirement_types:
                 qlog.warning('Unexpected requirement type in 4th field of legacy object id: "{}".  Expected one of: {}'.format(
                     text,
                     requirement_types))
-            directive_dict = OrderedDict([
-                ('id', pieces[0]),
-                ('method', pieces[1]),
-                ('old_id', pieces[2]),
-                ('type', pieces[3]),
-                ])
+            directive_dict = {
+                'id': pieces[0],
+                'method': pieces[1],
+                'old_id': pieces[2],
+                'type': pieces[3],
+                }
         else:
             qlog.error('Unexpected legacy object ID format.  Expected 2, 3, or 4 fields.  Object ID will be ignored: "{}"'.format(text))
             return None
@@ -261,18 +257,6 @@ class Indent:
         '''Return current indentation pad string'''
         return '   ' * self.level
 
-def get_heading_level(stylename):
-    '''Determines whether a stylename is a heading style. Returns heading number if true, else None
-    '''
-
-    # Headings of the form 'Heading N'
-    if stylename.startswith('Heading'):
-        return int(stylename.split(' ')[-1])
-    # Headings of the form 'Appendix_A_Level_N'
-    if stylename.startswith('Appendix_') and 'Level_' in stylename:
-        return int(stylename.split('_')[-1])
-    return None
-
 def to_snippet(text, length=40):
     '''Truncate text to requested length and append "..."
     '''
@@ -385,15 +369,67 @@ SCHEMA__PRAGMA = {
     "type":  "string"
 }
 
-def validate_json(json_dict, schema):
-    validation_passed = True
-    try:
-        jsonschema.validate(json_dict, schema)
-    except jsonschema.exceptions.ValidationError as err:
+# Compiled JSON schema validators, keyed by schema digest (see get_validator())
+_validators = {}
+# Validators keyed by id() of the schema dicts they were last requested for. Each
+# entry also holds its schema, so the id can't be reused while it's cached.
+_validators_by_id = {}
+MAX_CACHED_VALIDATORS = 1000
+
+def schema_digest(schema):
+    """Return a hash of a JSON schema which is the same for all equal schemas"""
+    return hashlib.sha256(json.dumps(schema, sort_keys=True).encode('utf-8')).hexdigest()
+
+def get_validator(schema):
+    """Return a (cached) jsonschema validator for a schema
+
+    The schema itself is checked, and its validator built, only once per distinct
+    schema: validators are cached by schema digest, so e.g. documents which declare
+    the same schemas in their "document_info" directive share validators.
+
+    Raises jsonschema.exceptions.SchemaError if the schema is invalid.
+    """
+    cached = _validators_by_id.get(id(schema))
+    if cached is not None and cached[0] is schema:
+        return cached[1]
+    digest = schema_digest(schema)
+    validator = _validators.get(digest)
+    if validator is None:
+        validator_class = jsonschema.validators.validator_for(schema)
+        validator_class.check_schema(schema)
+        if len(_validators) >= MAX_CACHED_VALIDATORS:
+            _validators.clear()
+        validator = _validators[digest] = validator_class(schema)
+    if len(_validators_by_id) >= MAX_CACHED_VALIDATORS:
+        _validators_by_id.clear()
+    _validators_by_id[id(schema)] = (schema, validator)
+    return validator
+
+def validate_json(json_dict, schema, collect_all=False):
+    """Validate a dict against a JSON schema, logging any validation errors
+
+    By default validation stops at the first error.  If collect_all is True, every
+    error is collected (and logged, one per line, with the location of each).
+
+    Returns True if the dict is valid.
+    """
+    validator = get_validator(schema)
+    if not collect_all:
+        err = next(validator.iter_errors(json_dict), None)
+        if err is None:
+            return True
         #TODO: Log validation error detail more cleanly
         qlog.error('JSON Validation Failed:\n' + str(err))
-        validation_passed = False
-    return validation_passed
+        return False
+    errors = sorted(validator.iter_errors(json_dict), key=lambda err: [str(item) for item in err.path])
+    if not errors:
+        return True
+    qlog.error('JSON Validation Failed ({} error{}):\n'.format(len(errors), '' if len(errors) == 1 else 's')
+               + '\n'.join('   {}: {}'.format(
+                   '/'.join(str(item) for item in err.path) or '(top level)', err.message)
+                            for err in errors)
+               + '\n   Directive: {}'.format(json.dumps(json_dict)))
+    return False
 
 def uprint(text):
     """Print Unicode do stdout, replacing errors for un-encodable characters"""
@@ -465,3 +501,37 @@ def make_output_file_info(out_filename, output_argument, append_suffix, replace_
         filename=out_filename,
         path_and_filename=os.path.join(out_path, out_filename)
         )
+
+# An input file given to a command in place of a filename (e.g. an upload, see
+# cmd_http.py).
+#   filename:   The file's name (no path), used in messages and to name output files
+#   source:     The file's content (bytes), a binary file object holding it, or
+#               the path of a file holding it (e.g. a temporary file)
+InputFile = namedtuple('InputFile', 'filename source')
+
+def input_file_name(input_file):
+    ''' Return the name of a command's input file (a filename or an InputFile) '''
+    if isinstance(input_file, InputFile):
+        return input_file.filename
+    return input_file
+
+def input_file_exists(input_file):
+    ''' True if a command's input file (a filename or an InputFile) exists '''
+    if isinstance(input_file, InputFile):
+        return not isinstance(input_file.source, str) or os.path.isfile(input_file.source)
+    return os.path.isfile(input_file)
+
+def open_input_file(input_file):
+    ''' Return a command's input file (a filename or an InputFile) in a form which can be loaded
+
+    Returns the file's absolute path if it is on disk, otherwise a seekable binary
+    file object holding its content (positioned at the start).  Either can be
+    passed to WordDocx or zipfile.ZipFile.
+    '''
+    source = input_file.source if isinstance(input_file, InputFile) else input_file
+    if isinstance(source, str):
+        return os.path.abspath(source)
+    if isinstance(source, bytes):
+        return io.BytesIO(source)
+    source.seek(0)
+    return source
@@ -6,78 +6,78 @@ https://eliot.readthedocs.io/en/1.2.0/
 '''
 # Standard library
 import json
-from pathlib import Path
 from functools import wraps
 
 # Library
 import eliot
 from eliot import start_action
-from flask import request
+
+# Local
+from cascade import log_writer
 
 class rotating_logfile():
-    ''' A log file rotation handler for the eliot logging framework'''
-    def __init__(self, filename, num_logs=4, auto=True, max_bytes=5000000):
+    ''' A log file rotation handler for the eliot logging framework
+
+    Messages are written (as JSON) by a background thread; see log_writer.py.
+    '''
+    def __init__(
+            self,
+            filename,
+            num_logs=4,
+            auto=True,
+            max_bytes=5000000,
+            queue_size=log_writer.DEFAULT_QUEUE_SIZE,
+            queue_policy=log_writer.POLICY_BLOCK,
+            flush_interval=log_writer.DEFAULT_FLUSH_INTERVAL):
         '''
         If auto rotation is disabled, then the logs will only be rotated
             1) At startup (class init)
             2) By explicitly calling to do_rotate_check().
         '''
         self.filename = filename
-        self.file = open(
-            filename, 
-            "a")
-        self.max_bytes = max_bytes
-        self.num_logs = num_logs
         self.auto = auto
-        self.do_rotate_check()
+        self.file = log_writer.RotatingFile(
+            filename,
+            max_bytes,
+            num_logs if num_logs > 1 else 0)
+        self.file.rotate_if_needed()
+        self._writer = log_writer.AsyncWriter(
+            self._write_batch,
+            self.file.flush,
+            queue_size=queue_size,
+            policy=queue_policy,
+            flush_interval=flush_interval,
+            name='log_writer:' + filename)
 
         # Register this handler as an eliot logging destination
         eliot.add_destinations(self.write)
 
     def write(self, log_dict):
-        ''' Write a dict to the logfile (as JSON) '''
-        if self.auto:
-            self.do_rotate_check()
-        self.file.write(json.dumps(log_dict) + '\n')
-        self.file.flush()
+        ''' Queue a dict to be written to the logfile (as JSON) '''
+        self._writer.put(log_dict)
+
+    def _write_batch(self, log_dicts):
+        ''' Write dicts to the logfile (as JSON). Called by the writer thread '''
+        self.file.write(
+            ''.join(json.dumps(log_dict, default=str) + '\n' for log_dict in log_dicts),
+            rotate=self.auto)
 
     def do_rotate_check(self):
         ''' Rotate the logs (if necessary)'''
-        if self.num_logs > 1:
-            if self.file.tell() > self.max_bytes:
-                self._rotate_file(None, 1)
+        self._writer.flush()
+        with self._writer.lock:
+            self.file.rotate_if_needed()
 
-    def _rotate_file(self, current_id, next_id):
-        ''' Rotate the log file with current_id to next_id
-
-        For the active log file, current_id == None
-        '''
-        if current_id is None:
-            self.file.close()
-
-        current_suffix = '' if current_id is None else f'.{current_id}'
-        current_file = Path(self.filename + current_suffix)
-        next_file = Path(self.filename + f'.{next_id}')
-
-        # If next file exists, then bump its suffix
-        if next_file.is_file():
-            if next_id == self.num_logs:
-                # Delete the next file
-                next_file.unlink()
-            else:
-                # Bump the next file
-                self._rotate_file(next_id, next_id + 1)
-
-        # Rename current file
-        current_file.rename(next_file)
-
-        if current_id is None:
-            # Open new base file
-            self.file = open(self.filename, "a")
+    def flush(self):
+        ''' Wait until all messages so far have been written to the logfile '''
+        self._writer.flush()
 
     def close(self):
         ''' Close the logfile '''
-        self.file.close()
+        eliot.remove_destination(self.write)
+        self._writer.close()
+        with self._writer.lock:
+            self.file.close()
 
 def log_route(func):
     ''' Logging decorator for flask functions wrapped with @app.route()
@@ -88,6 +88,10 @@ def log_route(func):
         def path_handler():
             <handler code>
     '''
+    # Imported here (rather than at module level) so that the command line commands,
+    # which also use this module, don't pay for importing flask
+    from flask import request
+
     @wraps(func)
     def wrapped():
         with start_action(action_type='http', path=request.path):
@@ -5,13 +5,18 @@ The python-docx library is documented at:
 """
 
 # Standard library
+import re
 from collections import namedtuple, defaultdict
 import pprint
+import zipfile
 
 # Libraries
 from docx import Document
+from lxml import etree
 from docx.shared import Pt as Pt
 from docx.shared import RGBColor as RGBColor
+from docx.oxml.ns import qn
+from docx.styles import BabelFish
 # The following imports specifically support the iter_block_items() function
 # as documented in https://github.com/python-openxml/python-docx/issues/40
 from docx.document import Document as docx_Document
@@ -26,22 +31,220 @@ from cascade.util import (
     extract_json_from_directive, expand_shortform_dict, get_directive_type,
     to_snippet)
 from cascade.custom_exceptions import FatalUserError
+from cascade import parse_cache
+from cascade.docx_package import save_package, DEFAULT_COMPRESS_LEVEL
 
 pp = pprint.PrettyPrinter(indent=3)
 
+# Clark-notation tags used when walking the document XML directly with lxml
+TAG_P = qn('w:p')
+TAG_R = qn('w:r')
+TAG_T = qn('w:t')
+TAG_TAB = qn('w:tab')
+TAG_BR = qn('w:br')
+TAG_CR = qn('w:cr')
+TAG_PPR = qn('w:pPr')
+TAG_PSTYLE = qn('w:pStyle')
+TAG_STYLE = qn('w:style')
+TAG_NAME = qn('w:name')
+TAG_BASED_ON = qn('w:basedOn')
+TAG_OUTLINE_LVL = qn('w:outlineLvl')
+ATTR_VAL = qn('w:val')
+ATTR_TYPE = qn('w:type')
+ATTR_STYLE_ID = qn('w:styleId')
+ATTR_DEFAULT = qn('w:default')
+ATTR_XML_SPACE = qn('xml:space')
+TAG_BODY = qn('w:body')
+TAG_INS = qn('w:ins')
+TAG_DEL = qn('w:del')
+
+# Package parts read directly in read-only mode
+DOCUMENT_PART_NAME = 'word/document.xml'
+STYLES_PART_NAME = 'word/styles.xml'
+
+# A run of paragraphs which make up a heading, a body paragraph, or a directive.
+#   token_type:     'heading', 'body' or 'directive'
+#   elements:       The w:p elements of the paragraphs (None in read-only mode)
+#   texts:          The text of each paragraph
+#   style_ids:      The style id of each paragraph (None for the default style)
+#   start, end:     The span of the paragraphs in the document's body paragraphs
+#                   (as indices, at the time the document was tokenized)
+#   heading_level:  Heading level of a heading token (None otherwise)
+#   as_dict:        The parsed JSON of a directive token (None otherwise)
+Token = namedtuple('Token', 'token_type elements texts style_ids start end heading_level as_dict')
+
+class Directive(object):
+    '''A directive found in the document
+
+    Directives are held for every object in a document (and, in aggregate, for every
+    document in a corpus), so the record is kept compact: it references its token's
+    elements, texts and style_ids (rather than copying them), and the python-docx
+    Paragraph proxies for its paragraphs are only created when paragraphs is read.
+    '''
+    __slots__ = ('elements', 'as_dict', 'texts', 'style_ids', '_body')
+
+    def __init__(self, token, body=None):
+        self.elements = token.elements
+        self.as_dict = token.as_dict
+        self.texts = token.texts
+        self.style_ids = token.style_ids
+        self._body = body
+
+    @property
+    def paragraphs(self):
+        '''python-docx Paragraphs of the directive (None in read-only mode)'''
+        if self.elements is None:
+            return None
+        return [Paragraph(element, self._body) for element in self.elements]
+
+    def __repr__(self):
+        return 'Directive({!r})'.format(self.as_dict)
+
+class Requirement(object):
+    '''A requirement: a shortform directive, the heading above it, and the text below it'''
+    __slots__ = ('directive', 'heading_text', '_texts')
+
+    def __init__(self, directive, heading_text):
+        self.directive = directive
+        self.heading_text = heading_text
+        self._texts = []
+
+    @property
+    def req_text(self):
+        '''The requirement text (its non-empty body paragraphs, one per line)'''
+        return '\n'.join(self._texts)
+
+    def __repr__(self):
+        return 'Requirement({!r}, heading_text={!r}, req_text={!r})'.format(
+            self.directive, self.heading_text, self.req_text)
+
+# w:outlineLvl values run 0-8 for heading levels 1-9. A value of 9 means "body text".
+MAX_OUTLINE_LVL = 8
+
 class WordDocx(object):
-    def __init__(self, qlog, filename):
+    def __init__(self, qlog, filename, read_only=False):
+        '''Load a Word document
+
+        filename is the document's path, or a (seekable) binary file object
+        holding the document, e.g. a BytesIO of a document read from a zip.
+
+        If read_only is True, the document's directives are found by streaming
+        word/document.xml (see _load_read_only()) rather than building the
+        python-docx object model of the whole package.  This is much faster and
+        uses far less memory, but a read-only WordDocx has no paragraphs and can't
+        be modified or saved.  Commands which only read directives (e.g. check)
+        should use it.
+        '''
         self._qlog = qlog
         self._filename_original = filename
-        self._document = Document(filename)
-        self.paragraphs = self._document.paragraphs
+        self.read_only = read_only
+        self._document = None
+        self.paragraphs = None
+        self._paragraph_positions = {}
+        self._positions_valid_to = 0
         self.format_types = ['directive_visible', 'directive_hidden']
-        self._Directive = namedtuple('Directive', 'paragraphs as_dict')
         self._directives = []
         self.requirements = []
         self.doc_info_directive = None
+        self._tokens = None
+        self._style_names = {}
+        self._all_style_names = set()
+        self._heading_levels = {}
+        self._change_tracking_counts = (0, 0)
+        self._cache_digest = None
+        self.cached_check_result = None
+        if read_only:
+            self._load_read_only(filename)
+        else:
+            self._document = Document(filename)
+            self.paragraphs = self._document.paragraphs
+            self.build_style_tables(self._document.styles.element)
         self.find_directives()
 
+    def _load_read_only(self, filename):
+        '''Load the document by streaming its XML, without building the python-docx object model
+
+        word/document.xml is parsed with lxml.etree.iterparse().  Each top level body
+        element (paragraph, table, ...) is tokenized as soon as it has been parsed and
+        is then cleared, so the document tree is never held in memory.
+
+        If the parse cache is enabled (see parse_cache.py) and holds an entry for
+        the document's content, the document isn't opened at all.
+        '''
+        cache = parse_cache.get_cache()
+        if cache is not None:
+            self._cache_digest = parse_cache.file_digest(filename)
+            entry = cache.get(self._cache_digest)
+            if entry is not None:
+                self._restore_cache_entry(entry)
+                return
+
+        with zipfile.ZipFile(filename) as package:
+            with package.open(STYLES_PART_NAME) as styles_file:
+                self.build_style_tables(etree.parse(styles_file).getroot())
+            with package.open(DOCUMENT_PART_NAME) as document_file:
+                self.tokenize(self._stream_paragraphs(document_file))
+
+        if cache is not None:
+            cache.put(self._cache_digest, self._make_cache_entry())
+
+    def _make_cache_entry(self):
+        '''The parse cache entry for this (read-only) document'''
+        return {
+            'tokens': self._tokens,
+            'style_names': self._style_names,
+            'all_style_names': self._all_style_names,
+            'heading_levels': self._heading_levels,
+            'change_tracking_counts': self._change_tracking_counts,
+            'check_result': self.cached_check_result,
+        }
+
+    def _restore_cache_entry(self, entry):
+        '''Restore this (read-only) document from a parse cache entry'''
+        self._tokens = entry['tokens']
+        self._style_names = entry['style_names']
+        self._all_style_names = entry['all_style_names']
+        self._heading_levels = entry['heading_levels']
+        self._change_tracking_counts = entry['change_tracking_counts']
+        self.cached_check_result = entry['check_result']
+
+    def store_check_result(self, check_result):
+        '''Record the result of checking this document in the parse cache (if enabled)
+
+        Only read-only documents are cached.  See cached_check_result.
+        '''
+        cache = parse_cache.get_cache()
+        if cache is None or self._cache_digest is None:
+            return
+        self.cached_check_result = check_result
+        cache.put(self._cache_digest, self._make_cache_entry())
+
+    def _stream_paragraphs(self, document_file):
+        '''Yield (None, text, style_id) for each body paragraph of a streamed word/document.xml
+
+        Change tracking elements are counted along the way (see warn_on_change_tracking()).
+        '''
+        insertions = 0
+        deletions = 0
+        for _event, element in etree.iterparse(document_file, events=('end',)):
+            parent = element.getparent()
+            if parent is None or parent.tag != TAG_BODY:
+                if parent is not None and element.tag in (TAG_INS, TAG_DEL):
+                    grandparent = parent.getparent()
+                    if grandparent is not None and grandparent.tag == TAG_BODY:
+                        if element.tag == TAG_INS:
+                            insertions += 1
+                        else:
+                            deletions += 1
+                continue
+            if element.tag == TAG_P:
+                yield (None, paragraph_element_text(element), paragraph_element_style_id(element))
+            # Discard the body element, and any already-processed siblings
+            element.clear()
+            while element.getprevious() is not None:
+                del parent[0]
+        self._change_tracking_counts = (insertions, deletions)
+
     def resync_paragraphs(self):
         ''' Get local copy of paragraphs again
 
@@ -52,99 +255,259 @@ class WordDocx(object):
         the list of paragraphs.
         '''
         self.paragraphs = self._document.paragraphs
+        self._paragraph_positions = {}
+        self._positions_valid_to = 0
+        self._tokens = None
+
+    def get_paragraph_index(self, paragraph):
+        '''Return the index of a paragraph in self.paragraphs, or None if it is not present
+
+        Paragraphs are located by their underlying w:p element (so any proxy of a
+        paragraph will do) through an element -> index map.  The map is kept
+        correct for self.paragraphs[:self._positions_valid_to]; inserts and deletes
+        only lower that watermark, and lookups beyond it repair the map forward from
+        the watermark.  Inserting while walking forward through the document (the
+        common case) is therefore amortized constant time.
+        '''
+        #pylint: disable=locally-disabled, protected-access
+        element = paragraph._p
+        index = self._paragraph_positions.get(element)
+        if (index is not None and index < len(self.paragraphs)
+                and self.paragraphs[index]._p is element):
+            return index
+        while self._positions_valid_to < len(self.paragraphs):
+            index = self._positions_valid_to
+            search_element = self.paragraphs[index]._p
+            self._paragraph_positions[search_element] = index
+            self._positions_valid_to += 1
+            if search_element is element:
+                return index
+        return None
+
+    def _track_insert(self, index, paragraph):
+        '''Record a paragraph inserted into the document at self.paragraphs[index]'''
+        #pylint: disable=locally-disabled, protected-access
+        self._tokens = None
+        self.paragraphs.insert(index, paragraph)
+        self._paragraph_positions[paragraph._p] = index
+        if self._positions_valid_to > index:
+            # Positions before the insertion are unaffected.  Those after it have shifted.
+            self._positions_valid_to = index + 1
+
+    def _track_delete(self, paragraph):
+        '''Record a paragraph deleted from the document'''
+        #pylint: disable=locally-disabled, protected-access
+        self._tokens = None
+        index = self.get_paragraph_index(paragraph)
+        if index is None:
+            return
+        del self.paragraphs[index]
+        del self._paragraph_positions[paragraph._p]
+        self._positions_valid_to = min(self._positions_valid_to, index)
+
+    def tokenize(self, paragraph_stream=None):
+        '''Split the document into heading, body and directive tokens
+
+        This is the single pass over the document's paragraphs (and the single parse
+        of each directive's JSON) which find_directives(), get_clusters() and
+        requirements are built from.  The result is cached; it is discarded (and
+        rebuilt on next use) when paragraphs are inserted, deleted or rewritten.
+
+        paragraph_stream is an iterable of (element, text, style_id) for each paragraph,
+        and defaults to scan_paragraphs().
+
+        Returns a list of Tokens, in document order.
+        '''
+        if self._tokens is not None:
+            return self._tokens
+        if paragraph_stream is None:
+            paragraph_stream = self.scan_paragraphs()
+        self._qlog.debug("Tokenizing document...")
+        tokens = []
+        directive_elements = []
+        directive_texts = []
+        directive_style_ids = []
+        directive_start = None
+        for index, (p_element, text, style_id) in enumerate(paragraph_stream):
+            if directive_start is None:
+                if '${' in text:
+                    # Start found
+                    directive_start = index
+                else:
+                    heading_level = self.get_style_heading_level(style_id)
+                    tokens.append(Token(
+                        'heading' if heading_level else 'body',
+                        None if p_element is None else (p_element,), (text,), (style_id,),
+                        index, index + 1, heading_level, None))
+                    continue
+
+            # Capture constituent paragraphs
+            directive_elements.append(p_element)
+            directive_texts.append(text)
+            directive_style_ids.append(style_id)
+            if '}$' in text:
+                # End found
+                json_text = ''.join(directive_texts).replace('“', '"').replace('”', '"')
+                json_text = extract_json_from_directive(json_text)
+                self._qlog.debug('Directive JSON: "%s"', json_text)
+                as_dict = json_to_dict(json_text)
+                if not as_dict:
+                    raise FatalUserError("JSON error")
+                self._qlog.debug("Found directive %s", as_dict)
+                tokens.append(Token(
+                    'directive',
+                    None if p_element is None else tuple(directive_elements),
+                    tuple(directive_texts), tuple(directive_style_ids),
+                    directive_start, index + 1, None, as_dict))
+
+                # Clear search
+                directive_elements = []
+                directive_texts = []
+                directive_style_ids = []
+                directive_start = None
+
+        self._tokens = tokens
+        return tokens
 
     def find_directives(self):
-        '''Find all directives in document'''
+        '''Find all directives (and requirements) in document'''
         self._qlog.debug("Finding directives...")
-        directive_in_progress = False
-        directive_paragraphs = []
-        current_requirement = {}
-
-        json_text = ""
+        current_requirement = None
         current_heading_text = ""
-        for p in self.paragraphs:
-            p_added = False
-            if self.get_heading_level(p):
-                p_is_heading = True
-                current_heading_text = p.text.strip()
+        #pylint: disable=locally-disabled, protected-access
+        body = None if self._document is None else self._document._body
+        for token in self.tokenize():
+            if token.token_type == 'heading':
+                current_heading_text = token.texts[0].strip()
+                if current_requirement is not None:
+                    # Commit the requirement in progress
+                    self.requirements.append(current_requirement)
+                    current_requirement = None
+            elif token.token_type == 'body':
+                text = token.texts[0]
+                if current_requirement is not None and text:
+                    # Current paragraph is requirements text, so add it to the requirement
+                    # in progress
+                    current_requirement._texts.append(text)
             else:
-                p_is_heading = False
-
-            if not directive_in_progress:
-                if '${' in p.text:
-                    # Start found
-                    directive_in_progress = True
-                    directive_paragraphs.append(p)
-                    json_text += p.text
-                    p_added = True
-
-                if current_requirement:
-                    # A feature is in progress.  Add to it or commit it.
-                    if p_is_heading:
-                        # Current paragraph is a heading 
-                        # so commit the feature in progress
+                directive = Directive(token, body)
+                self._directives.append(directive)
+                if '#document_info' in token.as_dict:
+                    self.doc_info_directive = directive
+
+                # If this is a requirements directive
+                if is_shortform_dict(token.as_dict):
+                    # If the previous requirement has not been committed, then
+                    # commit it now.
+                    if current_requirement is not None:
                         self.requirements.append(current_requirement)
-                        current_requirement = {}
-                    else:
-                        if p.text and not '${' in p.text:
-                            # Current paragraph is requirements text, so add it to the feature
-                            # in progress
-                            if current_requirement['req_text']:
-                                current_requirement['req_text'] += '\n' + p.text
-                            else:
-                                current_requirement['req_text'] += p.text
-            if directive_in_progress:
-                if not p_added:
-                    # Capture constituent paragraphs
-                    directive_paragraphs.append(p)
-                    json_text += p.text
-                    p_added = True
-
-                if '}$' in p.text:
-                    # End found
-                    json_text = json_text.replace('“', '"').replace('”', '"').strip('$')
-                    self._qlog.debug('Directive JSON: "{}"'.format(json_text))
-                    as_dict = json_to_dict(json_text)
-                    if as_dict:
-                        directive = self._Directive(
-                            directive_paragraphs,
-                            as_dict
-                            )
-                        self._directives.append(directive)
-                        if '#document_info' in as_dict:
-                            self.doc_info_directive = directive
-                        self._qlog.debug("Found directive {}".format(as_dict))
-                    else:
-                        raise FatalUserError("JSON error")
-
-                    # If this is a requirements directive
-                    if is_shortform_dict(as_dict):
-                        # If the previous requirement has not been committed, then
-                        # commit it now.
-                        if current_requirement:
-                            self.requirements.append(current_requirement)
-                            current_requirement = {}
-
-                        # Create requirement dict
-                        current_requirement = {
-                            'directive': directive,
-                            'req_text': '',
-                            'heading_text': current_heading_text
-                        }
-
-                    # Clear search
-                    directive_in_progress = False
-                    directive_paragraphs = []
-                    json_text = ''
-
-        # Commit the last feature
-        if current_requirement:
+
+                    # Create requirement
+                    current_requirement = Requirement(directive, current_heading_text)
+
+        # Commit the last requirement
+        if current_requirement is not None:
             self.requirements.append(current_requirement)
-            current_requirement = {}
 
         self._qlog.debug("Found {} directives".format(len(self._directives)))
         self._qlog.debug("Found {} requirements".format(len(self.requirements)))
-        self._qlog.debug("Requirements:\n {}".format(pp.pformat(self.requirements)))
+        self._qlog.debug(lambda: "Requirements:\n {}".format(pp.pformat(self.requirements)))
+
+    def paragraph_texts(self):
+        '''Yield the text of each body paragraph, in document order'''
+        for token in self.tokenize():
+            yield from token.texts
+
+    def _require_document(self, operation):
+        '''Raise if the python-docx document model is needed but wasn't loaded'''
+        if self.read_only:
+            raise RuntimeError('WordDocx.{}() is not available in read-only mode.'.format(operation))
+
+    def scan_paragraphs(self):
+        '''Yield (element, text, style_id) for each body paragraph, in document order
+
+        This walks the w:body/w:p elements directly with lxml, extracting each
+        paragraph's text and w:pStyle value in a single pass.  The text matches
+        python-docx's Paragraph.text (the text of the paragraph's direct w:r
+        children, with w:tab and w:br/w:cr mapped to '\\t' and '\\n').
+        style_id is None if the paragraph has no explicit style.
+        '''
+        for p_element in self._document.element.body.iterchildren(TAG_P):
+            yield (p_element, paragraph_element_text(p_element), paragraph_element_style_id(p_element))
+
+    def build_style_tables(self, styles_element):
+        '''Build the paragraph style id -> name and style id -> heading level tables
+
+        Both tables are built once per document from styles.xml, so that resolving
+        a paragraph's style (which python-docx does by searching styles.xml on every
+        access to Paragraph.style) is a dict lookup.  The key None maps to the
+        document's default paragraph style, which is the style python-docx reports
+        for paragraphs having no (or an unknown) w:pStyle.
+
+        A style is a heading if its name has one of the forms 'Heading N' or
+        'Appendix_X_Level_N'. Otherwise, a style is a heading if it declares (or
+        inherits via w:basedOn) a w:outlineLvl between 0 and 8.
+        '''
+        outline_levels = {}
+        based_on = {}
+        default_style_id = None
+        for style in styles_element.iterchildren(TAG_STYLE):
+            style_id = style.get(ATTR_STYLE_ID)
+            name = style.find(TAG_NAME)
+            name = BabelFish.internal2ui(name.get(ATTR_VAL) if name is not None else style_id)
+            self._all_style_names.add(name)
+            if style.get(ATTR_TYPE) != 'paragraph':
+                continue
+            self._style_names[style_id] = name
+            if style.get(ATTR_DEFAULT) in ('1', 'true', 'on'):
+                default_style_id = style_id
+            parent = style.find(TAG_BASED_ON)
+            if parent is not None:
+                based_on[style_id] = parent.get(ATTR_VAL)
+            ppr = style.find(TAG_PPR)
+            outline_lvl = ppr.find(TAG_OUTLINE_LVL) if ppr is not None else None
+            if outline_lvl is not None:
+                outline_levels[style_id] = int(outline_lvl.get(ATTR_VAL))
+
+        for style_id, name in self._style_names.items():
+            heading_level = heading_level_from_style_name(name)
+            if heading_level is None:
+                # Walk the basedOn chain (guarding against cycles) for an outline level
+                ancestor, visited = style_id, set()
+                while ancestor is not None and ancestor not in visited:
+                    if ancestor in outline_levels:
+                        if outline_levels[ancestor] <= MAX_OUTLINE_LVL:
+                            heading_level = outline_levels[ancestor] + 1
+                        break
+                    visited.add(ancestor)
+                    ancestor = based_on.get(ancestor)
+            if heading_level is not None:
+                self._heading_levels[style_id] = heading_level
+
+        self._style_names[None] = self._style_names.get(default_style_id, 'Normal')
+        if default_style_id in self._heading_levels:
+            self._heading_levels[None] = self._heading_levels[default_style_id]
+
+    def has_style(self, style_name):
+        '''True if the document defines a style named style_name'''
+        return style_name in self._all_style_names
+
+    def get_style_name(self, style_id):
+        '''Name of the paragraph style with style_id (None for the default paragraph style)'''
+        if style_id in self._style_names:
+            return self._style_names[style_id]
+        return self._style_names[None]
+
+    def get_style_heading_level(self, style_id):
+        '''Numerical heading level of the paragraph style with style_id if it is a heading style.  None otherwise'''
+        if style_id in self._style_names:
+            return self._heading_levels.get(style_id)
+        return self._heading_levels.get(None)
+
+    def get_style_id(self, paragraph):
+        '''The style id of a paragraph (None if it has the default paragraph style)'''
+        #pylint: disable=locally-disabled, no-self-use, protected-access
+        return paragraph_element_style_id(paragraph._p)
 
     def get_text(self, paragraph):
         '''Get a paragraph's text'''
@@ -158,17 +521,53 @@ class WordDocx(object):
         first_p = directive.paragraphs[0]
         directive_json = make_json_autoformat(directive.as_dict)
         if is_shortform_dict(directive.as_dict):
-            paragraph = first_p.insert_paragraph_before(directive_json)
+            paragraph = self.insert_paragraph_before(first_p, directive_json)
             self.format_paragraph(paragraph, 'directive_visible')
         else:
             lines = directive_json.split('\n')
             for line in lines:
-                paragraph = first_p.insert_paragraph_before(line)
+                paragraph = self.insert_paragraph_before(first_p, line)
                 self.format_paragraph(paragraph, 'directive_hidden')
         # Delete old directive paragraph(s)
         for paragraph in directive.paragraphs:
             self.delete_paragraph(paragraph)
 
+    def rewrite_directives(self, directives):
+        '''Rewrite a batch of (presumably modified) directives to the document
+
+        Each directive's new JSON is patched into the text (w:t) nodes of its existing
+        paragraphs in place, which leaves the paragraphs, their style, and the run
+        formatting of unchanged text intact. Only the characters which actually changed
+        are touched, so e.g. annotating 'SRD-RCN-?' to 'SRD-RCN-0101' edits a single
+        text node.  A directive is rewritten with rewrite_directive() (i.e. its
+        paragraphs are replaced) only if its line structure changed, or the change
+        would cross a tab or line break.
+
+        Returns the number of directives which needed paragraph replacement
+        '''
+        self._require_document('rewrite_directives')
+        num_replaced = 0
+        self._tokens = None
+        for directive in directives:
+            directive_json = make_json_autoformat(directive.as_dict)
+            if is_shortform_dict(directive.as_dict):
+                new_texts = [directive_json]
+            else:
+                new_texts = directive_json.split('\n')
+            paragraphs = directive.paragraphs
+            patched = len(new_texts) == len(paragraphs)
+            if patched:
+                for paragraph, new_text in zip(paragraphs, new_texts):
+                    #pylint: disable=locally-disabled, protected-access
+                    if not patch_paragraph_element_text(paragraph._p, new_text):
+                        patched = False
+                        break
+            if not patched:
+                self._qlog.debug('Replacing directive paragraphs: "{}"'.format(to_snippet(directive_json)))
+                self.rewrite_directive(directive)
+                num_replaced += 1
+        return num_replaced
+
     def delete_paragraph(self, paragraph):
         '''See https://github.com/python-openxml/python-docx/issues/33
         From 3/16/2015 post by docx author (scanny)
@@ -178,6 +577,7 @@ class WordDocx(object):
         '''
         #pylint: disable=locally-disabled, no-self-use, protected-access, invalid-name
 
+        self._track_delete(paragraph)
         p = paragraph._element
         p.getparent().remove(p)
         p._p = p._element = None
@@ -230,27 +630,25 @@ class WordDocx(object):
 
     def get_heading_level(self, paragraph):
         '''Numerical heading level of paragraph if is heading.  None otherwise'''
-        #pylint: disable=locally-disabled, no-self-use
-
-        style = paragraph.style.name
-        if style.startswith('Heading'):
-            # Style has form 'Heading N'
-            return int(style.split(' ')[1])
-        elif style.startswith('Appendix_') and '_Level_' in style:
-            # Style has form 'Appendix_X_Level_N'
-            return int(style.split('_')[-1])
-        return None
+        return self.get_style_heading_level(self.get_style_id(paragraph))
 
     def insert_paragraph(self, paragraph, text):
         '''Insert a new paragraph AFTER the specified paragraph'''
         next_pararaph, index = self.get_next_paragrah(paragraph)
         if next_pararaph:
             new_paragraph = next_pararaph.insert_paragraph_before(text)
-            self.paragraphs.insert(index, new_paragraph)
+            self._track_insert(index, new_paragraph)
             return new_paragraph
         else:
             self._qlog.critical('WordDocx.insert_paragraph() cannot be called on last paragraph.')
 
+    def insert_paragraph_before(self, paragraph, text):
+        '''Insert a new paragraph BEFORE the specified paragraph'''
+        new_paragraph = paragraph.insert_paragraph_before(text)
+        index = self.get_paragraph_index(paragraph)
+        if index is not None:
+            self._track_insert(index, new_paragraph)
+        return new_paragraph
 
     def insert_directive(self, paragraph, data_dict, simple=False, format_type='directive_hidden'):
         '''Insert dict as JSON directive located AFTER the specified paragraph
@@ -267,7 +665,7 @@ class WordDocx(object):
             new_paragraph = next_pararaph.insert_paragraph_before(insert_text)
             self.format_paragraph(new_paragraph, format_type)
             new_paragraph.paragraph_format.left_indent = paragraph.paragraph_format.left_indent
-            self.paragraphs.insert(index, new_paragraph)
+            self._track_insert(index, new_paragraph)
             return new_paragraph
         else:
             self._qlog.error('The following directive could not be inserted because it would have '+
@@ -279,21 +677,16 @@ class WordDocx(object):
 
         Returns a tuple: (paragraph, index)
             paragraph and index will be null if no solution was found
-        python-docx has no paragraph.next() method.  This method implements a brute-force search
-        which is adequate at present.
+        python-docx has no paragraph.next() method, so the paragraph is located via
+        get_paragraph_index().
         '''
-        found = False
-        #self._qlog.debug('get_next_paragraph: Searching for: "{}"'.format(to_snippet(paragraph.text)))
-        for index, search_p in enumerate(self.paragraphs):
-            #self._qlog.debug('get_next_paragraph: Comparing: "{}"'.format(to_snippet(search_p.text)))
-            if found:
-                return (search_p, index)
-            if search_p == paragraph:
-                found = True
-        if not found:
+        index = self.get_paragraph_index(paragraph)
+        if index is None:
             self._qlog.debug('get_next_paragraph: Search target not found.')
-        else:
+        elif index + 1 >= len(self.paragraphs):
             self._qlog.debug('get_next_paragraph: Search target was last paragraph in doc.')
+        else:
+            return (self.paragraphs[index + 1], index + 1)
         return (None, None)
 
     def get_clusters(self):
@@ -322,61 +715,35 @@ class WordDocx(object):
                     'paragraphs':     <a list containing the directive paragraphs (1 or more)>,
                     'directive':      <a dict representing the directive data>
                 }
+
+        Clusters are a view over the (cached) output of tokenize().
         '''
+        self._require_document('get_clusters')
         clusters = []
-        directive_in_progress = False
-        cluster_paragraphs = []
-        json_text = ''
-        for paragraph in self.paragraphs:
-            p_added = False
-            if not directive_in_progress:
-                if '${' in paragraph.text:
-                    # Start found
-                    directive_in_progress = True
-                    cluster_paragraphs.append(paragraph)
-                    json_text += paragraph.text
-                    p_added = True
-                else:
-                    #-- if paragraph.heading_level:
-                    heading_level = self.get_heading_level(paragraph)
-                    if heading_level:
-                            clusters.append({
-                                'cluster_type':   'heading',
-                                'paragraphs':    [paragraph],
-                                'heading_level': heading_level 
-                            })
-                    else:
-                        clusters.append({
-                                'cluster_type': 'body',
-                                'paragraphs': [paragraph]
-                            })
-            if directive_in_progress:
-                if not p_added:
-                    # Capture constituent paragraphs
-                    cluster_paragraphs.append(paragraph)
-                    json_text += paragraph.text
-                    p_added = True
-                if '}$' in paragraph.text:
-                    # End of directive found
-                    json_text = extract_json_from_directive(json_text)
-                    self._qlog.debug('Directive JSON: "{}"'.format(json_text))
-                    as_dict = json_to_dict(json_text)
-                    if as_dict:
-                        if is_shortform_dict(as_dict):
-                            as_dict = expand_shortform_dict(as_dict)
-                        clusters.append({
-                            'cluster_type': 'directive',
-                            'paragraphs':   cluster_paragraphs,
-                            'directive':    as_dict
-                        })
-                        self._qlog.debug("Found directive {}".format(as_dict))
-                    else:
-                        raise RuntimeError("JSON error")
-
-                    # Clear search
-                    directive_in_progress = False
-                    cluster_paragraphs = []
-                    json_text = ''
+        #pylint: disable=locally-disabled, protected-access
+        body = self._document._body
+        for token in self.tokenize():
+            paragraphs = [Paragraph(element, body) for element in token.elements]
+            if token.token_type == 'heading':
+                clusters.append({
+                    'cluster_type':   'heading',
+                    'paragraphs':    paragraphs,
+                    'heading_level': token.heading_level
+                })
+            elif token.token_type == 'body':
+                clusters.append({
+                    'cluster_type': 'body',
+                    'paragraphs': paragraphs
+                })
+            else:
+                as_dict = token.as_dict
+                if is_shortform_dict(as_dict):
+                    as_dict = expand_shortform_dict(as_dict)
+                clusters.append({
+                    'cluster_type': 'directive',
+                    'paragraphs':   paragraphs,
+                    'directive':    as_dict
+                })
 
         if self._qlog.debug_is_enabled():
             # Log the fist handful of clusters for debug
@@ -398,25 +765,38 @@ class WordDocx(object):
 
         return clusters
 
-    def save(self, filename):
-        '''Save the current file'''
+    def save(self, filename, compress_level=DEFAULT_COMPRESS_LEVEL):
+        '''Save the current file
+
+        Zip members of the original .docx which are unchanged are copied as-is (see
+        docx_package.py); only modified parts are compressed, at compress_level (0-9).
+        '''
         # TODO: Should this close as well?
-        self._document.save(filename)
+        self._require_document('save')
+        num_copied, num_compressed = save_package(
+            self._document.part.package, self._filename_original, filename, compress_level)
+        self._qlog.debug('Saved "{}": {} parts copied, {} parts compressed'.format(
+            filename, num_copied, num_compressed))
+
+    def count_change_tracking(self):
+        '''Return (insertions, deletions): the number of change tracking blocks in the document body'''
+        if self.read_only:
+            # Counted while the document was streamed
+            return self._change_tracking_counts
+        body = self._document._body._body
+        return (len(body.xpath('*/w:ins')), len(body.xpath('*/w:del')))
 
     def warn_on_change_tracking(self):
         '''Check whether the document contains change tracking elements and warn accordingly.'''
-        body = self._document._body._body
-
         self._qlog.debug('warn_on_change_tracking()...')
 
         ct_items = []
-        ct_insertions = body.xpath('*/w:ins')
-        ct_deletions = body.xpath('*/w:del')
+        ct_insertions, ct_deletions = self.count_change_tracking()
 
         if ct_insertions:
-            ct_items.append(f'{len(ct_insertions)} insertion{plural_s(len(ct_insertions))}')
+            ct_items.append(f'{ct_insertions} insertion{plural_s(ct_insertions)}')
         if ct_deletions:
-            ct_items.append(f'{len(ct_deletions)} deletion{plural_s(len(ct_deletions))}')
+            ct_items.append(f'{ct_deletions} deletion{plural_s(ct_deletions)}')
 
         if ct_items:
             self._qlog.warning(
@@ -430,3 +810,118 @@ class WordDocx(object):
 
 def plural_s(count):
     return 's' if count != 1 else ''
+
+# Heading style names: 'Heading N' and 'Appendix_X_Level_N'
+HEADING_STYLE_NAME_PATTERN = re.compile(r'^(?:Heading (\d+)|Appendix_.+_Level_(\d+))$')
+
+def heading_level_from_style_name(style):
+    '''Numerical heading level of a paragraph style name if is heading.  None otherwise
+
+    Other names (e.g. 'Heading Unnumbered', or LibreOffice's 'Heading') are not
+    numbered headings, and give None.
+    '''
+    match = HEADING_STYLE_NAME_PATTERN.match(style)
+    if match is None:
+        return None
+    return int(match.group(1) or match.group(2))
+
+def paragraph_element_text(p_element):
+    '''Text of a w:p element, equivalent to python-docx's Paragraph.text'''
+    pieces = []
+    for r_element in p_element.iterchildren(TAG_R):
+        for child in r_element:
+            tag = child.tag
+            if tag == TAG_T:
+                if child.text:
+                    pieces.append(child.text)
+            elif tag == TAG_TAB:
+                pieces.append('\t')
+            elif tag == TAG_BR or tag == TAG_CR:
+                pieces.append('\n')
+    return ''.join(pieces)
+
+def paragraph_element_style_id(p_element):
+    '''The w:pStyle value of a w:p element, or None if the paragraph has no explicit style'''
+    ppr = p_element.find(TAG_PPR)
+    if ppr is None:
+        return None
+    pstyle = ppr.find(TAG_PSTYLE)
+    if pstyle is None:
+        return None
+    return pstyle.get(ATTR_VAL)
+
+def patch_paragraph_element_text(p_element, new_text):
+    '''Change the text of a w:p element to new_text, editing its existing w:t nodes in place
+
+    The common prefix and suffix of the old and new text are left untouched. The
+    differing span is written into the w:t node where it begins (and removed from
+    any following w:t nodes it overlaps), so run formatting is preserved.
+
+    Returns True if the text was patched (or was already equal to new_text).
+    Returns False, without modifying the paragraph, if the change can't be made
+    by editing w:t nodes (e.g. it involves a tab or line break).
+    '''
+    segments = []   # (w:t node or None for tab/break, start offset, end offset)
+    position = 0
+    for r_element in p_element.iterchildren(TAG_R):
+        for child in r_element:
+            tag = child.tag
+            if tag == TAG_T:
+                length = len(child.text or '')
+                segments.append((child, position, position + length))
+                position += length
+            elif tag == TAG_TAB or tag == TAG_BR or tag == TAG_CR:
+                segments.append((None, position, position + 1))
+                position += 1
+    old_text = paragraph_element_text(p_element)
+    if old_text == new_text:
+        return True
+
+    # Find the differing span: old_text[start:old_end] becomes replacement
+    max_common = min(len(old_text), len(new_text))
+    start = 0
+    while start < max_common and old_text[start] == new_text[start]:
+        start += 1
+    suffix = 0
+    while suffix < max_common - start and old_text[-1 - suffix] == new_text[-1 - suffix]:
+        suffix += 1
+    old_end = len(old_text) - suffix
+    replacement = new_text[start:len(new_text) - suffix]
+    if '\t' in replacement or '\n' in replacement or '\r' in replacement:
+        return False
+
+    # Pick the w:t node in which the span begins (or which it extends)
+    target = None
+    for segment in segments:
+        if segment[1] <= start < segment[2]:
+            target = segment
+            break
+    if target is None or target[0] is None:
+        target = None
+        for segment in segments:
+            if segment[2] == start and segment[0] is not None:
+                target = segment
+    if target is None:
+        return False
+    for node, seg_start, seg_end in segments:
+        if node is None and seg_start < old_end and seg_end > start:
+            return False
+
+    # Patch the target node and trim the span from any nodes following it
+    node, seg_start, seg_end = target
+    text = node.text or ''
+    tail = text[old_end - seg_start:] if old_end < seg_end else ''
+    set_t_text(node, text[:start - seg_start] + replacement + tail)
+    for node, seg_start, seg_end in segments:
+        if seg_start >= old_end:
+            break
+        if node is target[0] or seg_start < target[2]:
+            continue
+        set_t_text(node, (node.text or '')[old_end - seg_start:] if old_end < seg_end else '')
+    return True
+
+def set_t_text(t_element, text):
+    '''Set the text of a w:t element, preserving leading/trailing whitespace'''
+    t_element.text = text
+    if text != text.strip():
+        t_element.set(ATTR_XML_SPACE, 'preserve')
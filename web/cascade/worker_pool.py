@@ -0,0 +1,117 @@
+'''Run per-document work in parallel worker processes
+
+Used by commands which process many documents independently (e.g. checking
+several documents, or extracting the documents of an aggregate zip).
+
+Each job runs in a worker process with its console output captured (rather than
+printed), and its log file messages prefixed with the job's label (typically the
+document's filename).  Results are yielded in submission order, each with its
+captured output and its qlog message counts, so the caller can print output in a
+deterministic order and the final WARNING/ERROR counts cover every job.
+'''
+
+# Standard library
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+# Local
+from cascade import quicklog
+from cascade import log_writer
+from cascade import parse_cache
+from cascade import object_id_index
+from cascade import aggregate_manifest
+from cascade.custom_exceptions import FatalUserError
+
+# The outcome of a job.
+#   value:      The job function's return value (None if it raised FatalUserError)
+#   output:     The job's captured console output (None if the job ran in this
+#               process, in which case its output was printed as it ran)
+#   counters:   The job's qlog message counts, by level (None if the job ran in
+#               this process)
+JobResult = namedtuple('JobResult', 'value output counters')
+
+def resolve_jobs(jobs):
+    '''Return the number of worker processes to use for a requested number of jobs (0 means one per CPU)'''
+    if jobs <= 0:
+        return os.cpu_count() or 1
+    return jobs
+
+def run_jobs(func, jobs_args, labels, jobs):
+    '''Run func(*args) for each args in jobs_args, using up to jobs worker processes
+
+    labels gives a label (e.g. a document filename) for each job, used to attribute
+    the job's log file messages.
+
+    If jobs is 1 (or there is only one job) the jobs run in this process, one at a
+    time, exactly as if func had been called directly.
+
+    Yields a JobResult for each job, in submission order.  The message counts of
+    each job are added to this process's qlog counts as its result is yielded.
+    '''
+    jobs_args = list(jobs_args)
+    if jobs <= 1 or len(jobs_args) <= 1:
+        for args in jobs_args:
+            yield JobResult(_call(func, args), None, None)
+        return
+
+    qlog = quicklog.get_logger()
+    cache = parse_cache.get_cache()
+    # Forked workers inherit the log writers' open files, so write out everything
+    # logged so far (otherwise on Python < 3.7, which lacks at-fork hooks, a worker
+    # could also write it)
+    log_writer.flush_all()
+    with ProcessPoolExecutor(
+            max_workers=min(jobs, len(jobs_args)),
+            initializer=_init_worker,
+            initargs=(
+                qlog.get_settings(), cache, object_id_index.get_index(),
+                aggregate_manifest.get_manifest())) as executor:
+        futures = [
+            executor.submit(_run_job, func, args, label)
+            for args, label in zip(jobs_args, labels)]
+        for future in futures:
+            result = future.result()
+            qlog.add_counters(result.counters)
+            yield result
+
+def _init_worker(qlog_settings, cache, index, manifest):
+    '''Set up logging, the parse cache, the object ID index and the aggregate manifest in a new worker process
+
+    Forked workers inherit all of these from the parent process.  Spawned workers (e.g. on
+    Windows) start from scratch, so they are configured like the parent.
+    '''
+    try:
+        quicklog.get_logger(qlog_settings['logger_name'])
+    except ValueError:
+        quicklog.Quicklog(**qlog_settings)
+        if cache is not None:
+            parse_cache.configure(cache.directory, cache.max_bytes)
+        if index is not None:
+            object_id_index.configure(index.path)
+        if manifest is not None:
+            aggregate_manifest.configure(manifest.directory, manifest.max_bytes)
+
+def _run_job(func, args, label):
+    '''Run a job in a worker process, capturing its output and counting its messages'''
+    qlog = quicklog.get_logger()
+    qlog.clear_counters()
+    qlog.set_log_context(label)
+    qlog.start_print_capture(echo=False)
+    try:
+        value = _call(func, args)
+    finally:
+        output = qlog.stop_print_capture()
+        qlog.set_log_context('')
+        # Worker processes exit without running atexit handlers, so the job's
+        # log messages are written out now
+        log_writer.flush_all()
+    return JobResult(value, output, qlog.get_counters())
+
+def _call(func, args):
+    '''Call func(*args). A FatalUserError is logged (as it would be by __main__) and returns None'''
+    try:
+        return func(*args)
+    except FatalUserError as err:
+        quicklog.get_logger().error(str(err))
+        return None
@@ -0,0 +1,96 @@
+'''Serve the Cascade web app with gunicorn (for "cascade http --workers N")
+
+Flask's development server (used by "cascade http") handles each request in a
+thread of a single process.  In production the app is instead served by
+gunicorn, with several (prefork) worker processes, each handling requests in a
+few threads:
+
+* The app, every command module and their libraries (python-docx, lxml,
+  openpyxl, ...) are imported in the master process before the workers are
+  forked (gunicorn's "preload"), so workers start warm and share those pages.
+* Workers are recycled gracefully: after handling about max_requests requests
+  (with some jitter, so they don't all restart at once) a worker finishes its
+  in-flight requests and is replaced.
+'''
+
+# Standard library
+import importlib
+
+# Local
+from cascade import quicklog
+from cascade import log_writer
+from cascade import jobs
+from cascade.custom_exceptions import FatalUserError
+
+qlog = quicklog.get_logger()
+lprint = qlog.lprint
+
+# Seconds a worker may take to handle one request (aggregating a large zip can
+# take minutes) before gunicorn restarts it
+WORKER_TIMEOUT = 300
+
+# Seconds a recycled (or stopped) worker is given to finish its in-flight requests
+GRACEFUL_TIMEOUT = 60
+
+# Maximum random number of requests added to max_requests (as a fraction of it)
+MAX_REQUESTS_JITTER = 0.1
+
+def gunicorn_options(host, port, workers, threads, max_requests):
+    '''Return the gunicorn settings used to serve the app'''
+    return {
+        'bind': '{}:{}'.format(host, port),
+        'workers': workers,
+        'worker_class': 'gthread' if threads > 1 else 'sync',
+        'threads': threads,
+        'preload_app': True,
+        'max_requests': max_requests,
+        'max_requests_jitter': int(max_requests * MAX_REQUESTS_JITTER),
+        'timeout': WORKER_TIMEOUT,
+        'graceful_timeout': GRACEFUL_TIMEOUT,
+        'pre_fork': _pre_fork,
+        'worker_exit': _worker_exit,
+    }
+
+def preload_command_modules():
+    '''Import every command module (and so the libraries they use)'''
+    # Imported here, since main (and the modules it imports) need the logger
+    from cascade.main import COMMAND_HANDLERS
+    for module_name, _function_name in COMMAND_HANDLERS.values():
+        importlib.import_module(module_name)
+
+def serve(app, host, port, workers, threads, max_requests):
+    '''Serve a WSGI app with gunicorn (until the server is stopped)'''
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise FatalUserError(
+            '"cascade http --workers" requires the "gunicorn" package (which runs on '
+            'Linux/macOS only). Run "cascade http" (without --workers) to use the '
+            'development server instead.')
+
+    class Application(BaseApplication):
+        '''gunicorn application serving app, configured by options'''
+        #pylint: disable=locally-disabled, abstract-method
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    preload_command_modules()
+    lprint('Serving on {}:{} with {} worker processes ({} threads each).'.format(host, port, workers, threads))
+    Application(gunicorn_options(host, port, workers, threads, max_requests)).run()
+
+def _pre_fork(_server, _worker):
+    '''Write out the master's buffered log output, so forked workers don't inherit (and repeat) it'''
+    log_writer.flush_all()
+
+def _worker_exit(_server, _worker):
+    '''Let the exiting worker's background jobs finish (or mark them failed), then write out its queued log messages'''
+    jobs.drain(GRACEFUL_TIMEOUT)
+    log_writer.close_all()
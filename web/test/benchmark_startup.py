@@ -0,0 +1,70 @@
+'''Benchmark command line startup time
+
+Times complete runs of "cascade check" on a small document (which is dominated by
+startup, i.e. imports), and lists the slowest top level imports made by a run.
+
+Usage (from the web/ directory):
+    python -m test.benchmark_startup [<runs>]
+'''
+
+# Standard library
+import os
+import sys
+import time
+import shutil
+import tempfile
+import statistics
+import subprocess
+
+# Get the path to the test directory (this file's path)
+test_root_path = os.path.dirname(os.path.realpath(__file__))
+web_path = os.path.dirname(test_root_path)
+
+DEFAULT_RUNS = 10
+NUM_SLOWEST_IMPORTS = 12
+
+def run_check(work_path, docx_filename, extra_python_args=()):
+    '''Run "cascade check" once, returning (elapsed seconds, stderr)'''
+    env = dict(os.environ, PYTHONPATH=web_path)
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable] + list(extra_python_args)
+        + ['-m', 'cascade', '--no-cache', 'check', docx_filename],
+        cwd=work_path, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    return (time.perf_counter() - start, completed.stderr)
+
+def slowest_imports(importtime_output):
+    '''Parse "python -X importtime" output, returning [(cumulative us, package)] for top level imports'''
+    imports = []
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if cumulative_us.strip().isdigit() and not name.startswith('  '):
+            imports.append((int(cumulative_us), name.strip()))
+    return sorted(imports, reverse=True)[:NUM_SLOWEST_IMPORTS]
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_RUNS
+    work_path = tempfile.mkdtemp(prefix='cascade_startup_')
+    try:
+        docx_filename = os.path.join(work_path, 'startup.docx')
+        shutil.copyfile(os.path.join(test_root_path, 'hidden_style_master.docx'), docx_filename)
+        os.mkdir(os.path.join(work_path, 'log'))
+
+        # The first run is not timed
+        run_check(work_path, docx_filename)
+        times = [run_check(work_path, docx_filename)[0] for _ in range(runs)]
+        print('cascade check: {} runs, median {:.3f}s, min {:.3f}s'.format(
+            runs, statistics.median(times), min(times)))
+
+        _elapsed, importtime_output = run_check(work_path, docx_filename, ('-X', 'importtime'))
+        print('Slowest top level imports (cumulative):')
+        for cumulative_us, name in slowest_imports(importtime_output):
+            print('   {:8.1f}ms  {}'.format(cumulative_us / 1000, name))
+    finally:
+        shutil.rmtree(work_path, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -33,7 +33,7 @@ qlog.begin(os.path.dirname(__file__))
 qlog.info('test_check.py')
 
 from cascade.word_docx import WordDocx
-from cascade.cmd_check import check
+from cascade.cmd_check import check, check_document
 from cascade.custom_exceptions import FatalUserError
 
 DUMMY_TEXT = (
@@ -76,6 +76,59 @@ def test_check(doc_type, expected_result):
 
     assert result == expected_result
 
+def test_check_document():
+    test_doc_filename = build_test_document('normal_unassigned')
+    doc_filename = os.path.join(test_root_path, 'results', test_doc_filename)
+    doc = WordDocx(qlog, doc_filename)
+
+    # A loaded document can be checked via check() as well as check_document()
+    assert check({'<requirements.docx>': doc_filename}, doc=doc)
+
+    result = check_document(doc, doc_filename)
+    assert result.passed
+    assert '#document_info' in result.doc_info_dict
+    assert result.object_ids['ABC-DEF-']['next_id'] == 100
+    assert result.object_ids['ABC-DEF-']['num_unassigned'] == 1
+    assert result.object_ids['ABC-DEF-']['max'] == 2
+    assert sorted(result.all_object_ids) == ['ABC-DEF-000', 'ABC-DEF-002']
+    assert '#shortform' in result.schemas
+
+def test_check_multiple_documents_in_parallel():
+    filenames = [
+        os.path.join(test_root_path, 'results', build_test_document(doc_type))
+        for doc_type in ('normal', 'repeat_object_id_number', 'bad_directive_json', 'normal_unassigned')]
+    filenames.append(os.path.join(test_root_path, 'results', 'no_such_document.docx'))
+    errors_before = qlog.get_count(logging.ERROR)
+
+    qlog.start_print_capture()
+    result = check({'<requirements.docx>': filenames, '--jobs': '2'})
+    output = qlog.stop_print_capture()
+
+    assert not result
+    # Each document's report appears in order; the workers' errors are counted here
+    positions = [output.index('Checking "{}"'.format(filenames[index])) for index in (0, 1, 3)]
+    assert positions == sorted(positions)
+    assert 'Checked 5 documents: 2 passed, 3 failed.' in output
+    assert qlog.get_count(logging.ERROR) - errors_before >= 3
+    assert check({'<requirements.docx>': filenames[:1] * 2, '--jobs': '2'})
+
+def test_cached_check_reports_like_full_check(tmp_path):
+    from cascade import parse_cache
+    filename = os.path.join(test_root_path, 'results', build_test_document('normal_unassigned'))
+    parse_cache.configure(str(tmp_path / 'cache'))
+    try:
+        outputs = []
+        for _ in range(2):
+            qlog.start_print_capture(echo=False)
+            assert check({'<requirements.docx>': filename})
+            outputs.append(qlog.stop_print_capture())
+        assert WordDocx(qlog, filename, read_only=True).cached_check_result is not None
+    finally:
+        parse_cache.configure(None, enabled=False)
+    assert 'Object ID usage summary' in outputs[0]
+    # The second check reuses the cached result, and reports it in full
+    assert outputs[1] == outputs[0]
+
 def build_test_document(doc_type):
     with open(os.path.join(test_root_path, 'document_info.json')) as data_file:    
         document_info_dict = json.load(data_file)
@@ -0,0 +1,223 @@
+# Standard library
+import os
+import re
+import logging
+import csv
+import json
+import zipfile
+import importlib.util
+import pytest
+
+# Libraries
+import openpyxl
+
+# Local
+from cascade import quicklog
+
+# Get the path to the test directory (this file's path)
+test_root_path = os.path.dirname(os.path.realpath(__file__))
+
+# Builds test documents (and starts the default logger, if not already started)
+from test.test_check import build_test_document
+
+qlog = quicklog.get_logger()
+
+from cascade import cmd_aggregate
+from cascade import aggregate_manifest
+from cascade import object_id_index
+from cascade.cmd_aggregate import aggregate, staging_filenames
+from cascade.custom_exceptions import FatalUserError
+from cascade.exporters import (
+    Exporter, ExcelExporter, CsvExporter, JsonLinesExporter, ParquetExporter, parse_formats, MAX_XLSX_COL_WIDTH)
+
+PARQUET_AVAILABLE = any(importlib.util.find_spec(engine) for engine in ParquetExporter.ENGINES)
+
+# Headings and rows of the flattened export of add_test_rows()
+EXPECTED_HEADERS = ['id', 'System', 'Application', 'Radio', 'method', 'sourceDocument', 'notes', 'text']
+EXPECTED_ROWS = [
+    ['ABC-001', None, None, 'X', 'T', 'one.docx', None, None],
+    ['ABC-002', None, None, None, None, 'two.docx', 'a, b', 'x' * 100],
+]
+
+def add_test_rows(exporter):
+    exporter.add_column_header('id')
+    exporter.add_ennumeration('allocatedTo', ['System', 'Application', 'Radio'])
+    exporter.add_row({'id': 'ABC-001', 'method': 'T', 'allocatedTo': ['Radio'], 'sourceDocument': 'one.docx'})
+    exporter.add_row({'id': 'ABC-002', 'notes': ['a', 'b'], 'text': 'x' * 100, 'sourceDocument': 'two.docx'})
+    exporter.save()
+
+def test_excel_exporter():
+    filename = os.path.join(test_root_path, 'results', 'test_export.xlsx')
+    add_test_rows(ExcelExporter(filename))
+
+    worksheet = openpyxl.load_workbook(filename).active
+    rows = [[cell.value for cell in row] for row in worksheet.iter_rows()]
+    assert rows == [
+        [None, 'allocatedTo', None, None, None, None, None, None],
+        EXPECTED_HEADERS,
+    ] + EXPECTED_ROWS
+    assert worksheet.auto_filter.ref == 'B2:H4'
+    assert worksheet['B1'].border.left.style == 'thin' and worksheet['D1'].border.right.style == 'thin'
+    assert worksheet['A2'].fill.fgColor.rgb.endswith('EBF1DE')
+    assert worksheet['H3'].border.top.style == 'thin'
+    assert worksheet.column_dimensions['A'].width == pytest.approx(len('ABC-001') * 1.2)
+    assert worksheet.column_dimensions['F'].width == pytest.approx(len('sourceDocument') * 1.4)
+    assert worksheet.column_dimensions['H'].width == MAX_XLSX_COL_WIDTH
+
+def test_csv_exporter(tmp_path):
+    filename = str(tmp_path / 'test_export.csv')
+    add_test_rows(CsvExporter(filename))
+
+    with open(filename, newline='', encoding='utf-8') as in_file:
+        rows = list(csv.reader(in_file))
+    assert rows == [EXPECTED_HEADERS] + [
+        ['' if value is None else value for value in row] for row in EXPECTED_ROWS]
+
+def test_json_lines_exporter(tmp_path):
+    filename = str(tmp_path / 'test_export.jsonl')
+    exporter = JsonLinesExporter(filename)
+    # Rows are written as they are added, so no spool is created
+    assert exporter.spool is None
+    add_test_rows(exporter)
+
+    with open(filename, encoding='utf-8') as in_file:
+        rows = [json.loads(line) for line in in_file]
+    assert rows == [
+        {header: value for header, value in zip(EXPECTED_HEADERS, row) if value is not None}
+        for row in EXPECTED_ROWS]
+    assert list(rows[0]) == ['id', 'method', 'Radio', 'sourceDocument']
+
+def test_exporters_must_implement_save(tmp_path):
+    class IncompleteExporter(Exporter):
+        pass
+    with pytest.raises(TypeError):
+        IncompleteExporter(str(tmp_path / 'test_export.txt'))
+
+@pytest.mark.skipif(not PARQUET_AVAILABLE, reason='No Parquet engine installed')
+def test_parquet_exporter(tmp_path):
+    import pandas
+    filename = str(tmp_path / 'test_export.parquet')
+    add_test_rows(ParquetExporter(filename))
+
+    data_frame = pandas.read_parquet(filename)
+    assert list(data_frame.columns) == EXPECTED_HEADERS
+    assert data_frame.where(data_frame.notnull(), None).values.tolist() == EXPECTED_ROWS
+
+@pytest.mark.skipif(PARQUET_AVAILABLE, reason='A Parquet engine is installed')
+def test_parquet_requires_engine():
+    with pytest.raises(FatalUserError, match='pyarrow'):
+        parse_formats('parquet')
+
+def test_parse_formats():
+    assert parse_formats('xlsx') == ['xlsx']
+    assert parse_formats(' CSV, .jsonl,csv,') == ['csv', 'jsonl']
+    with pytest.raises(FatalUserError, match='Unsupported export format "xml"'):
+        parse_formats('xlsx,xml')
+    with pytest.raises(FatalUserError):
+        parse_formats('')
+
+def test_aggregate_reads_documents_from_zip(tmp_path, monkeypatch):
+    docx_filename = os.path.join(test_root_path, 'results', build_test_document('normal'))
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.join('cascade', 'static', 'results'))
+    with zipfile.ZipFile('documents.zip', 'w') as zip_file:
+        zip_file.write(docx_filename, 'one.docx')
+        zip_file.write(docx_filename, 'specs/two.docx')
+        zip_file.write(docx_filename, 'specs/more/three.docx')
+        # Flattened, its name would clash with specs/two.docx's
+        zip_file.write(docx_filename, 'specs_two.docx')
+        zip_file.writestr('__MACOSX/specs/._two.docx', 'Not a document')
+
+    result = aggregate({'<requirements.zip>': 'documents.zip', '--jobs': '2', '--format': 'csv,xlsx'})
+
+    assert sorted(result[:-2]) == ['one.json', 'specs_more_three.json', 'specs_two.json', 'specs_two_2.json']
+    assert result[-2:] == ['aggregation.csv', 'aggregation.xlsx']
+    assert sorted(os.listdir('temp')) == []
+    worksheet = openpyxl.load_workbook(os.path.join('cascade', 'static', 'results', 'aggregation.xlsx')).active
+    headers = [cell.value for cell in worksheet[2]]
+    source_column = headers.index('sourceDocument')
+    sources = [row[source_column].value for row in worksheet.iter_rows(min_row=3)]
+    assert sorted(set(sources)) == ['one.docx', 'specs/more/three.docx', 'specs/two.docx', 'specs_two.docx']
+    with open(os.path.join('cascade', 'static', 'results', 'aggregation.csv'), newline='') as in_file:
+        csv_rows = list(csv.reader(in_file))
+    assert csv_rows[0] == headers
+    assert len(csv_rows) - 1 == len(sources)
+
+def test_staging_filenames():
+    assert staging_filenames(['one.docx', 'a/b_c.docx', 'a_b/c.docx', 'A_B/C.docx', 'a_b_c_2.docx']) == [
+        'one.json', 'a_b_c.json', 'a_b_c_2.json', 'A_B_C_3.json', 'a_b_c_2_2.json']
+
+def test_aggregate_reuses_unchanged_documents(tmp_path, monkeypatch):
+    normal_filename = os.path.join(test_root_path, 'results', build_test_document('normal'))
+    unassigned_filename = os.path.join(test_root_path, 'results', build_test_document('normal_unassigned'))
+    monkeypatch.chdir(tmp_path)
+    with zipfile.ZipFile('documents.zip', 'w') as zip_file:
+        zip_file.write(normal_filename, 'one.docx')
+        zip_file.write(unassigned_filename, 'two.docx')
+    arguments = {'<requirements.zip>': 'documents.zip', '--jobs': '1', '--format': 'csv,jsonl'}
+    results_path = os.path.join('cascade', 'static', 'results')
+
+    def read_results(result):
+        outputs = {}
+        for filename in result:
+            with open(os.path.join(results_path, filename), 'rb') as in_file:
+                outputs[filename] = in_file.read()
+        return outputs
+
+    full_outputs = read_results(aggregate(arguments))
+
+    aggregate_manifest.configure(str(tmp_path / 'manifest'))
+    try:
+        qlog.start_print_capture(echo=False)
+        first_outputs = read_results(aggregate(arguments))
+        first_report = qlog.stop_print_capture()
+        # Neither document is parsed again
+        monkeypatch.setattr(cmd_aggregate, 'WordDocx', None)
+        qlog.start_print_capture(echo=False)
+        incremental_outputs = read_results(aggregate(arguments))
+        incremental_report = qlog.stop_print_capture()
+    finally:
+        aggregate_manifest.configure(None, enabled=False)
+
+    assert sorted(full_outputs) == ['aggregation.csv', 'aggregation.jsonl', 'one.json', 'two.json']
+    assert first_outputs == full_outputs
+    assert incremental_outputs == full_outputs
+    # Reused documents are reported exactly as in a full run
+    assert 'Object ID usage summary' in incremental_report
+    def without_temp_names(report):
+        return re.sub(r'staging_\w+', 'staging_', report)
+    assert without_temp_names(incremental_report) == without_temp_names(first_report)
+
+def test_aggregate_reports_collisions_between_folders(tmp_path, monkeypatch):
+    normal_filename = os.path.join(test_root_path, 'results', build_test_document('normal'))
+    monkeypatch.chdir(tmp_path)
+    # b/spec.docx is a copy of a/spec.docx, with the same object IDs (but different
+    # bytes, since its parts are stored uncompressed); c/spec.docx is an identical copy
+    with zipfile.ZipFile(normal_filename, 'r') as docx_in, zipfile.ZipFile('edited.docx', 'w') as docx_out:
+        for info in docx_in.infolist():
+            docx_out.writestr(info.filename, docx_in.read(info), zipfile.ZIP_STORED)
+    with zipfile.ZipFile('documents.zip', 'w') as zip_file:
+        zip_file.write(normal_filename, 'a/spec.docx')
+        zip_file.write('edited.docx', 'b/spec.docx')
+        zip_file.write(normal_filename, 'c/spec.docx')
+    object_id_index.configure(str(tmp_path / 'index.sqlite'))
+    warnings_before = qlog.get_count(logging.WARNING)
+    errors_before = qlog.get_count(logging.ERROR)
+    try:
+        qlog.start_print_capture(echo=False)
+        result = aggregate({'<requirements.zip>': 'documents.zip', '--jobs': '1', '--format': 'csv'})
+        report = qlog.stop_print_capture()
+    finally:
+        object_id_index.configure(None, enabled=False)
+
+    # The same-named documents are indexed separately (as members of the zip), so
+    # their shared IDs are reported, though identical copies don't collide with
+    # each other; the collisions are advisory, so the documents are still aggregated
+    zip_name = object_id_index.document_name('documents.zip')
+    assert 'appears in multiple documents: "{zip}!/a/spec.docx", "{zip}!/b/spec.docx", "{zip}!/c/spec.docx"'.format(
+        zip=zip_name) in report
+    # (a/ and c/ overlap b/)
+    assert report.count('ID ranges overlap') == 2
+    assert 'aggregation.csv' in result
+    assert qlog.get_count(logging.WARNING) > warnings_before
+    assert qlog.get_count(logging.ERROR) == errors_before
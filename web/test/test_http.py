@@ -0,0 +1,117 @@
+# Standard library
+import io
+import os
+import zipfile
+import pytest
+
+# Get the path to the test directory (this file's path)
+test_root_path = os.path.dirname(os.path.realpath(__file__))
+
+# Builds test documents (and starts the default logger, if not already started)
+from test.test_check import build_test_document
+
+from cascade import cmd_http
+from cascade import cmd_aggregate
+from cascade import jobs
+from cascade import cmd_check
+from cascade import object_id_index
+from cascade import parse_cache
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    '''A test client of the web app, running commands in the request (not as background jobs), in tmp_path'''
+    document_filename = os.path.join(test_root_path, 'results', build_test_document('normal'))
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(cmd_http.results_path_local)
+    monkeypatch.setattr(cmd_http, 'global_arguments', {'-w': False, '-g': False, '-p': False})
+    jobs.configure(None, enabled=False)
+    with open(document_filename, 'rb') as in_file:
+        client = cmd_http.app.test_client()
+        client.document = in_file.read()
+        yield client
+
+def upload(client, url, content, filename):
+    return client.post(url, data={'file': (io.BytesIO(content), filename)})
+
+def test_upload_in_memory(client):
+    response = upload(client, '/do_apply_styles', client.document, 'spec.docx')
+    assert response.status_code == 200
+    assert b'spec_STYLED.docx' in response.data
+    assert os.path.isfile(os.path.join(cmd_http.results_path_local, 'spec_STYLED.docx'))
+    # Never written to the uploads folder
+    assert not os.path.exists('uploads')
+
+def test_large_upload_uses_temporary_file(client, monkeypatch):
+    monkeypatch.setattr(cmd_http, 'UPLOAD_MEMORY_MAX_BYTES', 0)
+    response = upload(client, '/do_apply_styles', client.document, 'spec.docx')
+    assert response.status_code == 200
+    assert os.path.isfile(os.path.join(cmd_http.results_path_local, 'spec_STYLED.docx'))
+    # The temporary file is deleted once the command has run
+    assert os.listdir('uploads') == []
+
+def test_upload_too_large(client, monkeypatch):
+    monkeypatch.setitem(cmd_http.app.config, 'MAX_CONTENT_LENGTH', 1000)
+    response = upload(client, '/do_apply_styles', client.document, 'spec.docx')
+    assert response.status_code == 413
+    assert not os.listdir(cmd_http.results_path_local)
+
+def test_aggregate_upload_in_memory(client, monkeypatch):
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
+        zip_file.writestr('one.docx', client.document)
+        zip_file.writestr('folder/two.docx', client.document)
+    calls = []
+    original_run_jobs = cmd_aggregate.run_jobs
+    def run_jobs(func, jobs_args, labels, num_jobs):
+        jobs_args = list(jobs_args)
+        calls.append((jobs_args, num_jobs))
+        return original_run_jobs(func, jobs_args, labels, num_jobs)
+    monkeypatch.setattr(cmd_aggregate, 'run_jobs', run_jobs)
+    monkeypatch.setattr(cmd_http, 'resolve_jobs', lambda jobs: 8)
+
+    response = client.post('/do_aggregate', data={
+        'file': (io.BytesIO(zip_buffer.getvalue()), 'documents.zip'),
+        'format': 'csv'})
+    assert response.status_code == 200
+    assert b'aggregation.csv' in response.data
+    assert os.path.isfile(os.path.join(cmd_http.results_path_local, 'aggregation.csv'))
+
+    # The web server uses at most MAX_AGGREGATE_JOBS worker processes, which are
+    # given the (in memory) zip as a temporary file, deleted afterwards
+    [(jobs_args, num_jobs)] = calls
+    assert num_jobs == cmd_http.MAX_AGGREGATE_JOBS
+    zip_paths = set(zip_source for zip_source, _member_name, _index_name in jobs_args)
+    assert len(zip_paths) == 1
+    zip_path = zip_paths.pop()
+    assert isinstance(zip_path, str)
+    assert not os.path.exists(zip_path)
+
+def test_uploads_are_indexed_by_content(client, tmp_path):
+    document_filename = os.path.join(test_root_path, 'results', build_test_document('normal'))
+    object_id_index.configure(str(tmp_path / 'index.sqlite'))
+    try:
+        # The same document, checked from the command line and uploaded twice
+        # (once under another name), plus another (different) upload of spec.docx
+        assert cmd_check.check({'<requirements.docx>': document_filename})
+        assert upload(client, '/do_check', client.document, 'spec.docx').status_code == 200
+        assert upload(client, '/do_check', client.document, 'copy.docx').status_code == 200
+        with open(os.path.join(test_root_path, 'results', build_test_document('normal_unassigned')), 'rb') as in_file:
+            other_document = in_file.read()
+        assert upload(client, '/do_check', other_document, 'spec.docx').status_code == 200
+        index = object_id_index.get_index()
+        documents = index.documents()
+        collisions = index.collisions()
+    finally:
+        object_id_index.configure(None, enabled=False)
+
+    digest = parse_cache.file_digest(document_filename)
+    other_digest = parse_cache.file_digest(io.BytesIO(other_document))
+    assert documents == sorted([
+        object_id_index.document_name(document_filename),
+        object_id_index.upload_name('spec.docx', digest),
+        object_id_index.upload_name('copy.docx', digest),
+        object_id_index.upload_name('spec.docx', other_digest),
+        ])
+    # Only the different document collides with the others
+    for collision in collisions:
+        assert object_id_index.upload_name('spec.docx', other_digest) in collision.documents
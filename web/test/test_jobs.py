@@ -0,0 +1,140 @@
+# Standard library
+import os
+import threading
+import time
+
+# Starts the default logger (if not already started)
+import test.test_check
+
+from cascade import jobs
+from cascade import quicklog
+
+qlog = quicklog.get_logger()
+
+def wait_until_finished(job_queue, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while True:
+        job = job_queue.get(job_id)
+        if job.status in jobs.FINISHED_STATES or time.time() > deadline:
+            return job
+        time.sleep(0.05)
+
+def test_job_runs_in_background(tmp_path):
+    job_queue = jobs.JobQueue(str(tmp_path), workers=2, expire_seconds=60, sweep_interval=60)
+
+    def command(results_path):
+        qlog.lprint('Writing output')
+        with open(os.path.join(results_path, 'out.txt'), 'w') as out_file:
+            out_file.write('done')
+        return ['out.txt']
+    job_id = job_queue.submit('Test', command)
+
+    job = wait_until_finished(job_queue, job_id)
+    assert job.status == jobs.DONE
+    assert job.operation == 'Test'
+    assert job.results == ['out.txt']
+    assert job.finished >= job.created
+    assert 'Writing output' in job_queue.read_log(job_id)
+    assert os.path.isfile(os.path.join(job_queue.results_path(job_id), 'out.txt'))
+
+    # Not yet expired
+    job_queue.sweep()
+    assert job_queue.get(job_id) is not None
+
+def test_failed_job_and_sweep(tmp_path):
+    job_queue = jobs.JobQueue(str(tmp_path), workers=1, expire_seconds=0, sweep_interval=60)
+
+    def command(_results_path):
+        raise RuntimeError('Broken command')
+    job_id = job_queue.submit('Test', command)
+
+    job = wait_until_finished(job_queue, job_id)
+    assert job.status == jobs.FAILED
+    assert job.results == []
+    assert 'Broken command' in job_queue.read_log(job_id)
+
+    job_queue.sweep()
+    assert job_queue.get(job_id) is None
+    assert not os.path.exists(job_queue.job_path(job_id))
+
+def test_unknown_job_ids(tmp_path):
+    job_queue = jobs.JobQueue(str(tmp_path), workers=1, expire_seconds=60, sweep_interval=60)
+    assert job_queue.get('0' * 32) is None
+    assert job_queue.get('../../etc') is None
+
+def test_job_with_stale_heartbeat_has_failed(tmp_path):
+    job_queue = jobs.JobQueue(str(tmp_path), workers=1, expire_seconds=60, sweep_interval=60, stale_seconds=30)
+
+    # A job left "running" by a process which has gone, whose ID is now in use
+    # (by this process)
+    job_id = '1' * 32
+    os.makedirs(job_queue.job_path(job_id))
+    job_queue._write_job(jobs.Job(job_id, 'Test', jobs.RUNNING, time.time() - 120, None, os.getpid(), []))
+    assert job_queue.get(job_id).status == jobs.RUNNING
+
+    heartbeat = time.time() - 90
+    os.utime(job_queue.job_path(job_id, jobs.JOB_FILENAME), (heartbeat, heartbeat))
+    job = job_queue.get(job_id)
+    assert job.status == jobs.FAILED
+    assert job.finished == heartbeat
+
+    # Removed once expired, like any other failed job
+    job_queue.expire_seconds = 0
+    job_queue.sweep()
+    assert job_queue.get(job_id) is None
+
+def test_drain(tmp_path):
+    job_queue = jobs.JobQueue(str(tmp_path), workers=1, expire_seconds=60, sweep_interval=60)
+    release = threading.Event()
+
+    def command(_results_path):
+        qlog.lprint('Started')
+        release.wait(10)
+        return ['out.txt']
+    running_job_id = job_queue.submit('Test', command)
+    queued_job_id = job_queue.submit('Test', command)
+    deadline = time.time() + 10
+    while job_queue.get(running_job_id).status != jobs.RUNNING and time.time() < deadline:
+        time.sleep(0.05)
+
+    job_queue.drain(timeout=0.1)
+    running_job = job_queue.get(running_job_id)
+    assert running_job.status == jobs.FAILED
+    assert 'interrupted' in job_queue.read_log(running_job_id)
+    queued_job = job_queue.get(queued_job_id)
+    assert queued_job.status == jobs.FAILED
+    assert 'cancelled' in job_queue.read_log(queued_job_id)
+    release.set()
+
+def test_drain_waits_for_running_jobs(tmp_path):
+    job_queue = jobs.JobQueue(str(tmp_path), workers=1, expire_seconds=60, sweep_interval=60)
+
+    def command(_results_path):
+        time.sleep(0.2)
+        return ['out.txt']
+    job_id = job_queue.submit('Test', command)
+    deadline = time.time() + 10
+    while job_queue.get(job_id).status != jobs.RUNNING and time.time() < deadline:
+        time.sleep(0.05)
+
+    job_queue.drain(timeout=10)
+    assert job_queue.get(job_id).status == jobs.DONE
+
+def test_job_removed_before_it_runs(tmp_path):
+    job_queue = jobs.JobQueue(str(tmp_path), workers=1, expire_seconds=60, sweep_interval=60)
+    release = threading.Event()
+    ran = []
+
+    first_job_id = job_queue.submit('Test', lambda _results_path: release.wait(10) and ['out.txt'])
+    job_id = job_queue.submit('Test', lambda _results_path: ran.append(True))
+    # Its state is lost while it is queued
+    os.remove(job_queue.job_path(job_id, jobs.JOB_FILENAME))
+    release.set()
+
+    assert wait_until_finished(job_queue, first_job_id).status == jobs.DONE
+    deadline = time.time() + 10
+    while job_id in job_queue._futures and time.time() < deadline:
+        time.sleep(0.05)
+    assert job_id not in job_queue._futures
+    assert not ran
+    assert job_queue.get(job_id) is None
@@ -0,0 +1,109 @@
+# Standard library
+import os
+import logging
+import threading
+import pytest
+
+# Local
+from cascade.log_writer import AsyncWriter, RotatingFile, QueuedRotatingFileHandler, POLICY_DROP
+
+def test_rotating_file(tmp_path):
+    filename = str(tmp_path / 'test.log')
+    log_file = RotatingFile(filename, max_bytes=10, backup_count=2)
+    for text in ('aaaaaa\n', 'bbbbbb\n', 'cccccc\n', 'dddddd\n'):
+        log_file.write(text)
+    log_file.close()
+
+    def read(name):
+        with open(str(tmp_path / name)) as in_file:
+            return in_file.read()
+    assert read('test.log') == 'dddddd\n'
+    assert read('test.log.1') == 'cccccc\n'
+    assert read('test.log.2') == 'bbbbbb\n'
+    assert not os.path.exists(str(tmp_path / 'test.log.3'))
+
+def test_async_writer_batches_in_order():
+    written = []
+    flushes = []
+    writer = AsyncWriter(written.extend, lambda: flushes.append(len(written)))
+    for index in range(5000):
+        writer.put(index)
+    writer.flush()
+    assert written == list(range(5000))
+    assert flushes[-1] == 5000
+    writer.close()
+    writer.put('ignored')
+    assert written == list(range(5000))
+
+def test_async_writer_drop_policy():
+    writing = threading.Event()
+    release = threading.Event()
+    written = []
+    def write_batch(records):
+        writing.set()
+        release.wait()
+        written.extend(records)
+    writer = AsyncWriter(write_batch, lambda: None, queue_size=2, policy=POLICY_DROP)
+    writer.put(0)
+    # While the writer thread is busy writing, only queue_size records can wait
+    writing.wait()
+    for index in range(1, 11):
+        writer.put(index)
+    release.set()
+    writer.close()
+    assert writer.dropped == 8
+    assert written == [0, 1, 2]
+
+def test_async_writer_bad_policy():
+    with pytest.raises(ValueError):
+        AsyncWriter(print, print, policy='discard')
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='Requires fork()')
+def test_async_writer_in_forked_child(tmp_path):
+    filename = str(tmp_path / 'fork.log')
+    log_file = RotatingFile(filename, max_bytes=100000, backup_count=1)
+    writer = AsyncWriter(lambda lines: log_file.write(''.join(lines)), log_file.flush)
+    writer.put('parent 1\n')
+    pid = os.fork()
+    if pid == 0:
+        writer.put('child\n')
+        writer.close()
+        os._exit(0)
+    os.waitpid(pid, 0)
+    writer.put('parent 2\n')
+    writer.close()
+    log_file.close()
+
+    with open(filename) as in_file:
+        lines = in_file.read().splitlines()
+    assert sorted(lines) == ['child', 'parent 1', 'parent 2']
+
+def test_rotating_file_rotated_by_another_process(tmp_path):
+    filename = str(tmp_path / 'shared.log')
+    log_file_a = RotatingFile(filename, max_bytes=10, backup_count=3)
+    log_file_b = RotatingFile(filename, max_bytes=10, backup_count=3)
+    log_file_a.write('aaaaaaaa\n')
+    log_file_a.flush()
+    log_file_a.write('bbbbbbbb\n')
+    # log_file_b's tracked size is now stale, and the file it opened has been rotated
+    log_file_b.write('cccccccc\n')
+    log_file_b.write('dddddddd\n')
+    log_file_a.close()
+    log_file_b.close()
+
+    def read(name):
+        with open(str(tmp_path / name)) as in_file:
+            return in_file.read()
+    assert read('shared.log') == 'bbbbbbbb\ndddddddd\n'
+    assert read('shared.log.1') == 'aaaaaaaa\ncccccccc\n'
+    assert not os.path.exists(str(tmp_path / 'shared.log.2'))
+
+def test_handler_with_unopenable_file_is_not_registered(tmp_path):
+    # (excinfo's traceback keeps any half-built handler alive, as at exit)
+    with pytest.raises(OSError) as _excinfo:
+        QueuedRotatingFileHandler(str(tmp_path / 'missing' / 'test.log'), max_bytes=1000, backup_count=1)
+    # No half-built handler was left for logging.shutdown() (at exit) to flush or close
+    handlers = [ref() for ref in logging._handlerList]
+    assert not [
+        handler for handler in handlers
+        if isinstance(handler, QueuedRotatingFileHandler) and not hasattr(handler, '_writer')]
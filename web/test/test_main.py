@@ -0,0 +1,105 @@
+# Standard library
+import os
+import sys
+import shutil
+import subprocess
+import zipfile
+
+# Get the path to the test directory (this file's path)
+test_root_path = os.path.dirname(os.path.realpath(__file__))
+
+# Builds test documents (and starts the default logger, if not already started)
+from test.test_check import build_test_document
+
+HEAVY_MODULES = ('flask', 'werkzeug', 'markdown', 'pandas', 'openpyxl')
+
+def test_check_does_not_import_heavy_modules():
+    # Run in a fresh interpreter, since other tests import these modules
+    script = (
+        'import logging, os, sys\n'
+        'from cascade.quicklog import Quicklog\n'
+        'Quicklog(log_filename=os.path.join({results!r}, "log_main.txt"), logging_level=logging.INFO)\n'
+        'from cascade.main import get_handler\n'
+        'get_handler("check")\n'
+        'print(" ".join(name for name in {heavy!r} if name in sys.modules))\n'
+        ).format(results=os.path.join(test_root_path, 'results'), heavy=HEAVY_MODULES)
+    output = subprocess.check_output(
+        [sys.executable, '-c', script],
+        cwd=os.path.dirname(test_root_path),
+        universal_newlines=True)
+    assert output.strip() == ''
+
+def run_check(tmp_path, *options):
+    document = os.path.join(test_root_path, 'results', 'test_check_normal.docx')
+    os.makedirs(str(tmp_path / 'log'), exist_ok=True)
+    environment = dict(os.environ, PYTHONPATH=os.path.dirname(test_root_path))
+    return subprocess.call(
+        [sys.executable, '-m', 'cascade'] + list(options) + ['check', document],
+        cwd=str(tmp_path),
+        env=environment,
+        stdout=subprocess.DEVNULL)
+
+def test_object_id_index_can_be_disabled(tmp_path):
+    build_test_document('normal')
+
+    assert run_check(tmp_path / 'no_index', '--no-index') == 0
+    assert not os.path.exists(str(tmp_path / 'no_index' / 'index'))
+    assert os.path.isdir(str(tmp_path / 'no_index' / 'cache'))
+
+    assert run_check(tmp_path / 'no_cache', '--no-cache') == 0
+    assert not os.path.exists(str(tmp_path / 'no_cache' / 'index'))
+
+    assert run_check(tmp_path / 'default') == 0
+    assert os.path.isfile(str(tmp_path / 'default' / 'index' / 'object_ids.sqlite'))
+
+def test_aggregate_uses_a_worker_per_cpu_by_default(tmp_path):
+    document = os.path.join(test_root_path, 'results', build_test_document('normal'))
+    os.makedirs(str(tmp_path / 'log'))
+    with zipfile.ZipFile(str(tmp_path / 'documents.zip'), 'w') as zip_file:
+        zip_file.write(document, 'one.docx')
+        zip_file.write(document, 'two.docx')
+    # Run the command line (with no --jobs option) as if on a machine with several CPUs
+    script = (
+        'import os, runpy, sys\n'
+        'os.cpu_count = lambda: 4\n'
+        'sys.argv = ["cascade", "--no-cache", "--format", "csv", "aggregate", "documents.zip"]\n'
+        'runpy.run_module("cascade", run_name="__main__", alter_sys=True)\n')
+    environment = dict(os.environ, PYTHONPATH=os.path.dirname(test_root_path))
+    assert subprocess.call(
+        [sys.executable, '-c', script],
+        cwd=str(tmp_path),
+        env=environment,
+        stdout=subprocess.DEVNULL) == 0
+
+    # Each document was extracted by a worker process, whose log file messages
+    # are labelled with the document's name
+    with open(str(tmp_path / 'log' / 'cascade.log'), encoding='utf-8') as in_file:
+        log = in_file.read()
+    assert '[one.docx] INFO: Checking "one.docx"' in log
+    assert '[two.docx] INFO: Checking "two.docx"' in log
+
+def run_cascade(cwd, *arguments):
+    environment = dict(os.environ, PYTHONPATH=os.path.dirname(test_root_path))
+    return subprocess.call(
+        [sys.executable, '-m', 'cascade'] + list(arguments),
+        cwd=str(cwd),
+        env=environment,
+        stdout=subprocess.DEVNULL)
+
+def test_id_forget(tmp_path):
+    document = os.path.join(test_root_path, 'results', build_test_document('normal'))
+    os.makedirs(str(tmp_path / 'log'))
+    shutil.copy(document, str(tmp_path / 'spec.docx'))
+    shutil.copy(document, str(tmp_path / 'copy.docx'))
+    assert run_cascade(tmp_path, 'check', 'spec.docx', 'copy.docx') == 0
+    # Identical copies don't collide
+    assert run_cascade(tmp_path, 'id-collisions') == 0
+    assert run_cascade(tmp_path, 'id-owner', 'ABC-DEF-001') == 0
+
+    assert run_cascade(tmp_path, 'id-forget', 'spec.docx') == 0
+    # No longer indexed
+    assert run_cascade(tmp_path, 'id-forget', 'spec.docx') == 1
+
+    os.remove(str(tmp_path / 'copy.docx'))
+    assert run_cascade(tmp_path, 'id-forget', '--missing') == 0
+    assert run_cascade(tmp_path, 'id-owner', 'ABC-DEF-001') == 1
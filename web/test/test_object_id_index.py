@@ -0,0 +1,136 @@
+# Standard library
+import os
+import logging
+
+# Local
+from cascade import quicklog
+from cascade.quicklog import Quicklog
+
+# Get the path to the test directory (this file's path)
+test_root_path = os.path.dirname(os.path.realpath(__file__))
+
+# Use the default logger if another test module has already started it
+try:
+    qlog = quicklog.get_logger()
+except ValueError:
+    qlog = Quicklog(
+        log_filename=os.path.join(test_root_path, 'results', 'log.txt'),
+        logging_level=logging.DEBUG)
+
+from cascade.cmd_check import CheckResult
+from cascade import object_id_index
+from cascade.object_id_index import ObjectIdIndex, Collision, split_object_id
+from cascade.util import InputFile
+
+def make_index(name):
+    path = os.path.join(test_root_path, 'results', name)
+    if os.path.exists(path):
+        os.remove(path)
+    return ObjectIdIndex(path)
+
+def make_check_result(next_ids, all_object_ids):
+    object_ids = {prefix: {'next_id': next_id, 'num_unassigned': 0, 'max': -1} for prefix, next_id in next_ids.items()}
+    return CheckResult(True, None, object_ids, {}, all_object_ids)
+
+def test_split_object_id():
+    assert split_object_id('SRD-RCN-0412') == ('SRD-RCN-', 412)
+
+def test_owners_and_collisions():
+    index = make_index('test_object_id_index.sqlite')
+    index.record_document('/a/one.docx', make_check_result({'ABC-': 10}, ['ABC-0001', 'ABC-0002']))
+    index.record_document('/b/two.docx', make_check_result({'ABC-': 20, 'XYZ-': 5}, ['ABC-0002', 'ABC-0015', 'XYZ-0004']))
+    index.record_document('three.docx', make_check_result({'ABC-': 50}, ['ABC-0030', 'ABC-0002']))
+
+    assert index.documents() == ['/a/one.docx', '/b/two.docx', 'three.docx']
+    assert index.owners('ABC-0001') == ['/a/one.docx']
+    assert index.owners('ABC-0002') == ['/a/one.docx', '/b/two.docx', 'three.docx']
+    assert index.owners('ABC-9999') == []
+    assert index.collisions() == [Collision('ABC-0002', ['/a/one.docx', '/b/two.docx', 'three.docx'])]
+    assert index.collisions(['/a/one.docx', '/b/two.docx']) == [Collision('ABC-0002', ['/a/one.docx', '/b/two.docx'])]
+    assert index.collisions(['/a/one.docx']) == []
+
+    overlaps = [(o.prefix, o.document_a, o.range_a, o.document_b, o.range_b) for o in index.next_id_overlaps()]
+    assert overlaps == [
+        ('ABC-', '/a/one.docx', (1, 10), '/b/two.docx', (2, 20)),
+        ('ABC-', '/a/one.docx', (1, 10), 'three.docx', (2, 50)),
+        ('ABC-', '/b/two.docx', (2, 20), 'three.docx', (2, 50)),
+    ]
+
+    # Re-recording a document replaces its entries
+    index.record_document('three.docx', make_check_result({'ABC-': 50}, ['ABC-0030']), digest='1234')
+    assert index.owners('ABC-0002') == ['/a/one.docx', '/b/two.docx']
+    assert [(o.document_a, o.document_b) for o in index.next_id_overlaps()] == [('/a/one.docx', '/b/two.docx')]
+    # ...unless its content (digest) is unchanged
+    index.record_document('three.docx', make_check_result({'ABC-': 50}, []), digest='1234')
+    assert index.owners('ABC-0030') == ['three.docx']
+
+    assert index.forget_document('/b/two.docx') == ['/b/two.docx']
+    assert index.collisions() == []
+    assert index.documents() == ['/a/one.docx', 'three.docx']
+
+def test_same_named_documents_in_different_folders():
+    index = make_index('test_object_id_index_folders.sqlite')
+    index.record_document('a/spec.docx', make_check_result({'ABC-': 10}, ['ABC-0001', 'ABC-0002']))
+    index.record_document('b/spec.docx', make_check_result({'ABC-': 10}, ['ABC-0002', 'ABC-0003']))
+    index.record_document('other.docx', make_check_result({'ABC-': 10}, ['ABC-0003']))
+
+    assert index.documents() == ['a/spec.docx', 'b/spec.docx', 'other.docx']
+    assert index.collisions() == [
+        Collision('ABC-0002', ['a/spec.docx', 'b/spec.docx']),
+        Collision('ABC-0003', ['b/spec.docx', 'other.docx']),
+    ]
+
+def test_document_names(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert object_id_index.document_name(os.path.join('specs', '..', 'spec.docx')) == \
+        os.path.join(str(tmp_path), 'spec.docx').replace(os.sep, '/')
+    assert object_id_index.upload_name('spec.docx', '0123456789abcdef') == 'upload:0123456789ab/spec.docx'
+    assert object_id_index.member_name('/specs/all.zip', 'a/spec.docx') == '/specs/all.zip!/a/spec.docx'
+    # An upload is named by its content
+    upload = InputFile('spec.docx', b'content')
+    assert object_id_index.input_file_document_name(upload) == \
+        object_id_index.input_file_document_name(InputFile('spec.docx', b'content'))
+    assert object_id_index.input_file_document_name(upload) != \
+        object_id_index.input_file_document_name(InputFile('spec.docx', b'other content'))
+    assert object_id_index.input_file_document_name(upload, 'fedcba9876543210') == 'upload:fedcba987654/spec.docx'
+
+def test_documents_with_the_same_content_do_not_collide():
+    index = make_index('test_object_id_index_copies.sqlite')
+    result = make_check_result({'ABC-': 10}, ['ABC-0001', 'ABC-0002'])
+    index.record_document('/specs/spec.docx', result, digest='1111')
+    index.record_document('upload:1111/spec.docx', result, digest='1111')
+    index.record_document('/specs/all.zip!/spec.docx', result, digest='1111')
+    assert index.owners('ABC-0001') == ['/specs/all.zip!/spec.docx', '/specs/spec.docx', 'upload:1111/spec.docx']
+    assert index.count_distinct(index.owners('ABC-0001')) == 1
+    assert index.collisions() == []
+    assert index.next_id_overlaps() == []
+
+    # An edited copy does collide
+    index.record_document('upload:2222/spec.docx', result, digest='2222')
+    assert index.count_distinct(index.owners('ABC-0001')) == 2
+    assert [collision.object_id for collision in index.collisions()] == ['ABC-0001', 'ABC-0002']
+    assert len(index.next_id_overlaps()) == 3
+
+def test_forget_zips_and_missing_documents(tmp_path):
+    index = make_index('test_object_id_index_forget.sqlite')
+    result = make_check_result({'ABC-': 10}, ['ABC-0001'])
+    present = object_id_index.document_name(str(tmp_path / 'present.docx'))
+    present_zip = object_id_index.document_name(str(tmp_path / 'present.zip'))
+    missing = object_id_index.document_name(str(tmp_path / 'missing.docx'))
+    missing_zip = object_id_index.document_name(str(tmp_path / 'missing.zip'))
+    for filename in ('present.docx', 'present.zip'):
+        (tmp_path / filename).write_bytes(b'')
+    for document in (
+            present, missing, 'upload:1111/spec.docx',
+            object_id_index.member_name(present_zip, 'a.docx'),
+            object_id_index.member_name(missing_zip, 'a.docx'),
+            object_id_index.member_name(missing_zip, 'b/b.docx')):
+        index.record_document(document, result)
+
+    assert index.forget_missing() == [missing, missing_zip + '!/a.docx', missing_zip + '!/b/b.docx']
+    assert index.documents() == sorted([present, present_zip + '!/a.docx', 'upload:1111/spec.docx'])
+
+    # Forgetting a zip forgets the documents in it
+    assert index.forget_document(present_zip) == [present_zip + '!/a.docx']
+    assert index.forget_document(present_zip) == []
+    assert index.documents() == sorted([present, 'upload:1111/spec.docx'])
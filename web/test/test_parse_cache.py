@@ -0,0 +1,55 @@
+# Standard library
+import os
+import time
+import logging
+import shutil
+
+# Local
+from cascade import quicklog
+from cascade.quicklog import Quicklog
+
+# Get the path to the test directory (this file's path)
+test_root_path = os.path.dirname(os.path.realpath(__file__))
+
+# Use the default logger if another test module has already started it
+try:
+    qlog = quicklog.get_logger()
+except ValueError:
+    qlog = Quicklog(
+        log_filename=os.path.join(test_root_path, 'results', 'log.txt'),
+        logging_level=logging.DEBUG)
+
+from cascade import parse_cache
+from cascade.parse_cache import ParseCache
+from cascade.word_docx import WordDocx
+from test.test_word_docx import build_document
+
+def make_cache_directory(name):
+    directory = os.path.join(test_root_path, 'results', name)
+    shutil.rmtree(directory, ignore_errors=True)
+    return directory
+
+def test_lru_eviction():
+    cache = ParseCache(make_cache_directory('cache_lru'), max_bytes=3500)
+    for digest in ('a', 'b', 'c'):
+        cache.put(digest, {'data': digest * 1000})
+        time.sleep(0.01)
+    # 'a' becomes the most recently used, so 'b' is evicted next
+    assert cache.get('a') == {'data': 'a' * 1000}
+    cache.put('d', {'data': 'd' * 1000})
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('d') is not None
+
+def test_read_only_document_cached():
+    path = build_document('test_parse_cache.docx')
+    parse_cache.configure(make_cache_directory('cache_docx'))
+    try:
+        first = WordDocx(qlog, path, read_only=True)
+        first.store_check_result('result')
+        second = WordDocx(qlog, path, read_only=True)
+        assert second.cached_check_result == 'result'
+        assert [d.as_dict for d in second._directives] == [d.as_dict for d in first._directives]
+        assert list(second.paragraph_texts()) == list(first.paragraph_texts())
+    finally:
+        parse_cache.configure(None, enabled=False)
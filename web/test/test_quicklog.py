@@ -0,0 +1,86 @@
+# Standard library
+import os
+import logging
+import threading
+
+# Local
+from cascade.quicklog import Quicklog
+
+# Get the path to the test directory (this file's path)
+test_root_path = os.path.dirname(os.path.realpath(__file__))
+
+class Unformattable():
+    def __str__(self):
+        raise AssertionError('Message was formatted')
+
+LOG_FILENAME = os.path.join(test_root_path, 'results', 'log_quicklog.txt')
+
+def make_logger(logging_level):
+    if os.path.exists(LOG_FILENAME):
+        os.remove(LOG_FILENAME)
+    return Quicklog(
+        log_filename=LOG_FILENAME,
+        logging_level=logging_level,
+        logger_name='test_quicklog')
+
+def test_disabled_levels_are_not_formatted():
+    qlog = make_logger(logging.INFO)
+    try:
+        def fail():
+            raise AssertionError('Message callable was called')
+        qlog.debug(fail)
+        qlog.debug('Value: %s', Unformattable())
+        assert qlog.get_count(logging.DEBUG) == 2
+    finally:
+        qlog.stop()
+
+def test_lazy_messages_are_formatted():
+    qlog = make_logger(logging.DEBUG)
+    try:
+        qlog.start_print_capture(echo=False)
+        qlog.debug(lambda: 'Called {}'.format(1))
+        qlog.info('Found %d directives in "%s"', 3, 'doc.docx')
+        qlog.warning('Literal 100% (no args)')
+        qlog.lprint('Done: %s', 'ok')
+        output = qlog.stop_print_capture()
+    finally:
+        qlog.stop()
+
+    assert output.splitlines() == [
+        '\x1b[33mWARNING\x1b[39m: Literal 100% (no args)',
+        'Done: ok',
+    ]
+    with open(LOG_FILENAME, encoding='utf-8') as in_file:
+        log_text = in_file.read()
+    assert 'DEBUG: Called 1' in log_text
+    assert 'INFO: Found 3 directives in "doc.docx"' in log_text
+
+def test_scopes_are_private_to_threads():
+    qlog = make_logger(logging.INFO)
+    try:
+        started = threading.Barrier(4)
+        reports = {}
+        def run_request(name):
+            with qlog.scope():
+                qlog.start_print_capture(echo=False)
+                started.wait()
+                for index in range(50):
+                    qlog.lprint('%s %d', name, index)
+                qlog.warning('%s done', name)
+                reports[name] = (qlog.stop_print_capture(), qlog.get_count(logging.WARNING))
+        threads = [threading.Thread(target=run_request, args=(name,)) for name in 'abcd']
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        qlog.error('Outside any scope')
+        default_counts = (qlog.get_count(logging.WARNING), qlog.get_count(logging.ERROR))
+    finally:
+        qlog.stop()
+
+    for name, (report, warnings) in reports.items():
+        lines = report.splitlines()
+        assert lines[:-1] == ['{} {}'.format(name, index) for index in range(50)]
+        assert lines[-1].endswith('{} done'.format(name))
+        assert warnings == 1
+    assert default_counts == (0, 1)
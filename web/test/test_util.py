@@ -1,6 +1,12 @@
 import pytest
 
-from cascade.util import make_json, get_requirement_id
+# Starts the default logger (if not already started)
+import test.test_check
+
+from cascade.util import make_json, get_requirement_id, get_validator, validate_json
+from cascade import quicklog
+
+qlog = quicklog.get_logger()
 
 @pytest.mark.parametrize("req_text, req_id", [
     # Positives
@@ -66,4 +72,36 @@ def test_get_requirement_id_strict(req_text, req_id):
 
 def test_get_requirement_id_fuzzy(req_text, req_id):
     r = get_requirement_id(req_text, fuzzy=True)
-    assert r == req_id
\ No newline at end of file
+    assert r == req_id
+
+SCHEMA = {
+    "title": "#shortform",
+    "type": "object",
+    "properties": {
+        "id": {"type": "string"},
+        "method": {"type": "string", "enum": ["A", "I", "T"]}
+    },
+    "required": ["id", "method"]
+}
+
+def test_validators_are_cached_by_schema():
+    validator = get_validator(SCHEMA)
+    assert get_validator(SCHEMA) is validator
+    # An equal schema (e.g. the same schema declared in another document) shares the validator
+    assert get_validator(dict(SCHEMA)) is validator
+
+def test_validate_json():
+    assert validate_json({"id": "ABC-001", "method": "T"}, SCHEMA)
+    assert validate_json({"id": "ABC-001", "method": "T"}, SCHEMA, collect_all=True)
+    assert not validate_json({"id": 1, "method": "X"}, SCHEMA)
+    assert not validate_json({"id": 1, "method": "X"}, SCHEMA, collect_all=True)
+
+    # Every error is logged, with its path
+    qlog.start_print_capture(echo=False)
+    validate_json({"id": 1, "method": "X"}, SCHEMA, collect_all=True)
+    output = qlog.stop_print_capture()
+    assert 'JSON Validation Failed (2 errors)' in output
+    assert "   id: 1 is not of type 'string'" in output
+    assert "   method: 'X' is not one of ['A', 'I', 'T']" in output
+    errors = list(get_validator(SCHEMA).iter_errors({"id": 1, "method": "X"}))
+    assert len(errors) == 2
@@ -0,0 +1,223 @@
+# Standard library
+import os
+import logging
+import zipfile
+
+# Libraries
+from docx import Document
+from docx.enum.style import WD_STYLE_TYPE
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+
+# Local
+from cascade import quicklog
+from cascade.quicklog import Quicklog
+
+# Get the path to the test directory (this file's path)
+test_root_path = os.path.dirname(os.path.realpath(__file__))
+
+# Use the default logger if another test module has already started it
+try:
+    qlog = quicklog.get_logger()
+except ValueError:
+    qlog = Quicklog(
+        log_filename=os.path.join(test_root_path, 'results', 'log.txt'),
+        logging_level=logging.DEBUG)
+
+from cascade.word_docx import WordDocx, heading_level_from_style_name
+
+def build_document(filename):
+    document = Document(os.path.join(test_root_path, 'hidden_style_master.docx'))
+    document.add_heading('Section One', level=1)
+    document.add_paragraph('${"#document_info":{"object_ids":[{"prefix":"ABC-DEF-", "next_id":100}],', style='Cascade Hidden Directive')
+    document.add_paragraph('"schemas":[]}}$', style='Cascade Hidden Directive')
+    document.add_paragraph('${"id":"ABC-DEF-001", "method":"I"}$', style='Cascade Directive')
+    paragraph = document.add_paragraph('First line')
+    paragraph.add_run().add_break()
+    paragraph.add_run('\tSecond line')
+    document.add_heading('Section Two', level=2)
+    document.add_paragraph('${"id":"ABC-DEF-?", "method":"T"}$', style='Cascade Directive')
+    document.add_paragraph('Requirement text.')
+    document.add_paragraph('Last paragraph.')
+    path = os.path.join(test_root_path, 'results', filename)
+    document.save(path)
+    return path
+
+def test_scan_paragraphs_matches_python_docx():
+    doc = WordDocx(qlog, build_document('test_word_docx_scan.docx'))
+    scanned = list(doc.scan_paragraphs())
+    assert len(scanned) == len(doc.paragraphs)
+    for (element, text, style_id), paragraph in zip(scanned, doc.paragraphs):
+        assert element is paragraph._p
+        assert text == paragraph.text
+        assert doc.get_style_name(style_id) == paragraph.style.name
+        assert doc.get_style_heading_level(style_id) == heading_level_from_style_name(paragraph.style.name)
+
+def test_find_directives():
+    doc = WordDocx(qlog, build_document('test_word_docx_directives.docx'))
+    assert len(doc._directives) == 3
+    assert '#document_info' in doc.doc_info_directive.as_dict
+    assert len(doc.doc_info_directive.paragraphs) == 2
+    assert [r.directive.as_dict['id'] for r in doc.requirements] == ['ABC-DEF-001', 'ABC-DEF-?']
+    assert doc.requirements[0].heading_text == 'Section One'
+    assert doc.requirements[0].req_text == 'First line\n\tSecond line'
+    assert doc.requirements[1].heading_text == 'Section Two'
+    assert doc.requirements[1].req_text == 'Requirement text.\nLast paragraph.'
+
+def test_directive_records_are_compact():
+    doc = WordDocx(qlog, build_document('test_word_docx_compact.docx'))
+    directive = doc.requirements[0].directive
+    assert not hasattr(directive, '__dict__')
+    assert type(directive.as_dict) is dict
+    # Paragraph proxies are created on demand, over the directive's elements
+    assert [paragraph._p for paragraph in directive.paragraphs] == list(directive.elements)
+    assert directive.paragraphs[0].text == directive.texts[0]
+
+def test_heading_levels_from_outline_level():
+    document = Document(os.path.join(test_root_path, 'hidden_style_master.docx'))
+    outline_style = document.styles.add_style('Custom Outline', WD_STYLE_TYPE.PARAGRAPH)
+    outline_style.element.get_or_add_pPr().append(parse_xml('<w:outlineLvl {} w:val="2"/>'.format(nsdecls('w'))))
+    derived_style = document.styles.add_style('Derived Outline', WD_STYLE_TYPE.PARAGRAPH)
+    derived_style.base_style = outline_style
+    body_style = document.styles.add_style('Body Outline', WD_STYLE_TYPE.PARAGRAPH)
+    body_style.element.get_or_add_pPr().append(parse_xml('<w:outlineLvl {} w:val="9"/>'.format(nsdecls('w'))))
+    document.add_heading('Heading', level=2)
+    document.add_paragraph('Outline', style='Custom Outline')
+    document.add_paragraph('Derived', style='Derived Outline')
+    document.add_paragraph('Body', style='Body Outline')
+    document.add_paragraph('Normal')
+    path = os.path.join(test_root_path, 'results', 'test_word_docx_outline.docx')
+    document.save(path)
+
+    doc = WordDocx(qlog, path)
+    levels = [doc.get_heading_level(paragraph) for paragraph in doc.paragraphs[-5:]]
+    assert levels == [2, 3, 3, None, None]
+    assert doc.get_style_name(None) == 'Normal'
+    assert doc.get_style_name('NoSuchStyle') == 'Normal'
+
+def test_unnumbered_heading_styles():
+    assert heading_level_from_style_name('Heading 3') == 3
+    assert heading_level_from_style_name('Appendix_A_Level_2') == 2
+    assert heading_level_from_style_name('Heading') is None
+    assert heading_level_from_style_name('Heading Unnumbered') is None
+    assert heading_level_from_style_name('Appendix_A_Level_X') is None
+
+    document = Document(os.path.join(test_root_path, 'hidden_style_master.docx'))
+    document.styles.add_style('Heading Unnumbered', WD_STYLE_TYPE.PARAGRAPH)
+    document.add_heading('Numbered', level=1)
+    document.add_paragraph('Unnumbered', style='Heading Unnumbered')
+    path = os.path.join(test_root_path, 'results', 'test_word_docx_unnumbered_heading.docx')
+    document.save(path)
+
+    doc = WordDocx(qlog, path)
+    assert [doc.get_heading_level(paragraph) for paragraph in doc.paragraphs[-2:]] == [1, None]
+    doc = WordDocx(qlog, path, read_only=True)
+    assert doc.has_style('Heading Unnumbered')
+
+def test_paragraph_index_tracks_inserts_and_deletes():
+    doc = WordDocx(qlog, build_document('test_word_docx_index.docx'))
+    original = list(doc.paragraphs)
+
+    # Insert after every original paragraph but the last, walking forward
+    for paragraph in original[:-1]:
+        doc.insert_paragraph(paragraph, 'Inserted')
+    doc.insert_paragraph_before(original[0], 'First')
+    doc.delete_paragraph(original[1])
+
+    body_elements = [element for element, _text, _style_id in doc.scan_paragraphs()]
+    assert [paragraph._p for paragraph in doc.paragraphs] == body_elements
+    for index, paragraph in enumerate(doc.paragraphs):
+        assert doc.get_paragraph_index(paragraph) == index
+    assert doc.get_next_paragrah(doc.paragraphs[-1]) == (None, None)
+
+    doc.resync_paragraphs()
+    assert doc.get_paragraph_index(doc.paragraphs[5]) == 5
+
+def test_rewrite_directives_in_place():
+    doc = WordDocx(qlog, build_document('test_word_docx_rewrite.docx'))
+    requirement = doc.requirements[1].directive
+    requirement_element = requirement.paragraphs[0]._p
+    requirement.as_dict['id'] = 'ABC-DEF-0100'
+    doc_info = doc.doc_info_directive
+    doc_info.as_dict['#document_info']['object_ids'][0]['next_id'] = 101
+    num_paragraphs = len(doc.paragraphs)
+
+    assert doc.rewrite_directives([requirement, doc_info]) == 1
+    # The shortform directive was patched in place. The doc info directive
+    # changed from 2 lines to many, so its paragraphs were replaced.
+    assert requirement.paragraphs[0]._p is requirement_element
+    assert requirement.paragraphs[0].text == '${"id":"ABC-DEF-0100", "method":"T"}$'
+    assert requirement.paragraphs[0].style.name == 'Cascade Directive'
+    assert len(doc.paragraphs) > num_paragraphs
+
+    doc.save(os.path.join(test_root_path, 'results', 'test_word_docx_rewrite_out.docx'))
+    reloaded = WordDocx(qlog, os.path.join(test_root_path, 'results', 'test_word_docx_rewrite_out.docx'))
+    assert [d.as_dict for d in reloaded._directives] == [d.as_dict for d in doc._directives]
+
+def test_tokens_shared_by_directives_and_clusters():
+    doc = WordDocx(qlog, build_document('test_word_docx_tokens.docx'))
+    tokens = doc.tokenize()
+    assert doc.tokenize() is tokens
+    assert [token.end - token.start for token in tokens if token.token_type == 'directive'] == [2, 1, 1]
+    assert sum(token.end - token.start for token in tokens) == len(doc.paragraphs)
+
+    clusters = doc.get_clusters()
+    assert [c['cluster_type'] for c in clusters] == [token.token_type for token in tokens]
+    directive_clusters = [c for c in clusters if c['cluster_type'] == 'directive']
+    assert directive_clusters[1]['directive'] == {'#shortform': doc._directives[1].as_dict}
+    assert [c['heading_level'] for c in clusters if c['cluster_type'] == 'heading'] == [1, 2]
+
+    # Modifying the document discards the cached tokens
+    doc.insert_paragraph(doc.paragraphs[0], 'New paragraph')
+    assert doc.tokenize() is not tokens
+    assert len(doc.get_clusters()) == len(clusters) + 1
+
+def test_read_only_matches_full_load():
+    path = build_document('test_word_docx_read_only.docx')
+    full = WordDocx(qlog, path)
+    read_only = WordDocx(qlog, path, read_only=True)
+
+    assert read_only.paragraphs is None
+    assert list(read_only.paragraph_texts()) == [paragraph.text for paragraph in full.paragraphs]
+    assert [d.as_dict for d in read_only._directives] == [d.as_dict for d in full._directives]
+    assert [(d.texts, d.style_ids) for d in read_only._directives] == [(d.texts, d.style_ids) for d in full._directives]
+    assert read_only.doc_info_directive.as_dict == full.doc_info_directive.as_dict
+    assert [(r.heading_text, r.req_text) for r in read_only.requirements] == [
+        (r.heading_text, r.req_text) for r in full.requirements]
+    assert read_only.has_style('Cascade Directive')
+    assert read_only.count_change_tracking() == full.count_change_tracking() == (0, 0)
+
+def test_read_only_counts_change_tracking():
+    document = Document(os.path.join(test_root_path, 'hidden_style_master.docx'))
+    paragraph = document.add_paragraph('Tracked')
+    paragraph._p.append(parse_xml(
+        '<w:ins {} w:id="1" w:author="A"><w:r><w:t>new</w:t></w:r></w:ins>'.format(nsdecls('w'))))
+    paragraph._p.append(parse_xml(
+        '<w:del {} w:id="2" w:author="A"><w:r><w:delText>old</w:delText></w:r></w:del>'.format(nsdecls('w'))))
+    document.add_paragraph('Last paragraph.')
+    path = os.path.join(test_root_path, 'results', 'test_word_docx_change_tracking.docx')
+    document.save(path)
+
+    assert WordDocx(qlog, path).count_change_tracking() == (1, 1)
+    assert WordDocx(qlog, path, read_only=True).count_change_tracking() == (1, 1)
+
+def test_save_copies_unchanged_members():
+    path = build_document('test_word_docx_save.docx')
+    out_path = os.path.join(test_root_path, 'results', 'test_word_docx_save_out.docx')
+    doc = WordDocx(qlog, path)
+    doc.paragraphs[-1].text = 'Changed paragraph.'
+    doc.save(out_path, compress_level=9)
+
+    with zipfile.ZipFile(path) as source_zip, zipfile.ZipFile(out_path) as out_zip:
+        assert out_zip.testzip() is None
+        assert sorted(out_zip.namelist()) == sorted(source_zip.namelist())
+        source_info = source_zip.getinfo('word/styles.xml')
+        out_info = out_zip.getinfo('word/styles.xml')
+        assert (out_info.CRC, out_info.compress_size, out_info.date_time) == (
+            source_info.CRC, source_info.compress_size, source_info.date_time)
+        assert out_zip.getinfo('word/document.xml').CRC != source_zip.getinfo('word/document.xml').CRC
+    assert [p.text for p in WordDocx(qlog, out_path).paragraphs] == [p.text for p in doc.paragraphs]
+
+    # Saving over the source document
+    doc.save(path)
+    assert WordDocx(qlog, path).paragraphs[-1].text == 'Changed paragraph.'
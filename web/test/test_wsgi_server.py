@@ -0,0 +1,32 @@
+# Standard library
+import importlib.util
+import sys
+import pytest
+
+# Starts the default logger (if not already started)
+import test.test_check
+
+from cascade import wsgi_server
+from cascade.custom_exceptions import FatalUserError
+
+def test_gunicorn_options():
+    options = wsgi_server.gunicorn_options('0.0.0.0', 5001, workers=3, threads=4, max_requests=1000)
+    assert options['bind'] == '0.0.0.0:5001'
+    assert options['workers'] == 3
+    assert options['worker_class'] == 'gthread'
+    assert options['preload_app'] is True
+    assert (options['max_requests'], options['max_requests_jitter']) == (1000, 100)
+
+    options = wsgi_server.gunicorn_options('127.0.0.1', 5001, workers=2, threads=1, max_requests=0)
+    assert options['worker_class'] == 'sync'
+    assert (options['max_requests'], options['max_requests_jitter']) == (0, 0)
+
+def test_preload_command_modules():
+    wsgi_server.preload_command_modules()
+    assert 'cascade.cmd_aggregate' in sys.modules
+    assert 'docx' in sys.modules
+
+@pytest.mark.skipif(importlib.util.find_spec('gunicorn') is not None, reason='gunicorn is installed')
+def test_serve_requires_gunicorn():
+    with pytest.raises(FatalUserError, match='gunicorn'):
+        wsgi_server.serve(None, '127.0.0.1', 5001, 1, 1, 0)